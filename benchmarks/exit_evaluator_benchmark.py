@@ -0,0 +1,101 @@
+"""
+Benchmark controller tick batch processing of legs waiting for exit, with exit evaluator vs trade function of every leg
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from collections import defaultdict
+from datetime import datetime, date
+from datetime import time as dt_time
+
+# Scripts are run as python benchmarks/<script>.py, project folder is added so trading_bot can be imported
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import trading_bot.controller as controller_module
+from trading_bot.controller import Controller
+from trading_bot.trade_managers.exit_evaluator import ExitEvaluator
+from trading_bot.trade_managers.opt_trade_manager import OptTradeManager
+
+
+class Client:
+    """
+    Client accepting all modifications
+    """
+    user_id = 'BENCH'
+    all_orders = []
+
+    @staticmethod
+    def modify_order(variety, order_id, **kwargs):
+        return order_id
+
+
+class Streamer:
+    """
+    Streamer having order updates of entry and pending exit orders of legs
+    """
+    def __init__(self, managers: list):
+        self.orders_queue = defaultdict(list)
+        self.updated_symbols = set()
+        for obj in managers:
+            self.orders_queue[obj.symbol] = [{'order_id': obj.entry_order_id, 'status': 'COMPLETE'},
+                                             {'order_id': obj.exit_order_id, 'status': 'TRIGGER PENDING'}]
+
+
+def make_managers(legs: int, trail_sl: bool) -> list:
+    """
+    :return: list of short legs with exit order placed
+    """
+    managers = []
+    for i in range(legs):
+        managers.append(OptTradeManager(
+            symbol=f'OPT{i}', instrument_token=i + 1, exchange='NFO', underlying_symbol='NIFTY 50', client=Client,
+            lot_size=75, lots=1, direction='SHORT', stop_loss=25, end_time=dt_time(15, 20), trail_sl=trail_sl,
+            entered=True, entry_order_filled=True, exit_pending=True, sold=True, instruction='BUY', qty=75,
+            entry_order_id=str(i), exit_order_id=str(legs + i), entry_price=100.0, sl=125.0, final_sl=125.0,
+            exit_order_price=125.0))
+    return managers
+
+
+def make_batches(legs: int, count: int) -> list:
+    """
+    :return: list of tick batches having tick of every leg, 10% of legs are in profit and trail sl
+    """
+    now = datetime.now()
+    prices = [100.0 + random.uniform(0, 5) if i % 10 else 95.0 for i in range(legs)]
+    return [[{'instrument_token': i + 1, 'last_price': round(p + random.uniform(-0.5, 0.5), 2), 'last_trade_time': now}
+             for i, p in enumerate(prices)] for _ in range(count)]
+
+
+def measure(legs: int, batches: list, exit_evaluator: ExitEvaluator = None) -> float:
+    """
+    :return: average seconds per tick batch
+    """
+    managers = make_managers(legs, trail_sl=True)
+    controller = Controller(streamer=Streamer(managers), trade_managers=managers, client=Client,
+                            exit_evaluator=exit_evaluator)
+    now = datetime.combine(date.today(), dt_time(10))
+    start = time.perf_counter()
+    for ticks in batches:
+        controller.run(ticks, now=now)
+    return (time.perf_counter() - start) / len(batches)
+
+
+def run(legs_list: list, count: int):
+    # Modifications are not stored in db
+    controller_module.save_trade = lambda action, params: None
+    for legs in legs_list:
+        batches = make_batches(legs, count)
+        loop = measure(legs, batches)
+        vectorized = measure(legs, batches, ExitEvaluator())
+        print(f'legs: {legs}, trade function per leg: {loop * 1000:.2f} ms/batch, '
+              f'exit evaluator: {vectorized * 1000:.2f} ms/batch, speedup: {loop / vectorized:.1f}x')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark exit evaluator')
+    parser.add_argument('--legs', type=int, nargs='+', default=[10, 100, 300, 1000], help='number of legs')
+    parser.add_argument('--batches', type=int, default=200, help='tick batches per measurement')
+    args = parser.parse_args()
+    run(args.legs, args.batches)
@@ -0,0 +1,90 @@
+"""
+Benchmark implied volatility and delta of full option chains, vectorized solver vs per option loop
+"""
+import argparse
+import math
+import os
+import sys
+import time
+
+import numpy as np
+
+# Scripts are run as python benchmarks/<script>.py, project folder is added so trading_bot can be imported
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from trading_bot.strategies.greeks import bs_price, chain_deltas
+
+# Underlying price, strike step and number of expiries of synthetic chains
+CHAINS = {'NIFTY': (25000, 50, 12), 'BANKNIFTY': (55000, 100, 8)}
+RATE = 0.07
+
+
+def make_chain(spot: float, step: float, expiries: int) -> list:
+    """
+    :return: list of (strikes, prices, is_call, t) per expiry, strikes cover +/- 20% of spot
+    """
+    strikes = np.arange(round(spot * 0.8 / step) * step, spot * 1.2, step)
+    strikes = np.concatenate([strikes, strikes])
+    is_call = np.arange(len(strikes)) < len(strikes) // 2
+    chain = []
+    for e in range(expiries):
+        t = (2 + 7 * e) / 365
+        sigma = 0.12 + 0.3 * np.abs(np.log(strikes / spot))
+        chain.append((strikes, bs_price(spot, strikes, t, RATE, sigma, is_call), is_call, t))
+    return chain
+
+
+def scalar_delta(spot, strike, price, is_call, t):
+    """
+    Per option newton solver used as baseline
+    """
+    def price_vega(sigma):
+        d1 = (math.log(spot / strike) + (RATE + 0.5 * sigma * sigma) * t) / (sigma * math.sqrt(t))
+        d2 = d1 - sigma * math.sqrt(t)
+        cdf1, cdf2 = 0.5 * (1 + math.erf(d1 / math.sqrt(2))), 0.5 * (1 + math.erf(d2 / math.sqrt(2)))
+        call = spot * cdf1 - strike * math.exp(-RATE * t) * cdf2
+        value = call if is_call else call - spot + strike * math.exp(-RATE * t)
+        return value, spot * math.exp(-0.5 * d1 * d1) / math.sqrt(2 * math.pi) * math.sqrt(t), cdf1
+
+    sigma, low, high = 0.2, 1e-4, 5.0
+    for _ in range(30):
+        value, vega, cdf1 = price_vega(sigma)
+        diff = value - price
+        if abs(diff) < 1e-4:
+            break
+        if diff > 0:
+            high = sigma
+        else:
+            low = sigma
+        newton = sigma - diff / vega if vega > 1e-8 else -1
+        sigma = newton if low < newton < high else (low + high) / 2
+    return cdf1 if is_call else cdf1 - 1
+
+
+def run(repeat: int):
+    for name, (spot, step, expiries) in CHAINS.items():
+        chain = make_chain(spot, step, expiries)
+        num_options = sum(len(c[0]) for c in chain)
+
+        start = time.perf_counter()
+        for _ in range(repeat):
+            for strikes, prices, is_call, t in chain:
+                chain_deltas(spot, strikes, prices, is_call, t, RATE)
+        vectorized = (time.perf_counter() - start) / repeat
+
+        start = time.perf_counter()
+        for strikes, prices, is_call, t in chain:
+            for k, p, c in zip(strikes, prices, is_call):
+                scalar_delta(spot, k, p, c, t)
+        scalar = time.perf_counter() - start
+
+        print(f'{name}: options: {num_options}, expiries: {expiries}, '
+              f'vectorized: {vectorized * 1000:.2f} ms ({num_options / vectorized:,.0f} options/s), '
+              f'loop: {scalar * 1000:.2f} ms ({num_options / scalar:,.0f} options/s), '
+              f'speedup: {scalar / vectorized:.1f}x')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark option chain implied volatility and delta')
+    parser.add_argument('--repeat', type=int, default=20, help='vectorized runs to average')
+    run(parser.parse_args().repeat)
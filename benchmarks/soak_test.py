@@ -0,0 +1,322 @@
+"""
+Soak test of full trading session at accelerated speed against simulated market and client,
+reports memory over time and fails if memory grows more than budget after warm up
+"""
+import argparse
+import gc
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+from collections import defaultdict
+from datetime import datetime, date, timedelta
+from datetime import time as dt_time
+
+# Scripts are run as python benchmarks/<script>.py, project folder is added so trading_bot can be imported
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import trading_bot.controller as controller_module
+from trading_bot.controller import Controller
+from trading_bot.settings import logger
+from trading_bot.streamers.kite_streamer import KiteStreamer
+
+# Session of 6.25 hours from market open
+SESSION_START = dt_time(9, 15)
+SESSION_HOURS = 6.25
+
+
+def rss_mb() -> float:
+    """
+    :return: resident set size of process in MB, peak resident size where current size is not available
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss / 2 ** 20
+    except ImportError:
+        pass
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2 ** 20 if sys.platform == 'darwin' else peak / 2 ** 10
+
+
+class SimMarket:
+    def __init__(self, streamer: KiteStreamer, seed: int = 1):
+        """
+        SimMarket class to move option prices as random walk and fill orders, order updates are sent to streamer
+        as json messages like kite websocket
+        :param streamer: streamer receiving ticks and order updates
+        :param seed: random seed
+        """
+        self.streamer = streamer
+        self.random = random.Random(seed)
+        self.prices = dict()
+        self.symbols = dict()
+        self.open_orders = dict()
+        self.positions = defaultdict(int)
+        self.order_id = 0
+        self.now = None
+
+    def add_instrument(self, instrument_token: int, symbol: str, price: float):
+        """
+        Start moving price of instrument
+        """
+        self.prices[instrument_token] = price
+        self.symbols[symbol] = instrument_token
+
+    def send_update(self, order: dict, status: str, average_price: float = 0.0):
+        """
+        Send order update to streamer
+        """
+        message = {'order_id': order['order_id'], 'tradingsymbol': order['tradingsymbol'], 'status': status,
+                   'price': order.get('price'), 'trigger_price': order.get('trigger_price'),
+                   'average_price': average_price}
+        self.streamer.on_message(None, json.dumps(message))
+
+    def fill(self, order: dict, price: float):
+        """
+        Fill order at price and update position
+        """
+        self.open_orders.pop(order['order_id'], None)
+        qty = order['quantity'] if order['transaction_type'] == 'BUY' else -order['quantity']
+        self.positions[order['tradingsymbol']] += qty
+        self.send_update(order, 'COMPLETE', average_price=price)
+
+    def place_order(self, **kwargs) -> str:
+        """
+        Fill order at last price, stop loss orders wait for trigger
+        """
+        self.order_id += 1
+        order = dict(kwargs, order_id=str(self.order_id))
+        price = self.prices[self.symbols[order['tradingsymbol']]]
+        self.send_update(order, 'OPEN')
+        if order['order_type'] == 'SL':
+            self.open_orders[order['order_id']] = order
+            self.send_update(order, 'TRIGGER PENDING')
+        else:
+            self.fill(order, price)
+        return order['order_id']
+
+    def modify_order(self, order_id: str, price: float = None, trigger_price: float = None,
+                     order_type: str = None) -> str:
+        """
+        Modify trigger of stop loss order or fill it if order type is changed to market
+        """
+        order = self.open_orders.get(order_id)
+        if order is None:
+            return
+        if order_type == 'MARKET':
+            self.fill(order, self.prices[self.symbols[order['tradingsymbol']]])
+            return order_id
+        order['price'], order['trigger_price'] = price, trigger_price
+        self.send_update(order, 'TRIGGER PENDING')
+        return order_id
+
+    def cancel_order(self, order_id: str) -> str:
+        """
+        Cancel open order
+        """
+        order = self.open_orders.pop(order_id, None)
+        if order is None:
+            return
+        self.send_update(order, 'CANCELLED')
+        return order_id
+
+    def step(self, now: datetime) -> list:
+        """
+        Move prices, trigger stop loss orders and return tick batch
+        :param now: simulated time
+        :return: list of ticks of all instruments
+        """
+        self.now = now
+        for token, price in self.prices.items():
+            self.prices[token] = round(max(price * (1 + self.random.gauss(0, 0.002)), 0.05), 2)
+        for order in list(self.open_orders.values()):
+            price = self.prices[self.symbols[order['tradingsymbol']]]
+            if (order['transaction_type'] == 'BUY' and price >= order['trigger_price']) or \
+                    (order['transaction_type'] == 'SELL' and price <= order['trigger_price']):
+                self.fill(order, price)
+        return [{'instrument_token': token, 'last_price': price, 'last_trade_time': now}
+                for token, price in self.prices.items()]
+
+
+class SimClient:
+    def __init__(self, market: SimMarket):
+        """
+        SimClient class providing trading client functions used by controller and trade managers
+        :param market: simulated market
+        """
+        self.market = market
+        self.user_id = 'SOAK'
+        self.tick_sizes = dict()
+        self.all_orders = []
+
+    def place_order(self, **kwargs):
+        return self.market.place_order(**kwargs)
+
+    def modify_order(self, variety: str, order_id: str, **kwargs):
+        return self.market.modify_order(order_id, **kwargs)
+
+    def get_positions(self) -> list:
+        return [{'tradingsymbol': s, 'quantity': q} for s, q in self.market.positions.items()]
+
+    def cancel_order(self, variety: str, order_id: str):
+        return self.market.cancel_order(order_id)
+
+    def get_orders(self) -> list:
+        return [dict(o, status='TRIGGER PENDING') for o in self.market.open_orders.values()]
+
+    def get_ltp(self, params: str) -> dict:
+        ltps = dict()
+        for key in params.strip('&').split('&'):
+            key = key[2:]
+            token = self.market.symbols.get(key.split(':', 1)[-1])
+            if token is not None:
+                ltps[key] = {'last_price': self.market.prices[token]}
+        return ltps
+
+
+class SimStreamer(KiteStreamer):
+    def start_streaming(self):
+        """
+        Ticks and order updates are sent by simulated market
+        """
+        pass
+
+    def subscribe(self, instruments: list):
+        """
+        Ticks are sent for all instruments of simulated market
+        """
+        self.subscribed_instruments.update(instruments)
+
+
+def run_session(args) -> int:
+    """
+    Run simulated session and report memory
+    :return: exit code, 1 if memory growth is over budget
+    """
+    logger.setLevel(args.log_level)
+    # Trades are counted instead of writing to db
+    saved = defaultdict(int)
+    controller_module.save_trade = lambda action, params: saved.__setitem__(action, saved[action] + 1)
+
+    streamer = SimStreamer(user_id='SOAK', ws_token='')
+    market = SimMarket(streamer, seed=args.seed)
+    client = SimClient(market)
+    exit_evaluator = None
+    if args.exit_evaluator:
+        from trading_bot.trade_managers.exit_evaluator import ExitEvaluator
+        exit_evaluator = ExitEvaluator()
+    controller = Controller(streamer=streamer, trade_managers=[], client=client, exit_evaluator=exit_evaluator)
+
+    start = datetime.combine(date.today(), SESSION_START)
+    end = start + timedelta(hours=args.hours)
+    step = timedelta(seconds=args.interval)
+    sample_every = timedelta(minutes=args.sample_minutes)
+    next_batch, next_sample = start + timedelta(minutes=5), start
+    flatten_at = datetime.combine(start.date(), args.flatten_at) if args.flatten_at is not None else None
+    baseline, baseline_snapshot, batch = None, None, 0
+    run_time, runs = 0.0, 0
+    rows = []
+
+    tracemalloc.start(args.frames)
+    started = time.monotonic()
+    now = start
+    print(f'{"time":>8} {"rss MB":>8} {"traced MB":>10} {"managers":>9} {"tokens":>7} {"orders":>7} '
+          f'{"queued":>7} {"run ms":>7}')
+    while now <= end:
+        # New straddle batch at interval until hour before close, each batch trades new strikes
+        if now >= next_batch and now < end - timedelta(hours=1):
+            next_batch += timedelta(minutes=args.batch_minutes)
+            batch += 1
+            instruments = []
+            for opt_type in ['CE', 'PE']:
+                token = batch * 10 + len(instruments)
+                symbol = f'NIFTY{batch:03d}{opt_type}'
+                market.add_instrument(token, symbol, price=100 + market.random.uniform(-20, 20))
+                instruments.append({'tradingsymbol': symbol, 'instrument_token': token, 'exchange': 'NFO',
+                                    'underlying_symbol': 'NIFTY 50', 'direction': 'SHORT', 'lot_size': 75, 'lots': 1,
+                                    'stop_loss': args.stop_loss, 'trail_sl': batch % 2 == 0, 'tick_size': 0.05,
+                                    'end_time': min(now + timedelta(minutes=90), end - timedelta(minutes=5)).time()})
+            streamer.subscribe([i['instrument_token'] for i in instruments])
+            controller.add_instruments('NIFTY 50', instruments)
+
+        streamer.put_ticks(market.step(now))
+        if flatten_at is not None and now >= flatten_at:
+            flatten_at = None
+            controller.flatten('flatten_time')
+        controller.check_flatten()
+        controller.run_timers(now)
+        if len(controller.trade_managers):
+            t0 = time.perf_counter()
+            controller.run(now=now)
+            run_time += time.perf_counter() - t0
+            runs += 1
+
+        if now >= next_sample:
+            next_sample += sample_every
+            gc.collect()
+            traced = tracemalloc.get_traced_memory()[0] / 2 ** 20
+            row = (now.strftime('%H:%M'), rss_mb(), traced)
+            rows.append(row)
+            orders = sum(len(o) for o in streamer.orders_queue.values())
+            print(f'{row[0]:>8} {row[1]:>8.1f} {row[2]:>10.2f} {len(controller.trade_managers):>9} '
+                  f'{len(streamer.subscribed_instruments):>7} {orders:>7} {streamer.ticks_queue.qsize():>7} '
+                  f'{run_time / max(runs, 1) * 1000:>7.3f}')
+            run_time, runs = 0.0, 0
+            # Baseline is taken after warm up so caches and first allocations are not counted as growth
+            if baseline is None and now >= start + timedelta(minutes=args.warmup_minutes):
+                baseline, baseline_snapshot = row, tracemalloc.take_snapshot()
+        now += step
+
+    gc.collect()
+    snapshot = tracemalloc.take_snapshot()
+    traced = tracemalloc.get_traced_memory()[0] / 2 ** 20
+    rss = rss_mb()
+    tracemalloc.stop()
+    print(f'\nsimulated {args.hours} hours in {round(time.monotonic() - started, 1)} s, batches: {batch}, '
+          f'trade actions: {dict(saved)}, tick batches dropped: {streamer.ticks_dropped}')
+    if baseline is None:
+        print('session ended before warm up, no memory growth measured')
+        return 0
+
+    print(f'\ntop {args.top} allocators grown since {baseline[0]}:')
+    filters = [tracemalloc.Filter(False, tracemalloc.__file__)]
+    stats = snapshot.filter_traces(filters).compare_to(baseline_snapshot.filter_traces(filters), 'lineno')
+    for stat in stats[:args.top]:
+        print(f'  {stat}')
+
+    traced_growth, rss_growth = traced - baseline[2], rss - baseline[1]
+    print(f'\ntraced memory growth: {traced_growth:.2f} MB (budget {args.budget_mb} MB), '
+          f'rss growth: {rss_growth:.2f} MB (budget {args.rss_budget_mb} MB)')
+    if traced_growth > args.budget_mb or rss_growth > args.rss_budget_mb:
+        print('FAILED: memory grew more than budget')
+        return 1
+    print('PASSED')
+    return 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--hours', type=float, default=SESSION_HOURS, help='simulated session length in hours')
+    parser.add_argument('--interval', type=float, default=1.0, help='simulated seconds between tick batches')
+    parser.add_argument('--batch-minutes', type=int, default=20, help='minutes between new straddle batches')
+    parser.add_argument('--stop-loss', type=float, default=25, help='stop loss percent of legs')
+    parser.add_argument('--sample-minutes', type=int, default=15, help='simulated minutes between memory samples')
+    parser.add_argument('--warmup-minutes', type=int, default=30, help='simulated minutes before baseline')
+    parser.add_argument('--budget-mb', type=float, default=8, help='allowed growth of traced memory')
+    parser.add_argument('--rss-budget-mb', type=float, default=32, help='allowed growth of resident memory')
+    parser.add_argument('--top', type=int, default=10, help='number of allocators reported')
+    parser.add_argument('--frames', type=int, default=1, help='traceback frames stored by tracemalloc')
+    parser.add_argument('--exit-evaluator', action='store_true', help='skip legs waiting for exit with arrays')
+    parser.add_argument('--flatten-at', type=lambda v: datetime.strptime(v, '%H:%M').time(),
+                        help='simulated time to exit all positions at once i.e. 14:00')
+    parser.add_argument('--log-level', default='WARNING', help='bot log level during session')
+    parser.add_argument('--seed', type=int, default=1, help='random seed of price moves')
+    sys.exit(run_session(parser.parse_args()))
@@ -1,10 +1,18 @@
+import argparse
+import json
 import warnings
 import time
+from datetime import datetime, timedelta
 
+import numpy as np
 import pandas as pd
+from dateutil.parser import parse
+from openpyxl import Workbook
+from sqlalchemy import select
 
-from trading_bot.database.db import engine
-from trading_bot.settings import logger, BASE_DIR
+from trading_bot.database.archive import list_archives, get_archive_engine
+from trading_bot.database.db import engine, TradesData
+from trading_bot.settings import logger, BASE_DIR, TRADE_STORE
 
 warnings.filterwarnings('ignore')
 
@@ -12,43 +20,235 @@ warnings.filterwarnings('ignore')
 Metrics to export db data of closed positions to excel
 """
 
+STATE_FILE = BASE_DIR / 'metrics_state.json'
+DAILY_METRICS_FILE = BASE_DIR / 'daily_metrics.csv'
+CHUNK_SIZE = 5000
 
-def calc_gross(entry_val: float, exit_val: float, side: str):
+
+def calc_gross(entry_val: pd.Series, exit_val: pd.Series, side: pd.Series) -> np.ndarray:
     """"
-    :param entry_val: entry value
-    :param exit_val: exit value
-    :param side: side
-    :return: gross profit
+    :param entry_val: entry values
+    :param exit_val: exit values
+    :param side: sides
+    :return: gross profits
     """
-    return exit_val - entry_val if side.upper() == 'BUY' else entry_val - exit_val
+    return np.where(side.str.upper() == 'BUY', exit_val - entry_val, entry_val - exit_val)
 
 
-def generate_metrics():
+def calc_pnl(df: pd.DataFrame) -> pd.DataFrame:
     """
-    Generate metrics and export it to trade_results.xlsx file
+    Add entry value, exit value and gross profit columns
+    :param df: trades dataframe
+    :return: trades dataframe
     """
-    df = pd.read_sql('trades_data', engine)
-    # df = df[df['position_status'] == "CLOSED"]
-    if not len(df):
-        logger.debug('No positions yet')
-        return
+    for c in ['entry_price', 'exit_price', 'entry_order_price', 'exit_order_price', 'stop_loss',
+              'final_stop_loss', 'stop_loss_percent']:
+        df[c] = pd.to_numeric(df[c], errors='coerce')
     df['entry_value'] = df['entry_price'] * df['quantity']
     df['exit_value'] = df['exit_price'] * df['quantity']
-    df['gross_profit'] = df[['entry_value', 'exit_value', 'side']].apply(lambda x: calc_gross(*x), axis=1)
-    del df['instruction']
-
-    df = df.round(2)
-    df = df.sort_values(by='entry_time', ascending=True)
-    df.index = df['entry_time']
-    df.index.names = ['index']
-    df['entry_time'] = df['entry_time'].astype(str)
-    df['exit_time'] = df['exit_time'].astype(str)
-    total_gross = df["gross_profit"].sum()
-    df.loc["total_net"] = pd.Series([total_gross], index=['gross_profit'])
-    df.to_excel(BASE_DIR / 'trade_results.xlsx', index=False)
-    logger.info('results generated, check trade_results.xlsx file for it')
+    df['gross_profit'] = calc_gross(df['entry_value'], df['exit_value'], df['side'])
+    return df
+
+
+def read_trades(start_date=None, end_date=None, closed_after=None):
+    """
+    Read trades in chunks from monthly archives and current trades table, filters are applied in sql
+    :param start_date: include trades entered on or after start date
+    :param end_date: include trades entered on or before end date
+    :param closed_after: include only closed trades exited at or after this time
+    :return: iterator of trades dataframes ordered by entry time
+    """
+    table = TradesData.__table__
+    query = select(table).order_by(table.c.entry_time.is_(None), table.c.entry_time)
+    if start_date is not None:
+        query = query.where(table.c.entry_time >= start_date)
+    if end_date is not None:
+        query = query.where(table.c.entry_time < end_date + timedelta(days=1))
+    if closed_after is not None:
+        query = query.where(table.c.position_status == 'CLOSED', table.c.exit_time >= closed_after)
+    # Trades are archived by entry month and trades exit on entry day
+    months = list_archives(start_date=start_date if start_date is not None else
+                           closed_after.date() if closed_after is not None else None, end_date=end_date)
+    parse_dates = ['entry_order_time', 'entry_time', 'exit_order_time', 'exit_time']
+    for month in months:
+        # Archive engines are created per read, their pooled connections are closed once archive is read
+        archive_engine = get_archive_engine(month)
+        try:
+            yield from pd.read_sql(query, archive_engine, chunksize=CHUNK_SIZE, parse_dates=parse_dates)
+        finally:
+            archive_engine.dispose()
+    yield from pd.read_sql(query, engine, chunksize=CHUNK_SIZE, parse_dates=parse_dates)
+
+
+class CsvExport:
+    def __init__(self, path):
+        """
+        Write only csv export
+        :param path: file path
+        """
+        self.path = path
+        self.header = True
+
+    def write(self, df: pd.DataFrame):
+        df.to_csv(self.path, mode='w' if self.header else 'a', header=self.header, index=False)
+        self.header = False
+
+    def close(self):
+        pass
+
+
+class XlsxExport:
+    def __init__(self, path):
+        """
+        Write only excel export, rows are streamed to file without keeping worksheet in memory
+        :param path: file path
+        """
+        self.path = path
+        self.workbook = Workbook(write_only=True)
+        self.sheet = self.workbook.create_sheet()
+        self.header = True
+
+    def write(self, df: pd.DataFrame):
+        if self.header:
+            self.sheet.append(list(df.columns))
+            self.header = False
+        for row in df.astype(object).where(df.notna(), None).itertuples(index=False):
+            self.sheet.append(list(row))
+
+    def close(self):
+        self.workbook.save(self.path)
+
+
+class ParquetExport:
+    def __init__(self, path):
+        """
+        Parquet export, each chunk is written as row group, requires pyarrow
+        :param path: file path
+        """
+        import pyarrow
+        import pyarrow.parquet
+        self.pa = pyarrow
+        self.path = path
+        self.writer = None
+
+    def write(self, df: pd.DataFrame):
+        table = self.pa.Table.from_pandas(df, preserve_index=False)
+        if self.writer is None:
+            self.writer = self.pa.parquet.ParquetWriter(self.path, table.schema)
+        self.writer.write_table(table.cast(self.writer.schema))
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+
+
+EXPORTS = {'xlsx': XlsxExport, 'csv': CsvExport, 'parquet': ParquetExport}
+
+
+def generate_metrics(start_date=None, end_date=None, file_format: str = 'xlsx'):
+    """
+    Generate metrics and export it to trade_results file
+    :param start_date: include trades entered on or after start date
+    :param end_date: include trades entered on or before end date
+    :param file_format: export format i.e. xlsx, csv or parquet
+    """
+    file_name = f'trade_results.{file_format}'
+    try:
+        export = EXPORTS[file_format](BASE_DIR / file_name)
+    except ImportError as e:
+        logger.exception(e)
+        logger.debug(f'Install pyarrow to export results in {file_format} format')
+        return
+
+    total_gross, num_trades = 0, 0
+    for df in read_trades(start_date=start_date, end_date=end_date):
+        df = calc_pnl(df)
+        del df['instruction']
+        df = df.round(2)
+        df['entry_time'] = df['entry_time'].astype(str)
+        df['exit_time'] = df['exit_time'].astype(str)
+        total_gross += df['gross_profit'].sum()
+        num_trades += len(df)
+        export.write(df)
+        columns = df.columns
+
+    if not num_trades:
+        logger.debug('No positions yet')
+        return
+    # Add total row
+    export.write(pd.DataFrame([{'gross_profit': round(total_gross, 2)}], columns=columns))
+    export.close()
+    logger.info(f'results generated, check {file_name} file for it')
     time.sleep(5)
 
 
+def generate_daily_metrics():
+    """
+    Update day wise metrics in daily_metrics.csv file, only trades closed since last run are processed
+    """
+    # Exit time of last processed trade and keys of trades processed with that exit time, trades closed at
+    # same time but stored after last run are not skipped and processed trades are not counted again
+    try:
+        with open(STATE_FILE) as f:
+            state = json.load(f)
+        last_exit_time = parse(state['last_exit_time'])
+        last_keys = {tuple(k) for k in state.get('last_keys', [])}
+    except (FileNotFoundError, KeyError, ValueError):
+        last_exit_time, last_keys = None, set()
+
+    daily = []
+    for df in read_trades(closed_after=last_exit_time if last_exit_time is not None else datetime.min):
+        if len(last_keys):
+            df = df[[(s, o) not in last_keys for s, o in zip(df['symbol'], df['entry_order_id'])]]
+            if not len(df):
+                continue
+        df = calc_pnl(df)
+        df['date'] = df['exit_time'].dt.date
+        df['winners'] = df['gross_profit'] > 0
+        df['losers'] = df['gross_profit'] < 0
+        daily.append(df.groupby('date').agg(trades=('symbol', 'size'), winners=('winners', 'sum'),
+                                            losers=('losers', 'sum'), gross_profit=('gross_profit', 'sum')))
+        # Chunks are ordered by entry time so watermark is advanced across chunks
+        chunk_last_exit_time = df['exit_time'].max()
+        chunk_last = df[df['exit_time'] == chunk_last_exit_time]
+        chunk_keys = set(zip(chunk_last['symbol'], chunk_last['entry_order_id']))
+        if last_exit_time is None or chunk_last_exit_time > last_exit_time:
+            last_exit_time, last_keys = chunk_last_exit_time, chunk_keys
+        elif chunk_last_exit_time == last_exit_time:
+            last_keys |= chunk_keys
+
+    if not len(daily):
+        logger.debug('No new closed positions since last run')
+        return
+
+    # Merge new trades with already stored days
+    try:
+        stored = pd.read_csv(DAILY_METRICS_FILE)
+        stored['date'] = pd.to_datetime(stored['date']).dt.date
+        daily.append(stored.set_index('date'))
+    except FileNotFoundError:
+        pass
+    daily = pd.concat(daily).groupby(level=0).sum().sort_index().round(2)
+    daily.index.name = 'date'
+    daily.to_csv(DAILY_METRICS_FILE)
+    with open(STATE_FILE, 'w') as f:
+        json.dump({'last_exit_time': str(last_exit_time), 'last_keys': sorted(last_keys)}, f)
+    logger.info('daily metrics updated, check daily_metrics.csv file for it')
+
+
 if __name__ == '__main__':
-    generate_metrics()
+    parser = argparse.ArgumentParser(description='Export trades and metrics')
+    parser.add_argument('--start-date', type=lambda x: parse(x).date(), help='first entry date to include')
+    parser.add_argument('--end-date', type=lambda x: parse(x).date(), help='last entry date to include')
+    parser.add_argument('--format', choices=list(EXPORTS), default='xlsx', help='export file format')
+    parser.add_argument('--daily', action='store_true', help='update day wise metrics of newly closed trades')
+    args = parser.parse_args()
+    if TRADE_STORE == 'journal':
+        # Bring trades table up to date with journals before reading it
+        from trading_bot.database.journal import materialize_pending, replay, journal_path
+        materialize_pending()
+        replay(journal_path())
+    if args.daily:
+        generate_daily_metrics()
+    else:
+        generate_metrics(start_date=args.start_date, end_date=args.end_date, file_format=args.format)
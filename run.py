@@ -4,6 +4,9 @@ Entry point of trading bot
 if __name__ == '__main__':
     kwargs = {i: j for i, j in locals().items() if not i.startswith('__')}
 
+    import time
+    started = time.perf_counter()
+
     from trading_bot.controller import run
 
-    run()
+    run(started=started)
@@ -0,0 +1,131 @@
+import os
+import pickle
+import threading
+import time
+from datetime import date
+
+from trading_bot.settings import logger, CHECKPOINTS_DIR, CHECKPOINT_INTERVAL
+
+"""
+Checkpoints of controller state written in background, used to resume trading instances
+and pending batches after restart on same day
+"""
+
+# Checkpoints of other versions are ignored
+CHECKPOINT_VERSION = 1
+
+
+def checkpoint_path():
+    """
+    :return: path of checkpoint file
+    """
+    return CHECKPOINTS_DIR / 'state.pickle'
+
+
+def write_checkpoint(state: dict, path=None):
+    """
+    Write checkpoint to temporary file and replace previous checkpoint with it,
+    so checkpoint file is always complete even if process stops while writing
+    :param state: controller state
+    :param path: path of checkpoint file
+    """
+    path = path if path is not None else checkpoint_path()
+    if not os.path.exists(path.parent):
+        os.makedirs(path.parent)
+    temp_path = path.with_suffix('.tmp')
+    with open(temp_path, 'wb') as f:
+        pickle.dump({'version': CHECKPOINT_VERSION, **state}, f, protocol=pickle.HIGHEST_PROTOCOL)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, path)
+
+
+def load_checkpoint(path=None):
+    """
+    :param path: path of checkpoint file
+    :return: controller state if checkpoint of today exists else None
+    """
+    path = path if path is not None else checkpoint_path()
+    if not os.path.exists(path):
+        return
+    try:
+        with open(path, 'rb') as f:
+            state = pickle.load(f)
+    except Exception as e:
+        logger.exception(e)
+        logger.debug(f'Could not read checkpoint: {path}')
+        return
+    if state.get('version') != CHECKPOINT_VERSION or state.get('date') != date.today():
+        logger.debug(f'Checkpoint of {state.get("date")} ignored')
+        return
+    return state
+
+
+class Checkpointer:
+    def __init__(self, interval: float = CHECKPOINT_INTERVAL, path=None):
+        """
+        Checkpointer class to write submitted states in background thread, if states are submitted
+        faster than they are written then only latest state is written
+        :param interval: seconds between checkpoints
+        :param path: path of checkpoint file
+        """
+        self.interval = interval
+        self.path = path if path is not None else checkpoint_path()
+        self.state = None
+        self.lock = threading.Lock()
+        self.event = threading.Event()
+        self.submit_time = time.monotonic()
+        self.written = 0
+        self.stopped = False
+        self.thread = threading.Thread(target=self.write, name='checkpoint')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def due(self) -> bool:
+        """
+        :return: True if interval has passed since last submitted state
+        """
+        return time.monotonic() - self.submit_time >= self.interval
+
+    def submit(self, state: dict):
+        """
+        Submit state to be written, state must not be modified afterwards
+        :param state: controller state
+        """
+        with self.lock:
+            self.state = state
+            self.submit_time = time.monotonic()
+        self.event.set()
+
+    def write(self):
+        """
+        Write latest submitted state until stopped
+        """
+        while True:
+            self.event.wait()
+            self.event.clear()
+            with self.lock:
+                state, self.state = self.state, None
+            if state is not None:
+                started = time.perf_counter()
+                try:
+                    write_checkpoint(state, self.path)
+                    self.written += 1
+                    if self.written == 1:
+                        logger.debug('First checkpoint written in %.1f ms, size: %s bytes',
+                                     (time.perf_counter() - started) * 1000, os.path.getsize(self.path))
+                except Exception as e:
+                    logger.exception(e)
+            if self.stopped and self.state is None:
+                return
+
+    def stop(self, state: dict = None):
+        """
+        Write final state if given and stop writer thread
+        :param state: controller state
+        """
+        if state is not None:
+            self.submit(state)
+        self.stopped = True
+        self.event.set()
+        self.thread.join(timeout=5)
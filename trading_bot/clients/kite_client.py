@@ -1,16 +1,28 @@
-from typing import Union
-from datetime import date, timedelta
+from __future__ import annotations
+
+import json
+import os
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from threading import RLock, Thread
+from typing import Union, TYPE_CHECKING
+from datetime import date, datetime, timedelta
 from json.decoder import JSONDecodeError
 
 import requests
+from requests.adapters import HTTPAdapter
 import pyotp
-import pandas as pd
 from dateutil.parser import parse
 
-from kiteconnect import KiteConnect
-from kiteconnect.exceptions import DataException
+from trading_bot.clients.rate_limiter import RateLimiter
+from trading_bot.settings import logger, TZ, SESSIONS_DIR, SESSION_CHECK_INTERVAL, ORDER_RATE_LIMIT, \
+    SESSION_RETRY_DELAY, SESSION_MAX_FAILURES
 
-from trading_bot.settings import logger
+# numpy and pandas are imported by data methods so they don't slow down startup
+if TYPE_CHECKING:
+    import pandas as pd
+    from trading_bot.database.candle_store import CandleStore
 
 """
 Kite rest client to handle api requests to kite connect
@@ -18,18 +30,21 @@ Kite rest client to handle api requests to kite connect
 
 
 class KiteClient:
-    def __init__(self, user_id: str, password: str, mfa_secret_key: str, api_key: str = 'xyz'):
+    def __init__(self, user_id: str, password: str, mfa_secret_key: str, api_key: str = 'xyz',
+                 candle_store: CandleStore = None):
         """
         KiteClient class to handle trading api endpoints functions
         :param user_id: zerodha kite user id
         :param password: zerodha kitepassword
         :param pin: zerodha kite pin
         :param api_key:
+        :param candle_store: candle store to cache historical data, data is always fetched from api if None
         """
         self.user_id = user_id
         self.password = password
         self.mfa_secret_key = mfa_secret_key
         self.api_key = api_key
+        self.candle_store = candle_store
         self.ws_url = 'wss://ws.zerodha.com'
         self.ua_string = 'user-agent=kite3-web&version=2.6.2'
         self.key_string = 'kitefront'
@@ -41,20 +56,166 @@ class KiteClient:
         self.headers = {
             'user-agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X x.y; rv:42.0) Gecko/20100101 Firefox/42.0'
         }
-        # Initialize KiteConnect
-        self.rest_client = KiteConnect(api_key=self.api_key)
+        # Keep alive connections for api requests, pool is sized for concurrent order requests
+        self.http = requests.Session()
+        self.http.mount('https://', HTTPAdapter(pool_connections=4, pool_maxsize=20))
+        # KiteConnect is created when instruments are loaded, kiteconnect package is slow to import
+        self.rest_client = None
         # Kite available exchanges
         self.available_exchanges = ['NFO', 'NSE', 'CDS', 'MCX']
 
         # Variables for storing exchange, instruments and orders data
         self.exchange_dict = dict()
         self.all_instruments = list()
+        self.tick_sizes = dict()
         self.ws_token = None
         self.all_orders = []
+        # Callbacks called with new websocket token when session changes i.e. set_token of streamers
+        self.session_listeners = []
+
+        # Rate limiters for kite api endpoints
+        self.data_rate_limiter = RateLimiter(rate=3)
+        self.order_rate_limiter = RateLimiter(rate=ORDER_RATE_LIMIT)
+
+        # Only one thread logs in at a time, login_time tells waiting threads session was refreshed
+        self.login_lock = RLock()
+        self.login_time = 0
+        self.session_date = None
+        # Set by session refresh thread when session could not be refreshed, trading is stopped by main thread
+        self.session_failed = False
+        self.session_path = SESSIONS_DIR / f'{self.user_id}.json'
+
+    def login(self, force: bool = False):
+        """
+        Login to kite, session saved earlier today is reused if it's still valid
+        :param force: login with credentials even if saved session is valid
+        """
+        with self.login_lock:
+            if not force and self.load_session() and self.validate_session():
+                logger.debug(f'Using saved session for {self.user_id}')
+                return
+            self.authenticate()
+            self.save_session()
+
+    def relogin(self):
+        """
+        Login again after failed request, session refreshed by another thread while waiting for lock
+        or still accepted by kite is reused
+        """
+        requested = time.monotonic()
+        with self.login_lock:
+            if self.login_time > requested:
+                return
+            if self.validate_session() is False:
+                self.login(force=True)
 
-    def login(self):
+    def validate_session(self):
         """
-        Login to kite
+        Check session using profile endpoint
+        :return: True if session is valid, False if rejected by kite, None if it couldn't be checked
+        """
+        try:
+            res = self.http.get(f"{self.root_trade_url}/user/profile", headers=self.headers, timeout=5)
+        except requests.RequestException as e:
+            logger.debug(f'Error validating session: {e}')
+            return
+        if res.status_code == 200:
+            return True
+        if res.status_code in (401, 403):
+            return False
+
+    def set_session(self, auth: str, csrf_token: str, created: datetime = None):
+        """
+        Set session tokens in request headers and websocket token
+        :param auth: authorization header i.e. enctoken xyz
+        :param csrf_token: csrf token
+        :param created: session creation time, current time if None
+        """
+        self.session_date = (created or datetime.now(tz=TZ)).date()
+        self.headers['x-csrftoken'] = csrf_token
+        self.headers['authorization'] = auth
+        ws_token = auth.split()[1].replace('/', '%2F').replace('+', '%2B').replace('=', '%3D')
+        changed = ws_token != self.ws_token
+        self.ws_token = ws_token
+        self.login_time = time.monotonic()
+        if changed:
+            for callback in self.session_listeners:
+                try:
+                    callback(ws_token)
+                except Exception as e:
+                    logger.exception(e)
+
+    def add_session_listener(self, callback):
+        """
+        Register callback to be called with new websocket token when session changes
+        :param callback: function taking websocket token
+        """
+        self.session_listeners.append(callback)
+
+    def load_session(self) -> bool:
+        """
+        Load session saved today, kite sessions expire every day
+        :return: True if session loaded else False
+        """
+        try:
+            with open(self.session_path) as f:
+                session = json.load(f)
+            created = datetime.fromisoformat(session['created'])
+            if created.date() != datetime.now(tz=TZ).date():
+                return False
+            self.set_session(session['authorization'], session['csrf_token'], created)
+            return True
+        except (OSError, ValueError, KeyError):
+            return False
+
+    def save_session(self):
+        """
+        Save session tokens, file is readable by owner only
+        """
+        try:
+            os.makedirs(SESSIONS_DIR, exist_ok=True)
+            session = {'user_id': self.user_id, 'authorization': self.headers['authorization'],
+                       'csrf_token': self.headers['x-csrftoken'], 'created': datetime.now(tz=TZ).isoformat()}
+            fd = os.open(self.session_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with open(fd, 'w') as f:
+                json.dump(session, f)
+        except (OSError, KeyError) as e:
+            logger.debug(f'Error saving session: {e}')
+
+    def start_session_refresh(self, interval: float = SESSION_CHECK_INTERVAL):
+        """
+        Start thread to validate session periodically and login again before requests fail
+        :param interval: seconds between checks
+        """
+        def refresh():
+            failures = 0
+            delay = interval
+            while True:
+                time.sleep(delay)
+                try:
+                    # Kite sessions expire every day
+                    if self.session_date != datetime.now(tz=TZ).date() or self.validate_session() is False:
+                        logger.debug(f'Session expired for {self.user_id}, logging in again')
+                        self.login(force=True)
+                    failures, delay = 0, interval
+                except (Exception, SystemExit) as e:
+                    # Failed login exits which would only end this thread, login is retried instead
+                    failures += 1
+                    if failures >= SESSION_MAX_FAILURES:
+                        logger.critical(f'Session refresh failed {failures} times for {self.user_id}, '
+                                        f'stopping trading')
+                        self.session_failed = True
+                        return
+                    delay = min(SESSION_RETRY_DELAY * 2 ** (failures - 1), interval)
+                    logger.error(f'Session refresh failed for {self.user_id}: {e!r}, retrying in {delay} s')
+
+        thread = Thread(target=refresh)
+        thread.daemon = True
+        thread.start()
+
+    def authenticate(self):
+        """
+        Login to kite using credentials and two factor authentication
         """
         try:
             with requests.session() as s:
@@ -72,9 +233,7 @@ class KiteClient:
                 auth = res.headers['Set-Cookie'].split(",")[2].split(';')[0].replace(" ", "").replace("enctoken=",
                                                                                                       "enctoken ")
                 csrf_token = res.headers['Set-Cookie'].split(";")[0].replace("public_token=", "")
-                self.headers['x-csrftoken'] = csrf_token
-                self.headers['authorization'] = auth
-                self.ws_token = auth.split()[1].replace('/', '%2F').replace('+', '%2B').replace('=', '%3D')
+                self.set_session(auth, csrf_token)
         except Exception as e:
             logger.exception(e)
             logger.debug("Error connecting with kite, please try again later")
@@ -87,12 +246,12 @@ class KiteClient:
         """
         for i in range(2):
             try:
-                all_orders = requests.get(f"{self.root_trade_url}/orders", headers=self.headers)
+                all_orders = self.http.get(f"{self.root_trade_url}/orders", headers=self.headers)
                 self.all_orders = all_orders.json()['data']
                 return self.all_orders
             except Exception as e:
                 logger.exception(e)
-                self.login()
+                self.relogin()
 
     def get_positions(self) -> dict:
         """
@@ -101,11 +260,11 @@ class KiteClient:
         """
         for i in range(2):
             try:
-                all_positions = requests.get(f"{self.root_trade_url}/portfolio/positions", headers=self.headers)
+                all_positions = self.http.get(f"{self.root_trade_url}/portfolio/positions", headers=self.headers)
                 return all_positions.json()['data']['day']
             except Exception as e:
                 logger.exception(e)
-                self.login()
+                self.relogin()
 
     def place_order(self, variety: str, tradingsymbol: str, quantity: str, transaction_type: str,
                     trigger_price: float = None, price: float = None,
@@ -137,12 +296,13 @@ class KiteClient:
         params = {i: j for i, j in params.items() if j is not None}
         for i in range(2):
             try:
-                order_details = requests.post(f"{self.root_trade_url}/orders/{variety}", headers=self.headers,
+                self.order_rate_limiter.acquire()
+                order_details = self.http.post(f"{self.root_trade_url}/orders/{variety}", headers=self.headers,
                                               data=params)
                 return order_details.json()['data']['order_id']
             except Exception as e:
                 logger.exception(e)
-                self.login()
+                self.relogin()
 
     def modify_order(self, variety: str, order_id: str, price: float = None, trigger_price: float = None,
                      quantity: int = None, parent_order_id: str = None, order_type: str = None, validity: str = None,
@@ -166,13 +326,14 @@ class KiteClient:
         params = {i: j for i, j in params.items() if j is not None}
         for i in range(2):
             try:
-                order_details = requests.put(f"{self.root_trade_url}/orders/{variety}/{order_id}",
+                self.order_rate_limiter.acquire()
+                order_details = self.http.put(f"{self.root_trade_url}/orders/{variety}/{order_id}",
                                              headers=self.headers, data=params)
                 logger.debug(order_details.text)
                 return order_details.json()['data']['order_id']
             except Exception as e:
                 logger.exception(e)
-                self.login()
+                self.relogin()
 
     def cancel_order(self, variety: str, order_id: str, parent_order_id: str = None) -> str:
         """
@@ -186,12 +347,13 @@ class KiteClient:
         del params['self']
         for i in range(2):
             try:
-                order_details = requests.delete(f"{self.root_trade_url}/orders/{variety}/{order_id}",
+                self.order_rate_limiter.acquire()
+                order_details = self.http.delete(f"{self.root_trade_url}/orders/{variety}/{order_id}",
                                                 headers=self.headers, data=params)
                 return order_details.json()['data']['order_id']
             except Exception as e:
                 logger.exception(e)
-                self.login()
+                self.relogin()
 
     @staticmethod
     def get_date_range(start_date, end_date):
@@ -205,45 +367,155 @@ class KiteClient:
             start_date = start_date + timedelta(days=61)
         return date_ranges
 
-    def get_data(self, symbol, token, start_date, end_date, time_frame):
+    def fetch_candles(self, symbol: str, token: int, start_date: str, end_date: str, time_frame: str):
+        """
+        Fetch candles for single date window
+        :param symbol: trading symbol
+        :param token: instrument token
+        :param start_date: window start date
+        :param end_date: window end date
+        :param time_frame: candle time frame i.e. minute, day etc
+        :return: list of candles if retrieved successfully else None
+        """
+        for i in range(2):
+            try:
+                self.data_rate_limiter.acquire()
+                res = self.http.get(
+                    f"{self.data_url}/{token}/{time_frame}?user_id={self.user_id}&oi=1&from={start_date}"
+                    f"&to={end_date}&ciqrandom={self.random_id}", headers=self.headers)
+                return res.json()['data']['candles']
+            except (TypeError, KeyError, JSONDecodeError):
+                logger.debug(f"Error getting data for {symbol} for {start_date} to {end_date}, trying again")
+                self.relogin()
+            except requests.RequestException as e:
+                # Network errors fail only this window, other windows of bulk request continue
+                logger.debug(f"Error getting data for {symbol} for {start_date} to {end_date}: {e}, trying again")
+        logger.debug(f"Error getting data for {symbol} for {start_date} to {end_date}")
+
+    @staticmethod
+    def candles_to_columns(candles: list) -> dict:
+        """
+        Convert raw candles to typed columns
+        :param candles: list of candles i.e. [timestamp, open, high, low, close, volume, oi]
+        :return: dict of column name and numpy array
+        """
+        import numpy as np
+        import pandas as pd
+        timestamps = pd.to_datetime([c[0] for c in candles]).tz_localize(None)
+        values = np.array([c[1:6] for c in candles], dtype=np.float64)
+        return {'datetime': timestamps.values, 'open': values[:, 0], 'high': values[:, 1], 'low': values[:, 2],
+                'close': values[:, 3], 'volume': values[:, 4].astype(np.int64)}
+
+    @staticmethod
+    def columns_to_frame(chunks: list) -> pd.DataFrame:
+        """
+        Join typed column chunks to dataframe
+        :param chunks: list of column dicts in date order
+        :return: dataframe with datetime index and open, high, low, close, volume columns
+        """
+        import numpy as np
+        import pandas as pd
+        if not len(chunks):
+            return pd.DataFrame(columns=["open", "high", "low", "close", "volume"],
+                                index=pd.DatetimeIndex([], name='datetime'))
+        columns = {k: np.concatenate([c[k] for c in chunks]) for k in chunks[0]}
+        index = pd.DatetimeIndex(columns.pop('datetime'), name='datetime')
+        return pd.DataFrame(columns, index=index, columns=["open", "high", "low", "close", "volume"])
+
+    def get_bulk_data(self, instruments: dict, start_date, end_date, time_frame, max_workers: int = 3) -> dict:
+        """
+        Get historical data for many instruments, date windows of all instruments are fetched
+        concurrently within historical api rate limit
+        :param instruments: dict of instrument token and symbol
+        :param start_date: start date
+        :param end_date: end date
+        :param time_frame: candle time frame i.e. minute, day etc
+        :param max_workers: number of concurrent requests
+        :return: dict of instrument token and dataframe, dataframe is None if data not retrieved
+                 and empty if no candles found for given range
+        """
         date_ranges = self.get_date_range(start_date, end_date)
-        all_results = []
         if not len(date_ranges):
+            return {token: self.columns_to_frame([]) for token in instruments}
+
+        chunks = defaultdict(dict)
+        failed = set()
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {executor.submit(self.fetch_candles, symbol, token, st_dt, en_dt, time_frame): (token, st_dt)
+                       for token, symbol in instruments.items() for st_dt, en_dt in date_ranges}
+            # Convert each window to typed columns as soon as it arrives
+            for future in as_completed(futures):
+                token, st_dt = futures[future]
+                candles = future.result()
+                if candles is None:
+                    failed.add(token)
+                elif len(candles):
+                    chunks[token][st_dt] = self.candles_to_columns(candles)
+
+        return {token: None if token in failed else
+                self.columns_to_frame([chunks[token][st_dt] for st_dt in sorted(chunks[token])])
+                for token in instruments}
+
+    def get_data(self, symbol, token, start_date, end_date, time_frame):
+        """
+        Get historical data
+        :param symbol: trading symbol
+        :param token: instrument token
+        :param start_date: start date
+        :param end_date: end date
+        :param time_frame: candle time frame i.e. minute, day etc
+        :return: dataframe if data retrieved successfully else None
+        """
+        if self.candle_store is None:
+            df = self.get_bulk_data({token: symbol}, start_date, end_date, time_frame)[token]
+        else:
+            df = self.get_cached_data(symbol, token, start_date, end_date, time_frame)
+        if df is None:
             return
-        for st_dt, en_dt in date_ranges:
-            for i in range(2):
-                try:
-                    res = requests.get(
-                        f"{self.data_url}/{token}/{time_frame}?user_id={self.user_id}&oi=1&from={st_dt}&to={en_dt}"
-                        f"&ciqrandom={self.random_id}", headers=self.headers)
-                    res = res.json()['data']['candles']
-                    break
-                except (TypeError, KeyError, JSONDecodeError):
-                    logger.debug(f"Error getting data for {symbol} for {st_dt} to {en_dt}, trying again")
-                    self.login()
-            else:
-                logger.debug(f"Error getting data for {symbol} for {st_dt} to {en_dt}")
-                return
-            all_results.extend(res)
-        if not len(all_results):
+        if not len(df):
             logger.debug(f"Empty data for {symbol}")
             return
-        df = pd.DataFrame(all_results)
-        df[0] = pd.to_datetime(df[0])
-        df[0] = df[0].dt.tz_localize(None)
-        df.index = df[0]
-        df.index.name = 'datetime'
-        df = df[[1, 2, 3, 4, 5]]
-        df.columns = ["open", "high", "low", "close", "volume"]
         return df
 
+    def get_cached_data(self, symbol, token, start_date, end_date, time_frame):
+        """
+        Get historical data from candle store, only ranges missing in store are fetched from api
+        :param symbol: trading symbol
+        :param token: instrument token
+        :param start_date: start date
+        :param end_date: end date
+        :param time_frame: candle time frame i.e. minute, day etc
+        :return: dataframe if data retrieved successfully else None
+        """
+        import pandas as pd
+        start_date, end_date = parse(start_date).date(), parse(end_date).date()
+        fresh = []
+        for st_dt, en_dt in self.candle_store.missing_ranges(token, time_frame, start_date, end_date):
+            df = self.get_bulk_data({token: symbol}, str(st_dt), str(en_dt), time_frame)[token]
+            if df is None:
+                return
+            self.candle_store.write(token, time_frame, df, st_dt, en_dt)
+            fresh.append(df)
+
+        # Serve stored days from disk and add current day candles which are not stored yet
+        coverage = self.candle_store.get_coverage(token, time_frame)
+        if coverage is None:
+            return pd.concat(fresh) if len(fresh) else self.columns_to_frame([])
+        df = self.candle_store.read(token, time_frame, start_date, min(end_date, coverage[1]))
+        fresh = [f[f.index.date > coverage[1]] for f in fresh]
+        df = pd.concat([df] + [f for f in fresh if len(f)])
+        return df[(df.index.date >= start_date) & (df.index.date <= end_date)]
 
     def load_instruments(self, exchanges: list = None):
         """
         Load all instruments
         :param exchanges: list of exchanges
         """
+        from kiteconnect import KiteConnect
+        from kiteconnect.exceptions import DataException
         logger.debug('Loading instruments, please wait...')
+        if self.rest_client is None:
+            self.rest_client = KiteConnect(api_key=self.api_key)
         if exchanges is None:
             exchanges = ['NFO', 'NSE', 'CDS', 'MCX']
         if not isinstance(exchanges, list) or not len([e for e in exchanges if e in self.available_exchanges]):
@@ -262,9 +534,19 @@ class KiteClient:
             # Add instruments to exchange_dict and all_instruments
             self.exchange_dict[exchange] = instruments
             self.all_instruments += instruments
+            self.tick_sizes.update({i['instrument_token']: i['tick_size'] for i in instruments})
 
         logger.debug('Instruments loaded')
 
+    def share_instruments(self, client):
+        """
+        Use instruments loaded by another client instead of loading them again
+        :param client: kite client with loaded instruments
+        """
+        self.exchange_dict = client.exchange_dict
+        self.all_instruments = client.all_instruments
+        self.tick_sizes = client.tick_sizes
+
     def map_instruments(self, symbols: list) -> list:
         """
         :param symbols: list of symbols
@@ -283,7 +565,7 @@ class KiteClient:
         """
         for i in range(10):
             try:
-                ltp = requests.get(f'{self.root_trade_url}/quote/ltp?{params}', headers=self.headers)
+                ltp = self.http.get(f'{self.root_trade_url}/quote/ltp?{params}', headers=self.headers)
                 data = ltp.json()['data']
                 if data is None or not len(data):
                     logger.debug(f'params: {params}, data: {data}, text: {ltp.text}')
@@ -291,7 +573,7 @@ class KiteClient:
                 return data
             except Exception as e:
                 logger.exception(e)
-                self.login()
+                self.relogin()
 
     @staticmethod
     def map_option_strikes(ltp: float, strike_dist: float, strike_diff: int, ce_opts: list, pe_opts: list) -> list:
@@ -0,0 +1,36 @@
+import time
+from threading import Lock
+
+"""
+Rate limiter to keep api requests within broker limits
+"""
+
+
+class RateLimiter:
+    def __init__(self, rate: float, per: float = 1.0):
+        """
+        RateLimiter class implementing thread safe token bucket
+        :param rate: number of requests allowed per period
+        :param per: period in seconds
+        """
+        self.rate = rate
+        self.per = per
+        self.tokens = float(rate)
+        self.last_time = time.monotonic()
+        self.lock = Lock()
+
+    def acquire(self):
+        """
+        Block until request can be made within rate limit
+        """
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.rate, self.tokens + (now - self.last_time) * self.rate / self.per)
+            self.last_time = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            # Wait until one token is available, waiting threads are served one at a time
+            time.sleep((1 - self.tokens) * self.per / self.rate)
+            self.last_time = time.monotonic()
+            self.tokens = 0
@@ -1,18 +1,41 @@
+from __future__ import annotations
+
 import json
 import time as t
+from collections import defaultdict
 from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, date, timedelta, time
+from decimal import Decimal
+from threading import Lock, Thread
+from typing import Union, TYPE_CHECKING
 
-import pandas as pd
-from dateutil.parser import parse
-
+from trading_bot.checkpoint import Checkpointer, load_checkpoint
 from trading_bot.clients.kite_client import KiteClient
-from trading_bot.database.db import engine
+from trading_bot.database.archive import archive_trades
+from trading_bot.database.db import TradesData, session
 from trading_bot.database.db_handler import save_trade
-from trading_bot.settings import logger, CONFIG_DIR, TZ, BASE_DIR
+from trading_bot.database.journal import TradeJournal, materialize_pending
+from trading_bot.flatten import FlattenTrigger
+from trading_bot.parameters import load_parameters, get_parameters_key
+from trading_bot.profiler import install_profiler
+from trading_bot.scheduler import TimerWheel, seconds_of_day
+from trading_bot.settings import logger, CONFIG_DIR, TZ, GROUP_ENTRY, STREAMER_PROCESS, TICK_RING_CAPACITY, \
+    PARAMETERS_RELOAD_INTERVAL, RECORD_TICKS, CANDLE_TIME_FRAMES, CANDLE_BUFFER_SIZE, CHECKPOINT_INTERVAL, \
+    EXIT_EVALUATOR, ORDER_RATE_LIMIT, TRADE_STORE, CANDLE_STORE
 from trading_bot.strategies.strike_selection import StrikeSelection
-from trading_bot.streamers.kite_streamer import KiteStreamer
-from trading_bot.trade_managers.opt_trade_manager import OptTradeManager
+from trading_bot.streamers.candle_builder import CandleBuilder
+from trading_bot.streamers.kite_streamer import KiteStreamer, store_order_update, pop_all, FINAL_STATUSES
+from trading_bot.trade_managers.leg_group import LegGroup
+from trading_bot.trade_managers.mtm_engine import MtmEngine
+from trading_bot.trade_managers.opt_trade_manager import OptTradeManager, TradeState
+
+# Process streamer and exit evaluator pull in numpy and are imported only when enabled
+if TYPE_CHECKING:
+    from trading_bot.streamers.process_streamer import ProcessKiteStreamer
+    from trading_bot.trade_managers.exit_evaluator import ExitEvaluator
+
+# Controllers of accounts run in parallel and share db session
+db_lock = Lock()
 
 """
 controller to connect and control client, streamer, db and trade manager
@@ -20,14 +43,33 @@ controller to connect and control client, streamer, db and trade manager
 
 
 class Controller:
-    def __init__(self, streamer: KiteStreamer, trade_managers: list):
+    def __init__(self, streamer: Union[KiteStreamer, ProcessKiteStreamer], trade_managers: list,
+                 mtm_engine: MtmEngine = None, client: KiteClient = None,
+                 feed: Union[KiteStreamer, ProcessKiteStreamer] = None, exit_evaluator: ExitEvaluator = None,
+                 journal: TradeJournal = None):
         """
         Controller to connect and control client, streamer, db and trade manager
-        :param streamer: instance of streamer class
+        :param streamer: instance of streamer class, provides order updates of account
         :param trade_managers: list trader manager instanes
+        :param mtm_engine: instance of mark to market engine
+        :param client: trading client of account
+        :param feed: instance of streamer class providing ticks, same as streamer if None
+        :param exit_evaluator: exit evaluator to skip legs waiting for exit without action,
+                               trade function of all legs having tick runs if None
+        :param journal: trade journal to append trade events to, trades table is updated for every event if None
         """
         self.streamer = streamer
+        self.feed = feed if feed is not None else streamer
+        self.client = client
         self.trade_managers = trade_managers
+        self.mtm_engine = mtm_engine if mtm_engine is not None else MtmEngine()
+        self.exit_evaluator = exit_evaluator
+        self.journal = journal
+        # End time exits of instances run on schedule
+        self.timers = TimerWheel()
+        self.square_off_reason = None
+        self.flatten_started = None
+        self.mtm_log_time = t.monotonic()
 
     def start_streaming(self):
         """
@@ -40,200 +82,773 @@ class Controller:
         """
         Run trade manager's trade function
         """
-        obj, tick, order_data = args
-        return obj.trade(tick, order_data)
+        obj, tick, order_data, now = args
+        return obj.trade(tick, order_data, now)
 
-    def run(self):
+    def save_messages(self, obj: OptTradeManager, res: dict):
         """
-        Get ticks, orders data from streamer and pass it to trade manager instance
+        Store trade details returned by trade manager instance
+        :param obj: trade manager instance
+        :param res: dict containing messages
+        """
+        if not res['msg']:
+            return
+        for i in res['msg']:
+            if i:
+                for k, v in i.items():
+                    if self.journal is not None:
+                        self.journal.append(k, v)
+                    else:
+                        with db_lock:
+                            save_trade(k, v)
+                    self.update_mtm(obj, k, v)
+                    if k == 'confirm_entry' and v['position_status'] == 'OPEN' and obj.leg_group is not None:
+                        obj.leg_group.on_fill(obj)
+
+    def enter_group(self, leg_group: LegGroup, client: KiteClient):
+        """
+        Place entry orders of all legs of group together
+        :param leg_group: leg group instance
+        :param client: trading client
+        """
+        for obj, r in leg_group.enter(client):
+            self.save_messages(obj, r)
+
+    def update_mtm(self, obj: OptTradeManager, action: str, params: dict):
+        """
+        Open or close leg in mark to market engine based on trade action
+        :param obj: trade manager instance
+        :param action: trade action i.e. confirm_entry, confirm_exit etc
+        :param params: trade details of action
+        """
+        key = (obj.symbol, params['entry_order_id'])
+        if action == 'confirm_entry' and params['position_status'] == 'OPEN':
+            self.mtm_engine.open_leg(key=key, instrument_token=obj.instrument_token,
+                                     underlying_symbol=obj.underlying_symbol, side=obj.side, qty=obj.qty,
+                                     entry_price=params['entry_price'])
+        elif action == 'confirm_exit':
+            self.mtm_engine.close_leg(key=key, exit_price=params['exit_price'])
+
+    def square_off(self, reason: str):
+        """
+        Exit all trade manager instances concurrently without waiting for ticks, instances which are not entered
+        yet are closed without entry, open entry orders are cancelled and exit orders are modified to market,
+        requests are limited by order rate limiter of client and completion is confirmed by check_flatten
+        :param reason: reason for square off
+        """
+        self.square_off_reason = reason
+        self.flatten_started = t.perf_counter()
+        for obj in self.trade_managers:
+            obj.force_exit = True
+        if self.exit_evaluator is not None:
+            self.exit_evaluator.invalidate()
+        logger.info(f'Square off started, reason: {reason}, instances: {len(self.trade_managers)}')
+        now = datetime.now(tz=TZ)
+        trade_managers = [obj for obj in self.trade_managers if not obj.trade_ended]
+        if len(trade_managers):
+            with ThreadPoolExecutor(max_workers=min(len(trade_managers), ORDER_RATE_LIMIT)) as executor:
+                res = list(executor.map(lambda obj: obj.flatten(now), trade_managers))
+            for obj, r in zip(trade_managers, res):
+                self.save_messages(obj, r)
+
+    def flatten(self, reason: str):
+        """
+        Square off all instances and cancel open algo orders of account left by earlier runs
+        :param reason: reason for flatten
+        """
+        self.square_off(reason=reason)
+
+        # Cancel open algo orders not belonging to instances i.e. left by earlier runs
+        orders = self.client.get_orders()
+        if orders is None:
+            logger.debug(f'{self.client.user_id}: could not get orders to cancel')
+            orders = []
+        order_ids = {i for obj in self.trade_managers for i in [obj.entry_order_id, obj.exit_order_id]}
+        orders = [o for o in orders if o.get('tag') == 'algo_order' and o['status'] not in FINAL_STATUSES and
+                  o['order_id'] not in order_ids]
+        if len(orders):
+            with ThreadPoolExecutor(max_workers=min(len(orders), ORDER_RATE_LIMIT)) as executor:
+                list(executor.map(lambda o: self.client.cancel_order(variety=o.get('variety', 'regular'),
+                                                                  order_id=o['order_id']),
+                                  orders))
+        logger.info(f'{self.client.user_id}: flatten orders sent in '
+                    f'{round((t.perf_counter() - self.flatten_started) * 1000, 1)} ms, instances: '
+                    f'{len(self.trade_managers)}, other orders cancelled: {len(orders)}')
+        self.check_flatten()
+
+    def check_flatten(self):
+        """
+        Confirm orders of flatten from order updates, instances whose entry got filled before cancellation
+        are exited again, total time is logged when all instances are closed
+        """
+        if self.flatten_started is None:
+            return
+        now = datetime.now(tz=TZ)
+        for obj in self.trade_managers:
+            if obj.state is TradeState.POSITION_OPEN or obj.state is TradeState.PENDING_ENTRY:
+                self.save_messages(obj, obj.flatten(now))
+            elif not obj.trade_ended:
+                order_data = self.streamer.orders_queue.get(obj.symbol)
+                if order_data is not None:
+                    self.save_messages(obj, obj.on_orders(order_data, now))
+        if all(obj.trade_ended for obj in self.trade_managers):
+            logger.info(f'{self.client.user_id}: flat in '
+                        f'{round((t.perf_counter() - self.flatten_started) * 1000, 1)} ms, '
+                        f'reason: {self.square_off_reason}')
+            self.flatten_started = None
+
+    def schedule_end_time(self, obj: OptTradeManager):
+        """
+        Schedule exit of trade manager instance at its end time
+        :param obj: trade manager instance
+        """
+        self.timers.schedule(seconds_of_day(obj.end_time), obj)
+
+    def run_timers(self, now: datetime = None):
+        """
+        Modify exit orders of instances whose end time is reached to market without waiting for their ticks,
+        instances placing exit order after end time are modified as soon as it's placed,
+        delay between end time and firing is logged
+        :param now: current time, fetched if None
+        """
+        now = now if now is not None else datetime.now(tz=TZ)
+        fired = []
+        for when, obj in self.timers.advance(seconds_of_day(now)):
+            if obj.state is TradeState.EXIT_OPEN:
+                fired.append((when, obj))
+            elif not obj.trade_ended:
+                # Entry not filled or exit order not placed yet, timer fires again on next slot
+                self.timers.schedule(when, obj)
+        if not len(fired):
+            return
+        started = t.perf_counter()
+        with ThreadPoolExecutor(max_workers=min(len(fired), ORDER_RATE_LIMIT)) as executor:
+            res = list(executor.map(lambda timer: timer[1].on_end_time(now), fired))
+        for (_, obj), r in zip(fired, res):
+            self.save_messages(obj, r)
+        delays = [(seconds_of_day(now) - when) * 1000 for when, _ in fired]
+        logger.info('%s: end time exits of %s instances fired %.1f ms after end time (max %.1f ms), '
+                    'orders modified in %.1f ms', self.client.user_id, len(fired), sum(delays) / len(delays),
+                    max(delays), (t.perf_counter() - started) * 1000)
+
+    def add_open_trade(self, trade: dict) -> int:
+        """
+        Create trade manager instance for open position/order stored in db
+        :param trade: trade details from db
+        :return: instrument token of trade
+        """
+        instrument_token = int(trade['instrument_token'])
+        logger.info(f"open position/order found in {trade['symbol']}, reading parameters...")
+        entry_order_filled = False if trade['entry_order_status'] == 'OPEN' else True
+        exit_pending = True if trade['exit_order_status'] == 'OPEN' else False
+        entry_price = float(trade['entry_price']) if entry_order_filled and trade['entry_price'] is not None else None
+        bought = True if trade['side'] == 'BUY' else False
+        sold = True if trade['side'] == 'SELL' else False
+        kwargs = {
+            'client': self.client, 'symbol': trade['symbol'], 'instrument_token': instrument_token,
+            'exchange': trade['exchange'], 'direction': trade['direction'], 'lot_size': trade['lot_size'],
+            'lots': trade['lots'],
+            'underlying_symbol': trade['underlying_symbol'], 'end_time': trade['end_time'],
+            'stop_loss': trade['stop_loss_percent'], 'trail_sl': trade['trail_sl'], 'side': trade['side'],
+            'entered': True, 'entry_order_filled': entry_order_filled, 'bought': bought, 'sold': sold,
+            'instruction': trade['instruction'], 'qty': trade['quantity'],
+            'entry_order_id': trade['entry_order_id'], 'exit_order_id': trade['exit_order_id'],
+            'sl': trade['stop_loss'], 'exit_pending': exit_pending, 'final_sl': trade['final_stop_loss'],
+            'entry_order_price': trade['entry_order_price'],
+            'exit_order_price': trade['exit_order_price'], 'entry_price': entry_price,
+            'tick_size': self.client.tick_sizes.get(instrument_token, 0.05)}
+
+        obj = OptTradeManager(**kwargs)
+        self.trade_managers.append(obj)
+        self.schedule_end_time(obj)
+        # Track open position in mark to market engine
+        self.mtm_engine.open_leg(key=(obj.symbol, obj.entry_order_id), instrument_token=instrument_token,
+                                 underlying_symbol=obj.underlying_symbol, side=trade['side'], qty=obj.qty,
+                                 entry_price=entry_price)
+        return instrument_token
+
+    def get_state(self) -> dict:
         """
-        # If no ticks found
-        if self.streamer.ticks_queue.empty():
+        :return: dict of trading instances and mark to market state to checkpoint controller
+        """
+        return {'trade_managers': [obj.get_state() for obj in self.trade_managers if not obj.trade_ended],
+                'mtm': self.mtm_engine.get_state(), 'square_off_reason': self.square_off_reason}
+
+    def restore(self, state: dict, open_trades: list, entered: list = ()) -> list:
+        """
+        Restore trading instances from checkpoint, db is updated on every trade action so instances of trades
+        changed after checkpoint are created from db and instances of trades closed after checkpoint are removed
+        :param state: dict returned by get_state
+        :param open_trades: open trades of account from db
+        :param entered: trades of account entered after checkpoint, instances waiting for entry
+                        of their symbols are dropped so entry is not placed twice
+        :return: list of instrument tokens of instances
+        """
+        self.square_off_reason = state['square_off_reason']
+        self.mtm_engine.restore(state['mtm'])
+        trade_managers = [OptTradeManager.from_state(i, self.client) for i in state['trade_managers']]
+        # Instances waiting for entry are not stored in db, ones entered after checkpoint are in db
+        entered_symbols = {tr['symbol'] for tr in entered}
+        self.trade_managers = [obj for obj in trade_managers if obj.entry_order_id is None and
+                               obj.symbol not in entered_symbols]
+        for obj in self.trade_managers:
+            self.schedule_end_time(obj)
+        entered = {(obj.symbol, obj.entry_order_id): obj for obj in trade_managers if obj.entry_order_id is not None}
+        for trade in open_trades:
+            obj = entered.pop((trade['symbol'], trade['entry_order_id']), None)
+            if obj is not None and obj.entry_order_status == trade['entry_order_status'] and \
+                    obj.exit_order_id == trade['exit_order_id']:
+                self.trade_managers.append(obj)
+                self.schedule_end_time(obj)
+                continue
+            if obj is not None:
+                self.mtm_engine.close_leg(key=(obj.symbol, obj.entry_order_id))
+            self.add_open_trade(trade)
+        for obj in entered.values():
+            self.mtm_engine.close_leg(key=(obj.symbol, obj.entry_order_id))
+        return list({obj.instrument_token for obj in self.trade_managers})
+
+    def reconcile_orders(self):
+        """
+        Add orders of trading instances from broker to order updates, so fills and rejections
+        missed while bot was stopped are applied on next tick
+        """
+        orders = self.client.get_orders()
+        if orders is None:
+            logger.debug(f'Could not reconcile orders of {self.client.user_id}')
             return
+        symbols = {obj.symbol for obj in self.trade_managers}
+        for o in orders:
+            if o['tradingsymbol'] in symbols:
+                store_order_update(self.streamer.orders_queue, o, self.streamer.updated_symbols)
+
+    def add_instruments(self, underlying_symbol: str, opt_instruments: list):
+        """
+        Create trade manager instances for selected strikes, legs of strike selection are grouped
+        :param underlying_symbol: underlying symbol
+        :param opt_instruments: list of option instruments with trading parameters
+        """
+        if self.square_off_reason is not None:
+            return
+        group_managers = []
+        for i in opt_instruments:
+            kwargs = {
+                'client': self.client, 'symbol': i['tradingsymbol'], 'instrument_token': i['instrument_token'],
+                'underlying_symbol': i['underlying_symbol'],
+                'exchange': i['exchange'], 'direction': i['direction'], 'lot_size': i['lot_size'],
+                'lots': i['lots'], 'stop_loss': i['stop_loss'], 'end_time': i['end_time'],
+                'trail_sl': i['trail_sl'], 'tick_size': i['tick_size']
+            }
+            group_managers.append(OptTradeManager(**kwargs))
+        self.trade_managers.extend(group_managers)
+        for obj in group_managers:
+            self.schedule_end_time(obj)
+        # Enter all legs together instead of waiting for first tick of each leg
+        if GROUP_ENTRY:
+            self.enter_group(LegGroup(underlying_symbol, group_managers), self.client)
+            if 'start_time' in opt_instruments[0]:
+                start = datetime.combine(date.today(), opt_instruments[0]['start_time'])
+                logger.info('%s: entry orders of %s placed %.1f ms after start time', underlying_symbol,
+                            self.client.user_id,
+                            (datetime.now(tz=TZ).replace(tzinfo=None) - start).total_seconds() * 1000)
+
+    def run(self, ticks=None, now: datetime = None):
+        """
+        Get ticks, orders data from streamer and pass it to trade manager instance
+        :param ticks: tick batch, read from feed if None
+        :param now: time of tick batch, current time if None
+        """
+        if ticks is None:
+            # If no ticks found
+            if self.feed.ticks_queue.empty():
+                return
+            ticks = self.feed.ticks_queue.get()
         # Create trading instances using ticks and trade manager instances
-        ticks = self.streamer.ticks_queue.get()
         self.trade_managers = [obj for obj in self.trade_managers if not obj.trade_ended]
+        # Time is read once for whole tick batch
+        if now is None:
+            now = datetime.now(tz=TZ)
         trade_instances = []
-        for tick in ticks:
-            trade_instances.extend(
-                [(obj, tick, self.streamer.orders_queue.get(obj.symbol)) for obj in self.trade_managers if
-                 obj.instrument_token == tick['instrument_token']])
+        if self.exit_evaluator is not None:
+            # Only legs needing action run trade function
+            self.exit_evaluator.sync(self.trade_managers)
+            for obj, tick in self.exit_evaluator.select(ticks, now, pop_all(self.streamer.updated_symbols)):
+                trade_instances.append((obj, tick, self.streamer.orders_queue.get(obj.symbol), now))
+        else:
+            # Index instances by instrument token so each tick finds its instances directly
+            token_managers = defaultdict(list)
+            for obj in self.trade_managers:
+                token_managers[obj.instrument_token].append(obj)
+            for tick in ticks:
+                trade_instances.extend(
+                    [(obj, tick, self.streamer.orders_queue.get(obj.symbol), now) for obj in
+                     token_managers.get(tick['instrument_token'], [])])
 
         # Run trade instances
         with ThreadPoolExecutor() as executor:
             res = executor.map(self.run_instance, trade_instances)
-        res = [r for r in res if r is not None]
+        res = [(obj, r) for (obj, _, _, _), r in zip(trade_instances, res) if r is not None]
+        if self.exit_evaluator is not None:
+            for obj, _, _, _ in trade_instances:
+                self.exit_evaluator.update(obj)
 
-        for r in res:
+        for obj, r in res:
             # Store trade details if trade data received
             if isinstance(r, dict):
-                if r['msg']:
-                    for i in r['msg']:
-                        if i:
-                            for k, v in i.items():
-                                save_trade(k, v)
+                self.save_messages(obj, r)
             else:
                 # Remove instance if trade is ended for it
                 if r.trade_ended:
                     logger.debug(f'{r.symbol} instance removed from trading manager')
 
+        # Update mark to market with latest prices and exit all positions if portfolio limit reached
+        for tick in ticks:
+            self.mtm_engine.on_tick(tick)
+        limit_reached = self.mtm_engine.check_limits()
+        if limit_reached is not None:
+            self.square_off(reason=limit_reached)
+        if t.monotonic() - self.mtm_log_time >= 60:
+            self.mtm_log_time = t.monotonic()
+            logger.info(self.mtm_engine.summary())
+            if STREAMER_PROCESS:
+                logger.info(f'Tick ring stats: {self.feed.stats()}')
+
         if not len(self.trade_managers):
             logger.debug('All instances closed, Trading ended')
             return 'trade_ended'
 
 
-def run():
+class FeedDispatcher:
+    def __init__(self, feed: Union[KiteStreamer, ProcessKiteStreamer], controllers: list,
+                 candle_builder: CandleBuilder = None):
+        """
+        FeedDispatcher to pass each tick batch of shared market data feed to controllers of all accounts
+        :param feed: instance of streamer class providing ticks
+        :param controllers: list of controller instances, one per account
+        :param candle_builder: candle builder to update with ticks, candles are not built if None
+        """
+        self.feed = feed
+        self.controllers = controllers
+        self.candle_builder = candle_builder
+
+    @staticmethod
+    def run_controller(args: tuple):
+        """
+        Run controller of account, errors are logged so they don't affect other accounts
+        """
+        controller, ticks = args
+        try:
+            return controller.run(ticks)
+        except Exception as e:
+            logger.exception(e)
+            logger.debug(f'Error running account: {controller.client.user_id}')
+
+    def run(self):
+        """
+        Get ticks from feed and run controllers of all accounts having trading instances concurrently
+        """
+        if self.feed.ticks_queue.empty():
+            return
+        ticks = self.feed.ticks_queue.get()
+        if self.candle_builder is not None:
+            self.candle_builder.on_ticks(ticks)
+        controllers = [c for c in self.controllers if len(c.trade_managers)]
+        if len(controllers) == 1:
+            self.run_controller((controllers[0], ticks))
+        elif len(controllers):
+            with ThreadPoolExecutor(max_workers=len(controllers)) as executor:
+                list(executor.map(self.run_controller, [(c, ticks) for c in controllers]))
+
+        if not any(len(c.trade_managers) for c in self.controllers):
+            return 'trade_ended'
+
+
+def read_accounts(config: dict) -> list:
+    """
+    :param config: kite config, either single account or list of accounts under ACCOUNTS key
+    :return: list of account dicts
+    """
+    if 'ACCOUNTS' not in config:
+        return [config]
+    # Accounts use common limits if not specified for account
+    return [{'MAX_LOSS': config.get('MAX_LOSS'), 'MAX_PROFIT': config.get('MAX_PROFIT'), **account}
+            for account in config['ACCOUNTS']]
+
+
+def read_open_trades() -> list:
+    """
+    :return: list of today's trades having open position or open entry order
+    """
+    today = datetime.combine(date.today(), time())
+    return query_trades(TradesData.entry_order_time >= today, TradesData.entry_order_time < today + timedelta(days=1),
+                        (TradesData.position_status == 'OPEN') | (TradesData.entry_order_status == 'OPEN'))
+
+
+def read_trades_entered_after(since: datetime) -> list:
+    """
+    :param since: time of checkpoint
+    :return: list of today's trades whose entry order was placed after given time, whatever their status
+    """
+    tomorrow = datetime.combine(date.today() + timedelta(days=1), time())
+    return query_trades(TradesData.entry_order_time > since.replace(tzinfo=None),
+                        TradesData.entry_order_time < tomorrow)
+
+
+def query_trades(*conditions) -> list:
+    """
+    :param conditions: filter conditions of trades table
+    :return: list of matching trades as dicts
+    """
+    try:
+        rows = session.query(TradesData).filter(*conditions).all()
+        columns = [c.name for c in TradesData.__table__.columns]
+        return [{c: float(v) if isinstance(v, Decimal) else v for c, v in
+                 ((c, getattr(row, c)) for c in columns)} for row in rows]
+    finally:
+        session.close()
+
+
+def drop_entered_batches(batches: dict, pending: list, entered: list) -> list:
+    """
+    Remove batches which placed entry orders after checkpoint, trade of batch has its underlying and end time
+    and is entered after its start time
+    :param batches: dict of batches of checkpoint
+    :param pending: list of keys of batches waiting for strike selection at checkpoint
+    :param entered: list of trades entered after checkpoint
+    :return: list of keys of batches still waiting
+    """
+    waiting = []
+    for key in pending:
+        strategy = batches[key]['strategy']
+        start = datetime.combine(date.today(), strategy['start_time'])
+        if any(tr['underlying_symbol'] == key[0] and tr['end_time'] == strategy['end_time'] and
+               tr['entry_order_time'] >= start for tr in entered):
+            logger.debug(f'Batch {key} entered after checkpoint, not started again')
+            continue
+        waiting.append(key)
+    return waiting
+
+
+def get_checkpoint_state(controllers: list, batches: dict, strats: dict,
+                         streamer: Union[KiteStreamer, ProcessKiteStreamer]) -> dict:
+    """
+    :param controllers: list of controller instances
+    :param batches: dict of batches
+    :param strats: dict of strategies waiting for strike selection
+    :param streamer: streamer providing ticks
+    :return: state of controllers, batches and subscriptions to checkpoint
+    """
+    return {'date': date.today(), 'created': datetime.now(tz=TZ), 'batches': dict(batches), 'pending': list(strats),
+            'subscribed': list(streamer.subscribed_instruments),
+            'accounts': {c.client.user_id: c.get_state() for c in controllers}}
+
+
+def build_batches(client: KiteClient, rows: list) -> dict:
+    """
+    Split parameters of each symbol into batches
+    :param client: trading client to map symbols
+    :param rows: list of parameters dicts
+    :return: dict of (symbol, batch number) and dict of strike selection kwargs and trade parameters
+    """
+    batches = dict()
+    df = {i['symbol']: i for i in rows}
+    if not len(df):
+        return batches
+    # Map instruments for given symbols
+    instruments = client.map_instruments(symbols=list(df.keys()))
+    if not len(instruments):
+        logger.debug(f'No instruments found for symbols: {list(df.keys())}, make sure you entered valid symbols')
+        return batches
+    for inst in instruments:
+        params = df[inst['tradingsymbol']]
+        if params['num_batches'] > params['lots']:
+            logger.debug(f"{inst['tradingsymbol']}: number lots must be greater or equal to number of batches")
+            continue
+        params['num_batches'] = int(params['num_batches'])
+        start_time_range = [
+            (datetime.combine(date.today(), params['start_time']) + timedelta(
+                minutes=(params['entry_interval'] * i))).time() for i in range(params['num_batches'])]
+        end_time_range = [
+            (datetime.combine(date.today(), params['end_time']) + timedelta(
+                minutes=(params['end_interval'] * i))).time() for i in range(params['num_batches'])]
+        lots_batches = [
+            params['lots'] // params['num_batches'] + (1 if x < params['lots'] % params['num_batches'] else 0)
+            for x in range(params['num_batches'])]
+        for j in range(params['num_batches']):
+            if end_time_range[j] <= datetime.now(tz=TZ).time():
+                continue
+            batches[(inst['tradingsymbol'], j)] = {
+                'strategy': {'symbol': inst['tradingsymbol'], 'exchange': inst['exchange'],
+                             'expiry_date': params['expiry_date'], 'strike_dist': params['strike_dist'],
+                             'strike_diff': params['strike_diff'], 'call_premium': params['call_premium'],
+                             'put_premium': params['put_premium'], 'call_delta': params.get('call_delta'),
+                             'put_delta': params.get('put_delta'), 'opt_type': params['opt_type'],
+                             'start_time': start_time_range[j], 'end_time': min(time(15, 20), end_time_range[j]),
+                             'lots': lots_batches[j]},
+                'params': {'stop_loss': params['stop_loss'], 'trail_sl': params['trail_sl'],
+                           'direction': params['direction']}}
+    return batches
+
+
+def reload_strategies(client: KiteClient, batches: dict, strats: dict):
+    """
+    Reload parameters and update batches waiting for strike selection, batches with retrieved strikes,
+    their trading instances and subscriptions are not changed
+    :param client: trading client
+    :param batches: dict of current batches, updated in place
+    :param strats: dict of strategies waiting for strike selection, updated in place
+    """
+    try:
+        new_batches = build_batches(client, load_parameters())
+    except Exception as e:
+        logger.exception(e)
+        logger.debug('Parameters not reloaded, please provide valid inputs')
+        return
+    removed = [key for key in strats if new_batches.get(key) != batches[key]]
+    for key in removed:
+        del strats[key]
+        del batches[key]
+    # New or changed batches, batches already started are not added again
+    added = [key for key in new_batches if key not in batches]
+    for key in added:
+        batches[key] = new_batches[key]
+        strats[key] = StrikeSelection(client=client, **new_batches[key]['strategy'])
+    logger.info(f'Parameters reloaded, batches removed: {removed}, added: {added}')
+
+
+def run(started: float = None):
     """
     Run function to initialize client, streamer, trading managers, controller
     and connect them with user specified inputs
+    :param started: perf counter value at process start, used to log startup timings
     """
+    timings = {'started': started if started is not None else t.perf_counter(), 'subscribed': False}
+    install_profiler()
+
+    def log_startup():
+        # Log time to first subscription once
+        if timings['subscribed']:
+            return
+        timings['subscribed'] = True
+        now = t.perf_counter()
+        logger.info('Startup timings, parameters: %.3fs, login: %.3fs, time to first subscription: %.3fs',
+                    timings['parameters'] - timings['started'], timings['login'] - timings['parameters'],
+                    now - timings['started'])
+
     try:
         # Read parameters
-        df = pd.read_excel(BASE_DIR / 'parameters.xlsx', engine='openpyxl')
+        df = load_parameters()
     except FileNotFoundError as e:
         logger.exception(e)
         t.sleep(5)
         return
-
-    try:
-        # Parse inputs
-        df['expiry_date'] = df['expiry_date'].apply(lambda x: parse(str(x)).date())
-        df['entry start time'] = df['start_time'].apply(lambda x: parse(str(x)).time())
-        df['end_time'] = df['end_time'].apply(lambda x: parse(str(x)).time())
-        df['trail_sl'] = df['trail_sl'].apply(lambda x: True if x.lower() == 'yes' else False)
-        df['opt_type'] = df['opt_type'].str.upper()
-        df['direction'] = df['direction'].str.upper()
-        df = list(df.T.to_dict().values())
     except Exception as e:
         logger.exception(e)
         logger.debug('Please provide valid inputs')
         t.sleep(5)
         return
+    timings['parameters'] = t.perf_counter()
 
     try:
         # Read kite credentials
         with open(CONFIG_DIR / 'kite_config.json') as config:
-            config = json.load(config)
-            user_id = config["USER_ID"]
-            password = config["PASSWORD"]
-            mfa_secret_key = config["MFA_SECRET_KEY"]
+            accounts = read_accounts(json.load(config))
+            credentials = [(a["USER_ID"], a["PASSWORD"], a["MFA_SECRET_KEY"]) for a in accounts]
     except (FileNotFoundError, KeyError) as e:
         logger.exception(e)
         t.sleep(5)
         return
 
-    # Initialize kite client
-    kite_client = KiteClient(user_id=user_id, password=password, mfa_secret_key=mfa_secret_key)
-    kite_client.login()
-    kite_client.load_instruments(exchanges=['NFO', 'NSE'])
+    # Candle store is shared by all accounts as historical data does not depend on account
+    candle_store = None
+    if CANDLE_STORE:
+        from trading_bot.database.candle_store import CandleStore
+        candle_store = CandleStore()
+
+    # Initialize kite clients, instruments are loaded once and shared by all accounts
+    clients = []
+    for user_id, password, mfa_secret_key in credentials:
+        client = KiteClient(user_id=user_id, password=password, mfa_secret_key=mfa_secret_key,
+                            candle_store=candle_store)
+        client.login()
+        client.start_session_refresh()
+        if not len(clients):
+            client.load_instruments(exchanges=['NFO', 'NSE'])
+        else:
+            client.share_instruments(clients[0])
+        clients.append(client)
+    kite_client = clients[0]
+    timings['login'] = t.perf_counter()
+
+    # Trades table is materialized from journals, journals of past days are materialized before archiving
+    journal = None
+    if TRADE_STORE == 'journal':
+        materialize_pending()
+        journal = TradeJournal()
+
+    # Move trades of past days to archive so trades table only holds current session
+    archive_trades()
+    if journal is not None:
+        journal.materialize()
 
     # Check if any open order/position
-    open_pos_stock_list = pd.read_sql('trades_data', engine)
-    mask = ((open_pos_stock_list['entry_order_time'].dt.date == date.today()) & (
-            (open_pos_stock_list['position_status'] == "OPEN") | (
-            open_pos_stock_list['entry_order_status'] == 'OPEN')))
-    open_pos_stock_list = open_pos_stock_list[mask]
-    open_pos_stock_list = list(open_pos_stock_list.T.to_dict().values())
+    open_pos_stock_list = read_open_trades()
+    checkpoint = load_checkpoint() if CHECKPOINT_INTERVAL else None
+    # Trades entered between checkpoint and restart, their instances and batches must not enter again
+    entered = read_trades_entered_after(checkpoint['created']) if checkpoint is not None else []
     if not len(open_pos_stock_list) and not len(df):
         logger.debug('No symbols found for trading')
+        if journal is not None:
+            journal.close()
         t.sleep(5)
         return
 
-    # Initialize kite streamer
-    kite_streamer = KiteStreamer(user_id=user_id, ws_token=kite_client.ws_token)
-    # Initialize trade_managers
-    trade_managers = list()
+    # Initialize kite streamer for market data of all accounts
+    if STREAMER_PROCESS:
+        from trading_bot.streamers.process_streamer import ProcessKiteStreamer
+        kite_streamer = ProcessKiteStreamer(user_id=kite_client.user_id, ws_token=kite_client.ws_token,
+                                            capacity=TICK_RING_CAPACITY, record=RECORD_TICKS)
+    else:
+        recorder = None
+        if RECORD_TICKS:
+            from trading_bot.streamers.tick_recorder import TickRecorder
+            recorder = TickRecorder()
+        kite_streamer = KiteStreamer(user_id=kite_client.user_id, ws_token=kite_client.ws_token, recorder=recorder)
+    # Streamers reconnect with token of current session after relogin
+    kite_client.add_session_listener(kite_streamer.set_token)
 
-    # Initialize controller
-    controller = Controller(streamer=kite_streamer, trade_managers=trade_managers)
+    # Initialize controllers, one per account
+    controllers = []
+    for account, client in zip(accounts, clients):
+        # Order updates of other accounts are received on their own websocket without subscriptions
+        streamer = kite_streamer if client is kite_client else KiteStreamer(user_id=client.user_id,
+                                                                              ws_token=client.ws_token)
+        if streamer is not kite_streamer:
+            client.add_session_listener(streamer.set_token)
+        exit_evaluator = None
+        if EXIT_EVALUATOR:
+            from trading_bot.trade_managers.exit_evaluator import ExitEvaluator
+            exit_evaluator = ExitEvaluator()
+        controllers.append(Controller(streamer=streamer, trade_managers=list(), client=client, feed=kite_streamer,
+                                      mtm_engine=MtmEngine(max_loss=account.get("MAX_LOSS"),
+                                                           max_profit=account.get("MAX_PROFIT")),
+                                      exit_evaluator=exit_evaluator, journal=journal))
+    candle_builder = CandleBuilder(time_frames=CANDLE_TIME_FRAMES, size=CANDLE_BUFFER_SIZE) \
+        if len(CANDLE_TIME_FRAMES) else None
+    dispatcher = FeedDispatcher(feed=kite_streamer, controllers=controllers, candle_builder=candle_builder)
 
     # Start streaming
-    controller.start_streaming()
+    for controller in controllers:
+        controller.start_streaming()
 
     open_pos_tokens = []
-    # Creating trading instances for open position/order
-    for trade in open_pos_stock_list:
-        instrument_token = int(trade['instrument_token'])
-        if instrument_token not in open_pos_tokens:
-            open_pos_tokens.append(instrument_token)
-        logger.info(f"open position/order found in {trade['symbol']}, reading parameters...")
-        entry_order_filled = False if trade['entry_order_status'] == 'OPEN' else True
-        exit_pending = True if trade['exit_order_status'] == 'OPEN' else False
-        bought = True if trade['side'] == 'BUY' else False
-        sold = True if trade['side'] == 'SELL' else False
-        kwargs = {
-            'client': kite_client, 'symbol': trade['symbol'], 'instrument_token': instrument_token,
-            'exchange': trade['exchange'], 'direction': trade['direction'], 'lot_size': trade['lot_size'],
-            'lots': trade['lots'],
-            'underlying_symbol': trade['underlying_symbol'], 'end_time': trade['end_time'],
-            'stop_loss': trade['stop_loss_percent'], 'trail_sl': trade['trail_sl'],
-            'entered': True, 'entry_order_filled': entry_order_filled, 'bought': bought, 'sold': sold,
-            'instruction': trade['instruction'], 'qty': trade['quantity'],
-            'entry_order_id': trade['entry_order_id'], 'exit_order_id': trade['exit_order_id'],
-            'sl': trade['stop_loss'], 'exit_pending': exit_pending, 'final_sl': trade['final_stop_loss'],
-            'entry_order_price': trade['entry_order_price'],
-            'exit_order_price': trade['exit_order_price']}
-
-        controller.trade_managers.append(OptTradeManager(**kwargs))
+    resume_started = t.perf_counter()
+    # Creating trading instances for open position/order from checkpoint if available else from db,
+    # trades stored before accounts were recorded in db belong to first account
+    for controller in controllers:
+        user_id = controller.client.user_id
+        trades = [tr for tr in open_pos_stock_list if tr.get('user_id') == user_id or
+                  (tr.get('user_id') is None and controller.client is kite_client)]
+        account = checkpoint['accounts'].get(user_id) if checkpoint is not None else None
+        if account is not None:
+            tokens = controller.restore(account, trades, [tr for tr in entered if tr.get('user_id') == user_id or
+                                                          (tr.get('user_id') is None and
+                                                           controller.client is kite_client)])
+            controller.reconcile_orders()
+        else:
+            tokens = [controller.add_open_trade(trade) for trade in trades]
+        open_pos_tokens.extend(i for i in tokens if i not in open_pos_tokens)
+    if checkpoint is not None:
+        open_pos_tokens.extend(i for i in checkpoint['subscribed'] if i not in open_pos_tokens)
+    resume_time = t.perf_counter() - resume_started
 
     # Subscribe for data for open_pos_tokens
     t.sleep(3)
     if len(open_pos_tokens):
-        controller.streamer.subscribe(instruments=open_pos_tokens)
-
-    # Initialize strategies list for strike selection
-    strats = list()
-    df = {i['symbol']: i for i in df}
-    if len(df):
-        # Map instruments for given symbols
-        instruments = kite_client.map_instruments(symbols=list(df.keys()))
-        if not len(instruments):
-            logger.debug(f'No instruments found for symbols: {list(df.keys())}, make sure you entered valid symbols')
-            if not len(open_pos_stock_list):
-                t.sleep(5)
-                return
+        kite_streamer.subscribe(instruments=open_pos_tokens)
+        log_startup()
+        # Load recent candles once, candles are built from ticks afterwards
+        if candle_builder is not None:
+            candle_builder.seed(kite_client, {int(obj.instrument_token): obj.symbol for c in controllers
+                                              for obj in c.trade_managers})
+
+    # Initialize strategies for strike selection, one per batch, batches started before restart
+    # are not started again and parameters changed since checkpoint are applied to pending batches
+    if checkpoint is not None:
+        resume_started = t.perf_counter()
+        batches = checkpoint['batches']
+        strats = {key: StrikeSelection(client=kite_client, **batches[key]['strategy'])
+                  for key in drop_entered_batches(batches, checkpoint['pending'], entered)}
+        reload_strategies(kite_client, batches, strats)
+        logger.info('Resumed from checkpoint of %s in %.1f ms, instances: %s, pending batches: %s',
+                    checkpoint['created'], (resume_time + t.perf_counter() - resume_started) * 1000,
+                    sum(len(c.trade_managers) for c in controllers), len(strats))
+    else:
+        batches = build_batches(kite_client, df)
+        strats = {key: StrikeSelection(client=kite_client, **batch['strategy']) for key, batch in batches.items()}
+    if len(df) and not len(strats):
+        logger.debug('No strategy instances created, make sure you entered right parameters, '
+                     'end time must be greater than start time and start time must be grater than current time')
+        if not any(len(c.trade_managers) for c in controllers):
+            t.sleep(5)
+            return
         else:
-            for inst in instruments:
-                params = df[inst['tradingsymbol']]
-                if params['num_batches'] > params['lots']:
-                    logger.debug(f"{inst['tradingsymbol']}: number lots must be greater or equal to number of batches")
-                    continue
-                params['num_batches'] = int(params['num_batches'])
-                start_time_range = [
-                    (datetime.combine(date.today(), params['start_time']) + timedelta(
-                        minutes=(params['entry_interval'] * i))).time() for i in range(params['num_batches'])]
-                end_time_range = [
-                    (datetime.combine(date.today(), params['end_time']) + timedelta(
-                        minutes=(params['end_interval'] * i))).time() for i in range(params['num_batches'])]
-                lots_batches = [
-                    params['lots'] // params['num_batches'] + (1 if x < params['lots'] % params['num_batches'] else 0)
-                    for x in range(params['num_batches'])]
-                strats.extend([StrikeSelection(client=kite_client, symbol=inst['tradingsymbol'],
-                                               exchange=inst['exchange'], expiry_date=params['expiry_date'],
-                                               strike_dist=params['strike_dist'],
-                                               strike_diff=params['strike_diff'], call_premium=params['call_premium'],
-                                               put_premium=params['put_premium'], opt_type=params['opt_type'],
-                                               start_time=start_time_range[j],
-                                               end_time=(min(time(15, 20), end_time_range[j])),
-                                               lots=lots_batches[j]) for j in range(params['num_batches']) if
-                               end_time_range[j] > datetime.now(tz=TZ).time()])
-            if not len(strats):
-                logger.debug('No strategy instances created, make sure you entered right parameters, '
-                             'end time must be greater than start time and start time must be grater than current time')
-                if not len(open_pos_stock_list):
-                    t.sleep(5)
-                    return
-                else:
-                    logger.debug('Trading existing instances')
+            logger.debug('Trading existing instances')
+    parameters_key = get_parameters_key()
+    reload_time = t.monotonic()
+    checkpointer = Checkpointer() if CHECKPOINT_INTERVAL else None
+    flatten_trigger = FlattenTrigger()
+    feed_check_time = t.monotonic()
 
     while True:
+        # Apply changes of parameters file to batches waiting for strike selection
+        if t.monotonic() - reload_time >= PARAMETERS_RELOAD_INTERVAL:
+            reload_time = t.monotonic()
+            key = get_parameters_key()
+            if key is not None and key != parameters_key:
+                parameters_key = key
+                reload_strategies(kite_client, batches, strats)
+
+        # Exit all positions and cancel open orders of all accounts concurrently when requested
+        reason = flatten_trigger.check()
+        if reason is not None:
+            if len(controllers) == 1:
+                controllers[0].flatten(reason)
+            else:
+                with ThreadPoolExecutor(max_workers=len(controllers)) as executor:
+                    list(executor.map(lambda c: c.flatten(reason), controllers))
+        # Restart feed process if it died so accounts don't trade on stale ticks
+        if STREAMER_PROCESS and t.monotonic() - feed_check_time >= 1:
+            feed_check_time = t.monotonic()
+            kite_streamer.check_feed()
+        # Stop if session of any account could not be refreshed, orders would fail, state is checkpointed so
+        # trading resumes after restart
+        failed = [c.client.user_id for c in controllers if c.client.session_failed]
+        if len(failed):
+            logger.critical(f'Trading stopped, session could not be refreshed for {", ".join(failed)}')
+            if checkpointer is not None:
+                checkpointer.stop(get_checkpoint_state(controllers, batches, strats, kite_streamer))
+            if journal is not None:
+                journal.close()
+            break
+
+        for controller in controllers:
+            controller.check_flatten()
+            # Exit orders of instances reaching end time are modified without waiting for their ticks
+            controller.run_timers()
+
         instruments = []
-        strats = [s for s in strats if not s.strikes_retrieved]
-        for s in strats:
+        leg_groups = []
+        # Stop strike selection once square off started in all accounts
+        if all(c.square_off_reason is not None for c in controllers):
+            strats.clear()
+        for key, s in list(strats.items()):
             # Retrieve strikes
             opt_instruments = s.get_strikes()
+            if s.strikes_retrieved:
+                del strats[key]
             if isinstance(opt_instruments, list):  # If strikes retrieved
-                params = df[s.symbol]
+                params = batches[key]['params']
                 for inst in opt_instruments:
                     # Set parameters for instruments
                     inst['stop_loss'] = params['stop_loss']
@@ -241,6 +856,7 @@ def run():
                     inst['direction'] = params['direction']
                     inst['underlying_symbol'] = s.symbol
                 instruments.extend(opt_instruments)
+                leg_groups.append((s.symbol, opt_instruments))
                 logger.debug(f'Strikes retrieved for {s.symbol}, starting trading instances')
             elif opt_instruments is None:  # If strikes not retrieved
                 logger.debug(f'No option contracts found for symbol: {s.symbol}, '
@@ -250,23 +866,34 @@ def run():
             # Subscribe for data for instruments
             tokens = [i['instrument_token'] for i in instruments if
                       i['instrument_token'] not in kite_streamer.subscribed_instruments]
-            controller.streamer.subscribe(instruments=tokens)
+            kite_streamer.subscribe(instruments=tokens)
+            log_startup()
+            # Load recent candles of new instruments in background so entries are not delayed
+            if candle_builder is not None and len(tokens):
+                symbols = {int(i['instrument_token']): i['tradingsymbol'] for i in instruments
+                           if i['instrument_token'] in tokens}
+                Thread(target=candle_builder.seed, args=(kite_client, symbols), name='candle_seed',
+                       daemon=True).start()
 
-        # Creating trading instances for instruments
-        for i in instruments:
-            kwargs = {
-                'client': kite_client, 'symbol': i['tradingsymbol'], 'instrument_token': i['instrument_token'],
-                'underlying_symbol': i['underlying_symbol'],
-                'exchange': i['exchange'], 'direction': i['direction'], 'lot_size': i['lot_size'], 'lots': i['lots'],
-                'stop_loss': i['stop_loss'], 'end_time': i['end_time'],
-                'trail_sl': i['trail_sl']
-            }
-            controller.trade_managers.append(OptTradeManager(**kwargs))
+        # Creating trading instances for instruments in all accounts concurrently
+        for underlying_symbol, opt_instruments in leg_groups:
+            if len(controllers) == 1:
+                controllers[0].add_instruments(underlying_symbol, opt_instruments)
+                continue
+            with ThreadPoolExecutor(max_workers=len(controllers)) as executor:
+                list(executor.map(lambda c: c.add_instruments(underlying_symbol, opt_instruments), controllers))
+
+        # Checkpoint state between tick batches when no trading instance is running
+        if checkpointer is not None and checkpointer.due():
+            checkpointer.submit(get_checkpoint_state(controllers, batches, strats, kite_streamer))
 
         # Run
-        if len(controller.trade_managers):
-            msg = controller.run()
-            # If trade_ended message returned from controller then stop trading
-            if msg == 'trade_ended':
-                logger.debug('Trading ended')
-                break
+        msg = dispatcher.run() if any(len(c.trade_managers) for c in controllers) else 'trade_ended'
+        # If no trading instance is left and no batch is waiting i.e. after flatten then stop trading
+        if msg == 'trade_ended' and not len(strats):
+            logger.debug('Trading ended')
+            if checkpointer is not None:
+                checkpointer.stop(get_checkpoint_state(controllers, batches, strats, kite_streamer))
+            if journal is not None:
+                journal.close()
+            break
@@ -0,0 +1,88 @@
+import os
+from collections import defaultdict
+from datetime import datetime, time, date
+
+from sqlalchemy import create_engine, select, func
+
+from trading_bot.database.db import engine, base, TradesData
+from trading_bot.settings import ARCHIVE_DIR, TZ, logger
+
+"""
+Monthly archive of trades, trades of past days are moved out of trades_data table so it only holds current session
+"""
+
+
+def month_key(day) -> str:
+    """
+    :param day: date or datetime
+    :return: month i.e. 2022_03
+    """
+    return f'{day.year:04d}_{day.month:02d}'
+
+
+def archive_path(month: str):
+    """
+    :param month: month i.e. 2022_03
+    :return: path of archive file of month
+    """
+    return ARCHIVE_DIR / f'trades_{month}.sqlite3'
+
+
+def get_archive_engine(month: str):
+    """
+    :param month: month i.e. 2022_03
+    :return: engine of archive file, file and table are created if not exists
+    """
+    archive_engine = create_engine(f'sqlite:///{str(archive_path(month))}', echo=False)
+    base.metadata.create_all(archive_engine)
+    return archive_engine
+
+
+def list_archives(start_date: date = None, end_date: date = None) -> list:
+    """
+    :param start_date: first date trades are required for
+    :param end_date: last date trades are required for
+    :return: list of months having archive file in given range, oldest first
+    """
+    if not os.path.exists(ARCHIVE_DIR):
+        return []
+    months = sorted(f[len('trades_'):-len('.sqlite3')] for f in os.listdir(ARCHIVE_DIR)
+                    if f.startswith('trades_') and f.endswith('.sqlite3'))
+    if start_date is not None:
+        months = [m for m in months if m >= month_key(start_date)]
+    if end_date is not None:
+        months = [m for m in months if m <= month_key(end_date)]
+    return months
+
+
+def archive_trades(before: datetime = None) -> int:
+    """
+    Move trades entered before given time which have no open order or position to monthly archive files,
+    rows are written to archive before being deleted so interrupted run is completed by next run
+    :param before: entry order time before which trades are archived, start of current day if None
+    :return: number of trades archived
+    """
+    before = before if before is not None else datetime.combine(datetime.now(tz=TZ).date(), time())
+    table = TradesData.__table__
+    condition = (table.c.entry_order_time < before) & (func.coalesce(table.c.position_status, '') != 'OPEN') & (
+            func.coalesce(table.c.entry_order_status, '') != 'OPEN')
+    with engine.connect() as connection:
+        rows = [dict(r._mapping) for r in connection.execute(select(table).where(condition))]
+    if not len(rows):
+        return 0
+
+    months = defaultdict(list)
+    for row in rows:
+        months[month_key(row['entry_order_time'])].append(row)
+    os.makedirs(ARCHIVE_DIR, exist_ok=True)
+    for month, month_rows in sorted(months.items()):
+        archive_engine = get_archive_engine(month)
+        try:
+            with archive_engine.begin() as connection:
+                connection.execute(table.insert().prefix_with('OR REPLACE'), month_rows)
+        finally:
+            archive_engine.dispose()
+    with engine.begin() as connection:
+        connection.execute(table.delete().where(condition))
+    logger.info(f'{len(rows)} trades archived to months: {sorted(months)}')
+    return len(rows)
@@ -0,0 +1,158 @@
+import json
+import os
+from datetime import date, datetime, timedelta
+from threading import Lock
+
+import numpy as np
+import pandas as pd
+
+from trading_bot.settings import CANDLES_DIR, TZ, logger
+
+"""
+Local candle store to cache historical data on disk
+"""
+
+CANDLE_DTYPE = np.dtype([('datetime', 'datetime64[ns]'), ('open', 'f8'), ('high', 'f8'), ('low', 'f8'),
+                         ('close', 'f8'), ('volume', 'i8')])
+
+
+class CandleStore:
+    def __init__(self, base_dir=CANDLES_DIR):
+        """
+        CandleStore class to store candles as numpy files partitioned by day,
+        files are stored in <base_dir>/<time_frame>/<token>/<date>.npy and only completed days are stored
+        :param base_dir: directory to store candles
+        """
+        self.base_dir = base_dir
+        self.lock = Lock()
+
+    def partition_dir(self, token: int, time_frame: str):
+        """
+        :param token: instrument token
+        :param time_frame: candle time frame
+        :return: directory containing day files for given token and time frame
+        """
+        return self.base_dir / time_frame / str(token)
+
+    def get_coverage(self, token: int, time_frame: str):
+        """
+        :param token: instrument token
+        :param time_frame: candle time frame
+        :return: tuple of first and last date stored if any data stored else None
+        """
+        try:
+            with open(self.partition_dir(token, time_frame) / 'meta.json') as f:
+                meta = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return
+        return date.fromisoformat(meta['first_date']), date.fromisoformat(meta['last_date'])
+
+    def missing_ranges(self, token: int, time_frame: str, start_date: date, end_date: date) -> list:
+        """
+        Find date ranges to be fetched from api, ranges always join stored range so coverage stays contiguous
+        :param token: instrument token
+        :param time_frame: candle time frame
+        :param start_date: start date
+        :param end_date: end date
+        :return: list of tuples of start and end date
+        """
+        coverage = self.get_coverage(token, time_frame)
+        if coverage is None:
+            return [(start_date, end_date)]
+        first_date, last_date = coverage
+        ranges = []
+        if start_date < first_date:
+            ranges.append((start_date, first_date - timedelta(days=1)))
+        if end_date > last_date:
+            ranges.append((last_date + timedelta(days=1), end_date))
+        return ranges
+
+    def write(self, token: int, time_frame: str, df: pd.DataFrame, start_date: date, end_date: date):
+        """
+        Store candles of completed days and extend stored range
+        :param token: instrument token
+        :param time_frame: candle time frame
+        :param df: dataframe with datetime index and open, high, low, close, volume columns
+        :param start_date: start date of fetched range
+        :param end_date: end date of fetched range
+        """
+        end_date = min(end_date, datetime.now(tz=TZ).date() - timedelta(days=1))
+        if end_date < start_date:
+            return
+        path = self.partition_dir(token, time_frame)
+        with self.lock:
+            os.makedirs(path, exist_ok=True)
+            if len(df):
+                days = df.index.date
+                for day in np.unique(days):
+                    if start_date <= day <= end_date:
+                        self.save_array(path / f'{day}.npy', self.frame_to_array(df[days == day]))
+
+            coverage = self.get_coverage(token, time_frame)
+            if coverage is not None:
+                start_date, end_date = min(start_date, coverage[0]), max(end_date, coverage[1])
+            self.save_meta(path, start_date, end_date)
+        logger.debug(f'Candles stored for {token}, {time_frame} from {start_date} to {end_date}')
+
+    def read_arrays(self, token: int, time_frame: str, start_date: date, end_date: date) -> list:
+        """
+        Read stored candles as memory mapped arrays without loading them in memory
+        :param token: instrument token
+        :param time_frame: candle time frame
+        :param start_date: start date
+        :param end_date: end date
+        :return: list of memory mapped arrays of CANDLE_DTYPE in date order
+        """
+        path = self.partition_dir(token, time_frame)
+        if not os.path.exists(path):
+            return []
+        days = sorted(f[:-4] for f in os.listdir(path) if f.endswith('.npy'))
+        return [np.load(path / f'{d}.npy', mmap_mode='r') for d in days if
+                start_date <= date.fromisoformat(d) <= end_date]
+
+    def read(self, token: int, time_frame: str, start_date: date, end_date: date) -> pd.DataFrame:
+        """
+        Read stored candles
+        :param token: instrument token
+        :param time_frame: candle time frame
+        :param start_date: start date
+        :param end_date: end date
+        :return: dataframe with datetime index and open, high, low, close, volume columns
+        """
+        arrays = self.read_arrays(token, time_frame, start_date, end_date)
+        arr = np.concatenate(arrays) if len(arrays) else np.empty(0, dtype=CANDLE_DTYPE)
+        index = pd.DatetimeIndex(arr['datetime'], name='datetime')
+        return pd.DataFrame({c: arr[c] for c in CANDLE_DTYPE.names[1:]}, index=index)
+
+    @staticmethod
+    def frame_to_array(df: pd.DataFrame) -> np.ndarray:
+        """
+        :param df: dataframe with datetime index and open, high, low, close, volume columns
+        :return: structured array of CANDLE_DTYPE
+        """
+        arr = np.empty(len(df), dtype=CANDLE_DTYPE)
+        arr['datetime'] = df.index.values
+        for c in CANDLE_DTYPE.names[1:]:
+            arr[c] = df[c].values
+        return arr
+
+    @staticmethod
+    def save_array(file_path, arr: np.ndarray):
+        """
+        Save array atomically
+        """
+        tmp_path = f'{file_path}.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.save(f, arr)
+        os.replace(tmp_path, file_path)
+
+    @staticmethod
+    def save_meta(path, first_date: date, last_date: date):
+        """
+        Save stored range atomically
+        """
+        tmp_path = path / 'meta.json.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'first_date': str(first_date), 'last_date': str(last_date)}, f)
+        os.replace(tmp_path, path / 'meta.json')
+
@@ -1,5 +1,5 @@
 from sqlalchemy import Column, String, Integer, DECIMAL, DATETIME, TIME, BOOLEAN
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, inspect, text
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, scoped_session
 
@@ -47,6 +47,7 @@ class TradesData(base):
     exit_type = Column(String, nullable=True)
     exit_price = Column(DECIMAL, nullable=True)
     exit_order_id = Column(String, nullable=True)
+    user_id = Column(String, nullable=True)
 
     def __repr__(self):
         return f"<symbol: {self.symbol}, side: {self.side}, qty: {self.quantity}>"
@@ -91,3 +92,8 @@ Session = scoped_session(Session)
 session = Session()
 
 base.metadata.create_all(engine)
+
+# Add columns missing in table created by older version
+if 'user_id' not in [c['name'] for c in inspect(engine).get_columns('trades_data')]:
+    with engine.begin() as connection:
+        connection.execute(text('ALTER TABLE trades_data ADD COLUMN user_id VARCHAR'))
@@ -0,0 +1,277 @@
+import argparse
+import json
+import os
+import threading
+import time
+from datetime import datetime, date
+from datetime import time as dt_time
+from decimal import Decimal
+
+from sqlalchemy import DATETIME, TIME
+
+from trading_bot.database.db import engine, TradesData
+from trading_bot.settings import logger, TZ, JOURNAL_DIR, JOURNAL_FSYNC_INTERVAL, JOURNAL_MATERIALIZE_INTERVAL
+
+"""
+Append only journal of trade events, alternative to updating trades table for every event,
+trades table is materialized from journal by replaying events
+"""
+
+COLUMNS = [c.name for c in TradesData.__table__.columns]
+
+# Columns restored from iso format strings of journal
+CONVERTERS = {c.name: datetime.fromisoformat if isinstance(c.type, DATETIME) else dt_time.fromisoformat
+              for c in TradesData.__table__.columns if isinstance(c.type, (DATETIME, TIME))}
+
+# Condition column, its value and updated columns of trade for each action, same as db handler
+EVENTS = {
+    'confirm_entry': ('entry_order_status', 'OPEN',
+                      ['entry_time', 'entry_price', 'stop_loss', 'entry_order_status', 'position_status',
+                       'quantity']),
+    'make_exit': ('position_status', 'OPEN',
+                  ['exit_order_id', 'exit_order_time', 'exit_order_price', 'exit_order_status']),
+    'modify_exit': ('exit_order_status', 'OPEN', ['final_stop_loss', 'exit_order_price']),
+    'confirm_exit': ('position_status', 'OPEN',
+                     ['position_status', 'exit_time', 'exit_price', 'exit_type', 'exit_order_status'])
+}
+
+
+def journal_path(day: date = None):
+    """
+    :param day: trading day, today if None
+    :return: path of journal file of day
+    """
+    day = day if day is not None else datetime.now(tz=TZ).date()
+    return JOURNAL_DIR / f'journal_{day}.jsonl'
+
+
+def encode(value):
+    """
+    :param value: value not serializable by json
+    :return: serializable value
+    """
+    if isinstance(value, (datetime, date, dt_time)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    if hasattr(value, 'item'):  # numpy scalars
+        return value.item()
+    return str(value)
+
+
+def decode(params: dict) -> dict:
+    """
+    :param params: trade details read from journal
+    :return: trade details with datetime and time columns restored
+    """
+    return {k: CONVERTERS[k](v) if k in CONVERTERS and isinstance(v, str) else v for k, v in params.items()}
+
+
+def load_row(key: tuple):
+    """
+    :param key: tuple of symbol and entry order id
+    :return: trade stored in trades table as dict, None if not found
+    """
+    table = TradesData.__table__
+    with engine.connect() as connection:
+        row = connection.execute(table.select().where(table.c.symbol == key[0],
+                                                      table.c.entry_order_id == key[1])).first()
+    return dict(row._mapping) if row is not None else None
+
+
+def apply_event(rows: dict, action: str, params: dict):
+    """
+    Apply trade event to trades, trades not in rows are loaded from trades table
+    i.e. trades entered before journal was enabled
+    :param rows: dict of (symbol, entry order id) and trade dict
+    :param action: action type of event i.e. make_entry, make_exit etc
+    :param params: details of event
+    :return: key of modified trade, None if no trade matched
+    """
+    key = (params['symbol'], params['entry_order_id'])
+    if action == 'make_entry':
+        rows[key] = {c: params.get(c) for c in COLUMNS}
+        return key
+    if action not in EVENTS:
+        return
+    row = rows.get(key)
+    if row is None:
+        row = load_row(key)
+        if row is None:
+            logger.debug('Trade not found for %s, entry_order_id: %s', key[0], key[1])
+            return
+        rows[key] = row
+    column, value, fields = EVENTS[action]
+    if row[column] != value:
+        return
+    for field in fields:
+        if field in params:
+            row[field] = params[field]
+    return key
+
+
+def read_events(path, offset: int = 0):
+    """
+    Read complete events written after offset, partly written last line is left for next read
+    :param path: path of journal file
+    :param offset: bytes already read
+    :return: tuple of list of (action, params) and new offset
+    """
+    if not os.path.exists(path):
+        return [], offset
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        data = f.read()
+    end = data.rfind(b'\n') + 1
+    events = []
+    for line in data[:end].splitlines():
+        try:
+            record = json.loads(line)
+            events.append((record['action'], decode(record['params'])))
+        except (ValueError, KeyError) as e:
+            logger.debug(f'Invalid journal record skipped in {path}: {e}')
+    return events, offset + end
+
+
+def write_rows(rows: list):
+    """
+    Insert or replace trades in trades table
+    :param rows: list of trade dicts having all columns
+    """
+    if not len(rows):
+        return
+    with engine.begin() as connection:
+        connection.execute(TradesData.__table__.insert().prefix_with('OR REPLACE'), rows)
+
+
+def replay(path) -> int:
+    """
+    Materialize trades of journal file to trades table
+    :param path: path of journal file
+    :return: number of trades written
+    """
+    rows = dict()
+    events, _ = read_events(path)
+    modified = {apply_event(rows, action, params) for action, params in events}
+    modified.discard(None)
+    write_rows([rows[key] for key in modified])
+    return len(modified)
+
+
+def materialize_pending() -> int:
+    """
+    Materialize journals of past days not materialized yet i.e. if bot stopped before materializing,
+    materialized journals are renamed with .done suffix and kept as audit trail
+    :return: number of journals materialized
+    """
+    if not os.path.exists(JOURNAL_DIR):
+        return 0
+    today = journal_path().name
+    count = 0
+    for name in sorted(os.listdir(JOURNAL_DIR)):
+        if name.startswith('journal_') and name.endswith('.jsonl') and name < today:
+            path = JOURNAL_DIR / name
+            logger.debug(f'Journal {name} materialized, trades: {replay(path)}')
+            os.replace(path, path.with_name(name + '.done'))
+            count += 1
+    return count
+
+
+class TradeJournal:
+    def __init__(self, path=None, fsync_interval: float = JOURNAL_FSYNC_INTERVAL,
+                 materialize_interval: float = JOURNAL_MATERIALIZE_INTERVAL):
+        """
+        TradeJournal class to append trade events to journal file of the day, events are written immediately
+        and synced to disk together by background thread which also materializes new events to trades table
+        :param path: path of journal file, today's journal if None
+        :param fsync_interval: seconds between fsyncs
+        :param materialize_interval: seconds between materializations, 0 materializes only on demand
+        """
+        self.path = path if path is not None else journal_path()
+        if not os.path.exists(self.path.parent):
+            os.makedirs(self.path.parent)
+        self.fsync_interval = fsync_interval
+        self.materialize_interval = materialize_interval
+        self.file = open(self.path, 'ab')
+        self.lock = threading.Lock()
+        self.unsynced = 0
+        # Trades replayed so far and bytes of journal replayed
+        self.rows = dict()
+        self.offset = 0
+        self.materialize_lock = threading.Lock()
+        self.materialize_time = time.monotonic()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.sync_loop, name='journal')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def append(self, action: str, params: dict):
+        """
+        Append trade event, same signature as db handler's save_trade
+        :param action: action type for trade i.e. make_entry, make_exit etc
+        :param params: details of event
+        """
+        line = json.dumps({'time': datetime.now(tz=TZ), 'action': action, 'params': params}, default=encode)
+        with self.lock:
+            self.file.write(line.encode() + b'\n')
+            self.file.flush()
+            self.unsynced += 1
+        logger.debug('Trade event journaled for %s for action: %s', params['symbol'], action)
+
+    def sync(self):
+        """
+        Sync appended events to disk
+        """
+        with self.lock:
+            if not self.unsynced:
+                return
+            self.unsynced = 0
+        os.fsync(self.file.fileno())
+
+    def materialize(self) -> int:
+        """
+        Materialize events appended since last materialization to trades table
+        :return: number of trades written
+        """
+        with self.materialize_lock:
+            started = time.perf_counter()
+            events, self.offset = read_events(self.path, self.offset)
+            modified = {apply_event(self.rows, action, params) for action, params in events}
+            modified.discard(None)
+            write_rows([self.rows[key] for key in modified])
+            if len(events):
+                logger.debug('Journal materialized, events: %s, trades: %s in %.1f ms', len(events), len(modified),
+                             (time.perf_counter() - started) * 1000)
+            return len(modified)
+
+    def sync_loop(self):
+        """
+        Sync events every fsync interval and materialize them every materialize interval until stopped
+        """
+        while not self.stopped.wait(self.fsync_interval):
+            try:
+                self.sync()
+                if self.materialize_interval and \
+                        time.monotonic() - self.materialize_time >= self.materialize_interval:
+                    self.materialize_time = time.monotonic()
+                    self.materialize()
+            except Exception as e:
+                logger.exception(e)
+
+    def close(self):
+        """
+        Stop background thread, sync and materialize remaining events
+        """
+        self.stopped.set()
+        self.thread.join(timeout=5)
+        self.sync()
+        self.materialize()
+        self.file.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Materialize trade journals to trades table')
+    parser.add_argument('paths', nargs='+', help='journal files to replay in given order')
+    args = parser.parse_args()
+    for p in args.paths:
+        print(f'{p}: {replay(p)} trades written')
@@ -0,0 +1,57 @@
+import os
+import signal
+import time
+from datetime import datetime
+
+from trading_bot.settings import logger, TZ, FLATTEN_TIME, FLATTEN_FILE, FLATTEN_CHECK_INTERVAL
+
+"""
+Triggers to exit all positions and cancel open orders at once
+"""
+
+
+class FlattenTrigger:
+    def __init__(self, at=FLATTEN_TIME, path=FLATTEN_FILE):
+        """
+        FlattenTrigger class to detect flatten request by SIGUSR2 signal, flatten file or schedule,
+        must be created in main thread to register signal
+        :param at: time to flatten, not scheduled if None
+        :param path: path of flatten file
+        """
+        self.at = at
+        self.path = path
+        self.signalled = False
+        self.triggered = False
+        self.check_time = 0
+        if hasattr(signal, 'SIGUSR2'):
+            signal.signal(signal.SIGUSR2, self.on_signal)
+
+    def on_signal(self, *args):
+        """
+        Signal handler, flatten is started by main loop
+        """
+        self.signalled = True
+
+    def check(self):
+        """
+        :return: reason if flatten is requested first time else None
+        """
+        if self.triggered:
+            return
+        reason = None
+        if self.signalled:
+            reason = 'flatten_signal'
+        elif time.monotonic() - self.check_time >= FLATTEN_CHECK_INTERVAL:
+            self.check_time = time.monotonic()
+            if os.path.exists(self.path):
+                reason = 'flatten_file'
+                try:
+                    os.remove(self.path)
+                except OSError as e:
+                    logger.exception(e)
+            elif self.at is not None and datetime.now(tz=TZ).time() >= self.at:
+                reason = 'flatten_time'
+        if reason is not None:
+            self.triggered = True
+            logger.info(f'Flatten requested, reason: {reason}')
+        return reason
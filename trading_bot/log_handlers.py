@@ -0,0 +1,68 @@
+import json
+import logging
+from logging.handlers import QueueHandler
+from queue import Full
+
+"""
+Logging handlers, filters and formatters to write logs off the trading threads
+"""
+
+
+class DroppingQueueHandler(QueueHandler):
+    def __init__(self, queue):
+        """
+        Queue handler which hands records to background writer without formatting them,
+        records are dropped and counted when queue is full
+        :param queue: bounded queue shared with listener
+        """
+        super().__init__(queue)
+        self.dropped = 0
+        self.reported = 0
+
+    def prepare(self, record):
+        """
+        Keep record as it is, message is formatted by writer thread
+        """
+        return record
+
+    def enqueue(self, record):
+        try:
+            if self.dropped > self.reported:
+                # Report dropped records once queue has space again
+                self.queue.put_nowait(logging.makeLogRecord(
+                    {'name': record.name, 'levelno': logging.WARNING, 'levelname': 'WARNING',
+                     'msg': '%s log records dropped, log queue full', 'args': (self.dropped - self.reported,),
+                     'module': 'log_handlers'}))
+                self.reported = self.dropped
+            self.queue.put_nowait(record)
+        except Full:
+            self.dropped += 1
+
+
+class ModuleLevelFilter(logging.Filter):
+    def __init__(self, levels: dict):
+        """
+        Filter records below level configured for module which logged them
+        :param levels: dict of module name and level name i.e. {'opt_trade_manager': 'INFO'}
+        """
+        super().__init__()
+        self.levels = {m: logging.getLevelName(level.upper()) for m, level in levels.items()}
+
+    def filter(self, record):
+        level = self.levels.get(record.module)
+        return level is None or record.levelno >= level
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Format records as compact json lines, fields passed in event extra are added to line
+    i.e. logger.info('order placed', extra={'event': {'order_id': order_id}})
+    """
+
+    def format(self, record):
+        line = {'time': self.formatTime(record), 'level': record.levelname, 'module': record.module,
+                'msg': record.getMessage()}
+        line.update(getattr(record, 'event', {}))
+        if record.exc_info:
+            line['exc'] = self.formatException(record.exc_info)
+        return json.dumps(line, default=str, separators=(',', ':'))
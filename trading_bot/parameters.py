@@ -0,0 +1,151 @@
+import csv
+import json
+import os
+import pickle
+from pathlib import Path
+
+from trading_bot.settings import logger, BASE_DIR, CACHE_DIR, PARAMETERS_FILES
+
+"""
+Lightweight loader for trading parameters, supports csv, json, toml and xlsx files
+"""
+
+INT_FIELDS = ['lots', 'num_batches']
+FLOAT_FIELDS = ['entry_interval', 'end_interval', 'strike_dist', 'strike_diff', 'call_premium', 'put_premium',
+                'stop_loss', 'call_delta', 'put_delta']
+
+# Parsed parameters of last loaded file with its modification time and size
+cache = dict()
+
+
+def find_parameters_file():
+    """
+    :return: path of first existing parameters file else None
+    """
+    for file_name in PARAMETERS_FILES:
+        path = BASE_DIR / file_name
+        if path.exists():
+            return path
+
+
+def read_csv(path) -> list:
+    with open(path, newline='') as f:
+        return [{k.strip(): v.strip() if isinstance(v, str) else v for k, v in row.items() if k}
+                for row in csv.DictReader(f)]
+
+
+def read_json(path) -> list:
+    """
+    Json file must contain list of parameters objects
+    """
+    with open(path) as f:
+        return json.load(f)
+
+
+def read_toml(path) -> list:
+    """
+    Toml file must contain parameters array of tables i.e. [[parameters]], requires tomli before python 3.11
+    """
+    try:
+        import tomllib
+    except ImportError:
+        import tomli as tomllib
+    with open(path, 'rb') as f:
+        return tomllib.load(f)['parameters']
+
+
+def read_xlsx(path) -> list:
+    """
+    Read first sheet, first row contains column names
+    """
+    from openpyxl import load_workbook
+    wb = load_workbook(path, read_only=True, data_only=True)
+    try:
+        rows = wb.worksheets[0].iter_rows(values_only=True)
+        columns = next(rows)
+        return [{c: v for c, v in zip(columns, row) if c is not None} for row in rows
+                if any(v is not None for v in row)]
+    finally:
+        wb.close()
+
+
+READERS = {'.csv': read_csv, '.json': read_json, '.toml': read_toml, '.xlsx': read_xlsx}
+
+
+def to_number(value, cast):
+    if value is None or (isinstance(value, str) and not value):
+        return None
+    return cast(float(value))
+
+
+def parse_rows(rows: list) -> list:
+    """
+    Convert raw values to types used by controller
+    :param rows: list of parameters dicts
+    :return: list of parameters dicts
+    """
+    from dateutil.parser import parse
+    for row in rows:
+        row['expiry_date'] = parse(str(row['expiry_date'])).date()
+        row['start_time'] = parse(str(row['start_time'])).time()
+        row['end_time'] = parse(str(row['end_time'])).time()
+        trail_sl = row['trail_sl']
+        row['trail_sl'] = trail_sl if isinstance(trail_sl, bool) else str(trail_sl).lower() == 'yes'
+        row['opt_type'] = str(row['opt_type']).upper()
+        row['direction'] = str(row['direction']).upper()
+        for field in INT_FIELDS:
+            row[field] = to_number(row.get(field), int)
+        for field in FLOAT_FIELDS:
+            row[field] = to_number(row.get(field), float)
+    return rows
+
+
+def get_parameters_key(path=None):
+    """
+    :param path: parameters file path, first existing file of PARAMETERS_FILES if None
+    :return: tuple of path, modification time and size, None if file not found
+    """
+    path = Path(path) if path is not None else find_parameters_file()
+    try:
+        stat = os.stat(path)
+    except (OSError, TypeError):
+        return
+    return str(path), stat.st_mtime_ns, stat.st_size
+
+
+def load_parameters(path=None) -> list:
+    """
+    Load parameters, parsed parameters are cached in memory and on disk until file is modified
+    :param path: parameters file path, first existing file of PARAMETERS_FILES if None
+    :return: list of parameters dicts
+    """
+    path = Path(path) if path is not None else find_parameters_file()
+    if path is None:
+        raise FileNotFoundError(f'No parameters file found, expected one of {PARAMETERS_FILES}')
+    key = get_parameters_key(path)
+    if cache.get('key') == key:
+        return [dict(row) for row in cache['rows']]
+
+    cache_path = CACHE_DIR / 'parameters.pickle'
+    try:
+        with open(cache_path, 'rb') as f:
+            cached = pickle.load(f)
+        if cached['key'] != key:
+            cached = None
+    except (OSError, pickle.UnpicklingError, EOFError, KeyError):
+        cached = None
+
+    if cached is not None:
+        rows = cached['rows']
+    else:
+        rows = parse_rows(READERS[path.suffix.lower()](path))
+        try:
+            os.makedirs(CACHE_DIR, exist_ok=True)
+            with open(cache_path, 'wb') as f:
+                pickle.dump({'key': key, 'rows': rows}, f)
+        except OSError as e:
+            logger.debug(f'Error caching parameters: {e}')
+        logger.debug(f'Parameters loaded from {path.name}, rows: {len(rows)}')
+
+    cache.update({'key': key, 'rows': rows})
+    return [dict(row) for row in rows]
@@ -0,0 +1,149 @@
+import atexit
+import os
+import signal
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+
+from trading_bot.settings import logger, TZ, PROFILES_DIR, PROFILE_INTERVAL, PROFILE_THREADS
+
+"""
+Sampling profiler for controller and worker threads, started by PROFILE=1 environment variable
+or toggled by SIGUSR1 (SIGBREAK on windows) signal while bot is running
+"""
+
+
+class SamplingProfiler:
+    def __init__(self, interval: float = PROFILE_INTERVAL, threads: tuple = PROFILE_THREADS,
+                 output_dir=PROFILES_DIR):
+        """
+        SamplingProfiler class to sample stacks of threads periodically, samples are written as collapsed stacks
+        for flame graph tools and per function timings when profiling stops
+        :param interval: seconds between samples
+        :param threads: name prefixes of threads to sample
+        :param output_dir: directory to write profiles
+        """
+        self.interval = interval
+        self.threads = threads
+        self.output_dir = output_dir
+        self.stacks = Counter()
+        # Seconds per stack, each sample is weighted by measured time since previous sample
+        # as sleep, stack walk and waiting for GIL make samples further apart than interval
+        self.seconds = Counter()
+        self.lock = threading.Lock()
+        self.thread = None
+        self.running = False
+        self.started = None
+
+    def start(self):
+        if self.running:
+            return
+        self.stacks = Counter()
+        self.seconds = Counter()
+        self.running = True
+        self.started = datetime.now(tz=TZ)
+        self.thread = threading.Thread(target=self.sample, name='profiler')
+        self.thread.daemon = True
+        self.thread.start()
+        logger.info(f'Profiler started, interval: {self.interval}s')
+
+    def stop(self):
+        """
+        Stop sampling and write profile
+        """
+        if not self.running:
+            return
+        self.running = False
+        self.thread.join(timeout=1)
+        self.dump()
+
+    def toggle(self, *args):
+        """
+        Signal handler to start or stop profiler
+        """
+        if self.running:
+            self.stop()
+        else:
+            self.start()
+
+    def sample(self):
+        """
+        Record stacks of selected threads until stopped
+        """
+        own_id = threading.get_ident()
+        previous = time.perf_counter() - self.interval
+        while self.running:
+            now = time.perf_counter()
+            elapsed, previous = now - previous, now
+            names = {t.ident: t.name for t in threading.enumerate()}
+            frames = sys._current_frames()
+            samples = []
+            for ident, frame in frames.items():
+                name = names.get(ident, '')
+                if ident == own_id or not name.startswith(self.threads):
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+                    frame = frame.f_back
+                # Threads of pool share one root so their samples merge
+                samples.append(';'.join([name.rsplit('_', 1)[0]] + stack[::-1]))
+            del frames
+            with self.lock:
+                self.stacks.update(samples)
+                for stack in samples:
+                    self.seconds[stack] += elapsed
+            time.sleep(self.interval)
+
+    def function_timings(self) -> list:
+        """
+        :return: list of (function, self seconds, cumulative seconds) tuples, highest cumulative first
+        """
+        own, cumulative = Counter(), Counter()
+        with self.lock:
+            stacks = list(self.seconds.items())
+        for stack, seconds in stacks:
+            functions = stack.split(';')[1:]
+            if not len(functions):
+                continue
+            own[functions[-1]] += seconds
+            for function in set(functions):
+                cumulative[function] += seconds
+        return [(f, own[f], c) for f, c in cumulative.most_common()]
+
+    def dump(self):
+        """
+        Write collapsed stacks and per function timings of profiling session
+        """
+        if not len(self.stacks):
+            return
+        os.makedirs(self.output_dir, exist_ok=True)
+        name = self.started.strftime('%Y-%m-%d_%H-%M-%S')
+        with self.lock:
+            stacks = sorted(self.stacks.items())
+        with open(self.output_dir / f'{name}.folded', 'w') as f:
+            f.writelines(f'{stack} {count}\n' for stack, count in stacks)
+        with open(self.output_dir / f'{name}_functions.csv', 'w') as f:
+            f.write('function,self_seconds,cumulative_seconds\n')
+            f.writelines(f'"{function}",{own:.3f},{cumulative:.3f}\n'
+                         for function, own, cumulative in self.function_timings())
+        logger.info(f'Profile written to {self.output_dir / name}.folded, samples: {sum(c for _, c in stacks)}')
+
+
+def install_profiler() -> SamplingProfiler:
+    """
+    Create profiler, register toggle signal and start it if PROFILE environment variable is set,
+    must be called from main thread
+    :return: profiler
+    """
+    profiler = SamplingProfiler()
+    toggle_signal = getattr(signal, 'SIGUSR1', None) or getattr(signal, 'SIGBREAK', None)
+    if toggle_signal is not None:
+        signal.signal(toggle_signal, profiler.toggle)
+    atexit.register(profiler.stop)
+    if os.environ.get('PROFILE', '') not in ('', '0'):
+        profiler.start()
+    return profiler
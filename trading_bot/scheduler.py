@@ -0,0 +1,68 @@
+from trading_bot.settings import TIMER_RESOLUTION, TIMER_WHEEL_SIZE
+
+"""
+Timer wheel to run time based actions of trading instances on schedule instead of checking time on every tick
+"""
+
+
+def seconds_of_day(t) -> float:
+    """
+    :param t: time or datetime
+    :return: seconds since midnight
+    """
+    return t.hour * 3600 + t.minute * 60 + t.second + t.microsecond / 1e6
+
+
+class TimerWheel:
+    def __init__(self, resolution: float = TIMER_RESOLUTION, size: int = TIMER_WHEEL_SIZE):
+        """
+        TimerWheel class to keep timers in buckets of fixed time resolution, advancing the wheel only visits
+        buckets of elapsed slots so cost does not depend on number of pending timers,
+        timers more than one rotation ahead stay in their bucket until their round comes
+        :param resolution: seconds per slot, timers fire at most this late after due time
+        :param size: number of slots in one rotation
+        """
+        self.resolution = resolution
+        self.size = size
+        self.buckets = [[] for _ in range(size)]
+        # Last slot advanced to, all buckets are checked on first advance
+        self.current = None
+        self.pending = 0
+
+    def schedule(self, when: float, item):
+        """
+        Add timer, timer already due fires on next slot
+        :param when: due time in seconds
+        :param item: item returned when timer fires
+        """
+        slot = -int(-when // self.resolution)
+        if self.current is not None and slot <= self.current:
+            slot = self.current + 1
+        self.buckets[slot % self.size].append((slot, when, item))
+        self.pending += 1
+
+    def advance(self, now: float) -> list:
+        """
+        Advance wheel to given time
+        :param now: current time in seconds
+        :return: list of tuples of due time and item of fired timers, earliest first
+        """
+        target = int(now // self.resolution)
+        if self.current is not None and target <= self.current:
+            return []
+        first = self.current + 1 if self.current is not None else target - self.size + 1
+        self.current = target
+        if not self.pending:
+            return []
+        fired = []
+        for slot in range(max(first, target - self.size + 1), target + 1):
+            bucket = self.buckets[slot % self.size]
+            if not len(bucket):
+                continue
+            due = [timer for timer in bucket if timer[0] <= target]
+            if len(due):
+                bucket[:] = [timer for timer in bucket if timer[0] > target]
+                fired.extend((when, item) for _, when, item in due)
+        self.pending -= len(fired)
+        fired.sort(key=lambda timer: timer[0])
+        return fired
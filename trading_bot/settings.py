@@ -1,19 +1,129 @@
+import atexit
+import json
 import logging
 import os
-from datetime import datetime
+from datetime import datetime, time
+from logging.handlers import QueueListener
 from pathlib import Path
+from queue import Queue
 
 import pytz
 
+from trading_bot.log_handlers import DroppingQueueHandler, ModuleLevelFilter, JsonFormatter
+
 BASE_DIR = Path(__file__).resolve().parent.parent
 LOGS_DIR = BASE_DIR / 'logs'
 CONFIG_DIR = BASE_DIR / 'config'
+CANDLES_DIR = BASE_DIR / 'candles'
+TICKS_DIR = BASE_DIR / 'ticks'
+ARCHIVE_DIR = BASE_DIR / 'archive'
+PROFILES_DIR = BASE_DIR / 'profiles'
+CACHE_DIR = BASE_DIR / 'cache'
+SESSIONS_DIR = CONFIG_DIR / 'sessions'
+CHECKPOINTS_DIR = BASE_DIR / 'checkpoints'
+JOURNAL_DIR = BASE_DIR / 'journal'
+
+# Parameters files in order of preference, first existing file is used
+PARAMETERS_FILES = ['parameters.csv', 'parameters.json', 'parameters.toml', 'parameters.xlsx']
+# Seconds between checks of parameters file for changes while trading
+PARAMETERS_RELOAD_INTERVAL = 5
 
 TZ = pytz.timezone('Asia/Kolkata')
 
+# Trailing stop loss order is modified only when trigger moves by at least this many ticks
+TRAIL_SL_STEP_TICKS = 2
+# Minimum seconds between two trailing stop loss modifications of an order
+TRAIL_SL_MIN_INTERVAL = 1.0
+# Check exit and trailing sl conditions of all legs with numpy arrays per tick batch,
+# trade manager runs only for legs needing action
+EXIT_EVALUATOR = False
+# Seconds per slot of timer wheel running end time exits on schedule, exits fire at most this late
+TIMER_RESOLUTION = 0.05
+# Number of slots of timer wheel, timers further than one rotation ahead wait in their slot for their round
+TIMER_WHEEL_SIZE = 1024
+# Order requests allowed per second by broker, shared by all order requests of account
+ORDER_RATE_LIMIT = 10
+# Time to exit all positions and cancel open orders irrespective of end time of batches i.e. time(15, 15),
+# not scheduled if None
+FLATTEN_TIME = None
+# Creating this file in project folder exits all positions and cancels open orders, file is removed after that
+FLATTEN_FILE = BASE_DIR / 'flatten'
+# Seconds between checks of flatten file
+FLATTEN_CHECK_INTERVAL = 0.5
+# Place entry orders of all legs of strike selection together as soon as strikes are retrieved
+GROUP_ENTRY = True
+# Seconds before batch start time to start shortlisting strikes from live quotes
+PREARM_LEAD = 30
+# Seconds between shortlist updates while pre-arming
+PREARM_INTERVAL = 5
+# Number of candidate strikes kept on each side of required strike or premium
+PREARM_SHORTLIST = 5
+# Risk free rate used for implied volatility and delta of options
+RISK_FREE_RATE = 0.07
+# Expiry time of options on expiry date
+EXPIRY_TIME = time(15, 30)
+# Maximum tick batches waiting for controller, oldest batch is dropped when full
+TICKS_QUEUE_SIZE = 100
+# Minimum seconds between warnings about dropped tick batches
+TICKS_DROP_WARNING_INTERVAL = 60
+# Run websocket streamer in separate process and pass ticks through shared memory ring buffer
+STREAMER_PROCESS = False
+# Number of ticks shared memory ring buffer can hold
+TICK_RING_CAPACITY = 65536
+# Record received ticks to ticks folder
+RECORD_TICKS = False
+# Maximum tick batches waiting for recorder thread, batches are dropped when full
+TICK_RECORDER_QUEUE_SIZE = 10000
+# Candle time frames in seconds built from ticks i.e. [60, 300], candles are not built if empty
+CANDLE_TIME_FRAMES = []
+# Number of completed candles kept per instrument and time frame
+CANDLE_BUFFER_SIZE = 375
+# Cache historical candles in candles folder, only days missing in cache are fetched from api
+CANDLE_STORE = False
+
+# Seconds between checkpoints of controller state used to resume after restart, 0 disables checkpoints
+CHECKPOINT_INTERVAL = 2
+
+# Trade store i.e. db (trades table updated for every trade event) or journal (events appended to journal file,
+# trades table is materialized from it in background)
+TRADE_STORE = 'db'
+# Seconds between fsyncs of journal, events appended in between are synced together
+JOURNAL_FSYNC_INTERVAL = 0.2
+# Seconds between materializations of journal to trades table while trading
+JOURNAL_MATERIALIZE_INTERVAL = 30
+
+# Seconds between session checks, session is refreshed before requests fail
+SESSION_CHECK_INTERVAL = 300
+# Seconds before retrying failed session refresh, doubled after every failure up to session check interval
+SESSION_RETRY_DELAY = 10
+# Consecutive failed session refreshes after which trading is stopped
+SESSION_MAX_FAILURES = 5
+
+# Seconds between stack samples of profiler
+PROFILE_INTERVAL = 0.005
+# Name prefixes of threads sampled by profiler, controller loop runs in main thread
+PROFILE_THREADS = ('MainThread', 'ThreadPoolExecutor')
+
+# Log format i.e. text or json (json lines)
+LOG_FORMAT = os.environ.get('LOG_FORMAT', 'text')
+# Minimum log level per module i.e. {"opt_trade_manager": "INFO", "db_handler": "WARNING"}
+LOG_LEVELS = json.loads(os.environ.get('LOG_LEVELS', '{}'))
+# Maximum log records waiting for writer thread, records are dropped when full
+LOG_QUEUE_SIZE = 10000
+
+
+def customTime(*args):
+    # Use record creation time as records are formatted later by writer thread
+    converted = datetime.fromtimestamp(args[-1], tz=TZ) if args else datetime.now(tz=TZ)
+    return converted.timetuple()
+
+
+# Set logs timezone
+logging.Formatter.converter = customTime
+
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
-formatter = logging.Formatter('%(asctime)s:%(message)s')
+formatter = JsonFormatter() if LOG_FORMAT == 'json' else logging.Formatter('%(asctime)s:%(message)s')
 
 if not os.path.exists(LOGS_DIR):
     os.mkdir(LOGS_DIR)
@@ -24,15 +134,11 @@ file_handler.setFormatter(formatter)
 stream_handler = logging.StreamHandler()
 stream_handler.setFormatter(formatter)
 
-logger.addHandler(file_handler)
-logger.addHandler(stream_handler)
-
+# Records are put on queue by trading threads and written to file and stream by listener thread
+queue_handler = DroppingQueueHandler(Queue(maxsize=LOG_QUEUE_SIZE))
+queue_handler.addFilter(ModuleLevelFilter(LOG_LEVELS))
+log_listener = QueueListener(queue_handler.queue, file_handler, stream_handler)
+log_listener.start()
+atexit.register(log_listener.stop)
 
-def customTime(*args):
-    utc_dt = pytz.utc.localize(datetime.utcnow())
-    converted = utc_dt.astimezone(TZ)
-    return converted.timetuple()
-
-
-# Set logs timezone
-logging.Formatter.converter = customTime
+logger.addHandler(queue_handler)
@@ -0,0 +1,113 @@
+import numpy as np
+
+"""
+Vectorized Black-Scholes prices, implied volatility and delta for option chains
+"""
+
+SQRT_2PI = np.sqrt(2 * np.pi)
+
+
+def norm_pdf(x: np.ndarray) -> np.ndarray:
+    return np.exp(-0.5 * x * x) / SQRT_2PI
+
+
+def norm_cdf(x: np.ndarray) -> np.ndarray:
+    """
+    Standard normal cdf using Abramowitz and Stegun 7.1.26 erf approximation, max error 1.5e-7
+    """
+    z = np.abs(x) / np.sqrt(2)
+    t = 1 / (1 + 0.3275911 * z)
+    erf = 1 - t * (0.254829592 + t * (-0.284496736 + t * (1.421413741 + t * (-1.453152027 + t * 1.061405429)))) * \
+        np.exp(-z * z)
+    return 0.5 * (1 + np.sign(x) * erf)
+
+
+def d1_d2(spot, strike, t, rate, sigma) -> tuple:
+    sqrt_t = np.sqrt(t)
+    d1 = (np.log(spot / strike) + (rate + 0.5 * sigma * sigma) * t) / (sigma * sqrt_t)
+    return d1, d1 - sigma * sqrt_t
+
+
+def bs_price(spot, strike, t, rate, sigma, is_call) -> np.ndarray:
+    """
+    :param spot: underlying price
+    :param strike: array of strikes
+    :param t: time to expiry in years
+    :param rate: risk free rate
+    :param sigma: array of volatilities
+    :param is_call: boolean array, True for calls and False for puts
+    :return: array of option prices
+    """
+    d1, d2 = d1_d2(spot, strike, t, rate, sigma)
+    discount = strike * np.exp(-rate * t)
+    call = spot * norm_cdf(d1) - discount * norm_cdf(d2)
+    # Put call parity
+    return np.where(is_call, call, call - spot + discount)
+
+
+def bs_delta(spot, strike, t, rate, sigma, is_call) -> np.ndarray:
+    """
+    :return: array of deltas, positive for calls and negative for puts
+    """
+    d1, _ = d1_d2(spot, strike, t, rate, sigma)
+    cdf = norm_cdf(d1)
+    return np.where(is_call, cdf, cdf - 1)
+
+
+def implied_vol(price, spot, strike, t, rate, is_call, iterations: int = 30, tolerance: float = 1e-4) -> np.ndarray:
+    """
+    Solve implied volatility of all options together, newton steps which leave bracket are replaced by bisection
+    :param price: array of option prices
+    :param spot: underlying price
+    :param strike: array of strikes
+    :param t: time to expiry in years
+    :param rate: risk free rate
+    :param is_call: boolean array, True for calls and False for puts
+    :param iterations: maximum iterations
+    :param tolerance: price tolerance
+    :return: array of implied volatilities, nan where price is outside no arbitrage bounds
+    """
+    price, strike, is_call = np.asarray(price, float), np.asarray(strike, float), np.asarray(is_call, bool)
+    discount = strike * np.exp(-rate * t)
+    intrinsic = np.where(is_call, np.maximum(spot - discount, 0), np.maximum(discount - spot, 0))
+    upper = np.where(is_call, spot, discount)
+    valid = (price > intrinsic) & (price < upper)
+
+    low, high = np.full(price.shape, 1e-4), np.full(price.shape, 5.0)
+    sigma = np.full(price.shape, 0.2)
+    # Only options not converged yet are computed in each iteration
+    active = np.flatnonzero(valid)
+    for _ in range(iterations):
+        s, k, c = sigma[active], strike[active], is_call[active]
+        diff = bs_price(spot, k, t, rate, s, c) - price[active]
+        converged = np.abs(diff) < tolerance
+        # Price increases with volatility
+        high[active] = np.where(diff > 0, s, high[active])
+        low[active] = np.where(diff <= 0, s, low[active])
+        d1, _ = d1_d2(spot, k, t, rate, s)
+        vega = spot * norm_pdf(d1) * np.sqrt(t)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            newton = s - diff / vega
+        step = np.where((vega > 1e-8) & (newton > low[active]) & (newton < high[active]), newton,
+                        (low[active] + high[active]) / 2)
+        sigma[active] = np.where(converged, s, step)
+        active = active[~converged]
+        if not len(active):
+            break
+    return np.where(valid, sigma, np.nan)
+
+
+def chain_deltas(spot: float, strikes, prices, is_call, t: float, rate: float) -> tuple:
+    """
+    :param spot: underlying price
+    :param strikes: strikes of options
+    :param prices: last prices of options
+    :param is_call: True for calls and False for puts
+    :param t: time to expiry in years
+    :param rate: risk free rate
+    :return: tuple of implied volatility and delta arrays, nan where implied volatility couldn't be solved
+    """
+    strikes, is_call = np.asarray(strikes, float), np.asarray(is_call, bool)
+    iv = implied_vol(prices, spot, strikes, t, rate, is_call)
+    with np.errstate(invalid='ignore'):
+        return iv, bs_delta(spot, strikes, t, rate, iv, is_call)
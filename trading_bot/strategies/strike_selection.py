@@ -1,6 +1,8 @@
+import time
 from datetime import datetime
 
-from trading_bot.settings import TZ, logger
+from trading_bot.settings import TZ, logger, PREARM_LEAD, PREARM_INTERVAL, PREARM_SHORTLIST, RISK_FREE_RATE, \
+    EXPIRY_TIME
 
 """
 Strike selection strategy
@@ -9,7 +11,8 @@ Strike selection strategy
 
 class StrikeSelection:
     def __init__(self, client, symbol, exchange, expiry_date, start_time, end_time, lots,
-                 opt_type='both', call_premium=None, put_premium=None, strike_dist=0, strike_diff=1):
+                 opt_type='both', call_premium=None, put_premium=None, strike_dist=0, strike_diff=1,
+                 call_delta=None, put_delta=None):
         """
         StrikeSelection class to select strikes based on given parameter
         :param client: trading client
@@ -24,6 +27,8 @@ class StrikeSelection:
         :param put_premium: put premium amount
         :param strike_dist: distance from ATM strike
         :param strike_diff: strike diff, i.e.if 100 then only select strikes divisible by 100, for ex. 10100, 10200 etc
+        :param call_delta: call delta to select strike with closest delta i.e. 0.3
+        :param put_delta: put delta to select strike with closest absolute delta i.e. 0.3
         """
         self.client = client
         self.symbol = symbol
@@ -33,12 +38,19 @@ class StrikeSelection:
         self.put_premium = put_premium
         self.strike_dist = strike_dist
         self.strike_diff = strike_diff
+        self.call_delta = call_delta
+        self.put_delta = put_delta
         self.opt_type = opt_type
         self.start_time = start_time
         self.end_time = end_time
         self.lots = lots
         self.strikes_retrieved = False
 
+        # Candidate strikes shortlisted before start time
+        self.ce_shortlist = []
+        self.pe_shortlist = []
+        self.prearm_time = None
+
         # Create list of call and put instruments
         index_name_mapper = {'NIFTY 50': 'NIFTY', 'NIFTY BANK': 'BANKNIFTY'}
         symbol = self.symbol if self.symbol not in index_name_mapper else index_name_mapper[self.symbol]
@@ -60,37 +72,187 @@ class StrikeSelection:
                          f'Make sure you provided right parameters')
             self.strikes_retrieved = True
             return
-        # Wait until start time reached
-        if datetime.now(tz=TZ).time() < self.start_time:
+        # Wait until start time reached, shortlist strikes shortly before it
+        now = datetime.now(tz=TZ)
+        if now.time() < self.start_time:
+            seconds_left = (datetime.combine(now.date(), self.start_time) - now.replace(tzinfo=None)).total_seconds()
+            if seconds_left <= PREARM_LEAD and (
+                    self.prearm_time is None or time.monotonic() - self.prearm_time >= PREARM_INTERVAL):
+                self.prearm()
             return 'wait'
         self.strikes_retrieved = True
 
         # If call premium and put_premium specified then retrieve strikes based on that
         if self.call_premium and self.put_premium:
-            call_instrument = self.client.map_strikes_based_on_premium(self.ce_opts, self.call_premium)
-            put_instrument = self.client.map_strikes_based_on_premium(self.pe_opts, self.put_premium)
+            call_instrument = self.select_by_premium(self.ce_shortlist, self.ce_opts, self.call_premium)
+            put_instrument = self.select_by_premium(self.pe_shortlist, self.pe_opts, self.put_premium)
             if call_instrument is None or put_instrument is None:
                 return
+        elif self.call_delta and self.put_delta:  # If deltas specified then retrieve strikes with closest deltas
+            # Shortlist is used only if deltas of its strikes are on both sides of required deltas
+            if len(self.ce_shortlist) and len(self.pe_shortlist):
+                instruments = self.select_by_delta(self.ce_shortlist + self.pe_shortlist,
+                                                   full_opts=self.ce_opts + self.pe_opts)
+            else:
+                instruments = self.select_by_delta(self.ce_opts + self.pe_opts)
+            if instruments is None:
+                return
+            call_instrument, put_instrument = instruments[0][0], instruments[1][0]
         else:  # Else retrieve strikes based on distance to atm i.e. using strike_dist and strike_diff parameters
-            # Get ltp of underlying
-            key = f'{self.exchange}:{self.symbol}'
-            params = f'i={key}'
-            ltp = self.client.get_ltp(params=params)
+            ltp = self.get_underlying_ltp()
             if ltp is None:
-                logger.exception(f"could not find ltp for given params: {params}")
                 return
-            ltp = ltp[key]['last_price']
+            # Use shortlist only if it contains strikes on both sides of required strikes
+            ce_opts = self.ce_shortlist if self.covers(self.ce_shortlist, ltp + self.strike_dist) else self.ce_opts
+            pe_opts = self.pe_shortlist if self.covers(self.pe_shortlist, ltp - self.strike_dist) else self.pe_opts
             # Get option instrument based underlying ltp and strike_dist and strike_diff parameters
-            instruments = self.client.map_option_strikes(ltp, self.strike_dist, self.strike_diff, self.ce_opts,
-                                                         self.pe_opts)
+            instruments = self.client.map_option_strikes(ltp, self.strike_dist, self.strike_diff, ce_opts, pe_opts)
             if instruments is None:
                 return
             call_instrument, put_instrument = instruments
 
         call_instrument['lots'] = put_instrument['lots'] = self.lots
         call_instrument['end_time'] = put_instrument['end_time'] = self.end_time
+        call_instrument['start_time'] = put_instrument['start_time'] = self.start_time
+        logger.info('%s: strikes selected %.1f ms after start time', self.symbol,
+                    (datetime.now(tz=TZ).replace(tzinfo=None) -
+                     datetime.combine(now.date(), self.start_time)).total_seconds() * 1000)
         if self.opt_type == 'CALL':
             return [call_instrument]
         elif self.opt_type == 'PUT':
             return [put_instrument]
         return [call_instrument, put_instrument]
+
+    def get_underlying_ltp(self):
+        """
+        :return: ltp of underlying if retrieved else None
+        """
+        key = f'{self.exchange}:{self.symbol}'
+        params = f'i={key}'
+        ltp = self.client.get_ltp(params=params)
+        if ltp is None:
+            logger.exception(f"could not find ltp for given params: {params}")
+            return
+        return ltp[key]['last_price']
+
+    def prearm(self):
+        """
+        Shortlist candidate strikes from live quotes, requests also keep client connections warm
+        so only final pick remains at start time
+        """
+        self.prearm_time = time.monotonic()
+        if self.call_premium and self.put_premium:
+            self.ce_shortlist = self.shortlist_by_premium(self.ce_opts, self.call_premium)
+            self.pe_shortlist = self.shortlist_by_premium(self.pe_opts, self.put_premium)
+        elif self.call_delta and self.put_delta:
+            instruments = self.select_by_delta(self.ce_opts + self.pe_opts, shortlist=PREARM_SHORTLIST)
+            if instruments is None:
+                return
+            self.ce_shortlist, self.pe_shortlist = instruments
+        else:
+            ltp = self.get_underlying_ltp()
+            if ltp is None:
+                return
+            self.ce_shortlist = self.shortlist_by_strike(self.ce_opts, ltp + self.strike_dist)
+            self.pe_shortlist = self.shortlist_by_strike(self.pe_opts, ltp - self.strike_dist)
+        logger.debug(f'{self.symbol}: pre-armed, call strikes: {[i["strike"] for i in self.ce_shortlist]}, '
+                     f'put strikes: {[i["strike"] for i in self.pe_shortlist]}')
+
+    def shortlist_by_strike(self, opts: list, price: float) -> list:
+        """
+        :param opts: list of option instruments
+        :param price: price around which strikes are required
+        :return: option instruments of strikes closest to price, strikes are contiguous
+        """
+        opts = [i for i in opts if not i['strike'] % self.strike_diff]
+        return sorted(opts, key=lambda i: abs(i['strike'] - price))[:PREARM_SHORTLIST * 2]
+
+    def shortlist_by_premium(self, opts: list, premium: float) -> list:
+        """
+        :param opts: list of option instruments
+        :param premium: premium amount
+        :return: option instruments with premium closest to premium amount
+        """
+        keys = {f"{i['exchange']}:{i['tradingsymbol']}": i for i in opts}
+        ltps = self.client.get_ltp(params=''.join([f"i={i}&" for i in keys]))
+        if ltps is None:
+            return []
+        ltps = sorted([i for i in ltps if i in keys], key=lambda i: abs(ltps[i]['last_price'] - premium))
+        return [keys[i] for i in ltps[:PREARM_SHORTLIST * 2]]
+
+    def select_by_premium(self, shortlist: list, opts: list, premium: float):
+        """
+        Select option from shortlist if premiums of its strikes are on both sides of premium amount,
+        else premium moved away since shortlisting and all options are scanned
+        :param shortlist: list of shortlisted option instruments
+        :param opts: list of all option instruments of same type
+        :param premium: premium amount
+        :return: option instrument with premium closest to premium amount, None if quotes not found
+        """
+        if not len(shortlist):
+            return self.client.map_strikes_based_on_premium(opts, premium)
+        keys = {f"{i['exchange']}:{i['tradingsymbol']}": i for i in shortlist}
+        ltps = self.client.get_ltp(params=''.join([f"i={i}&" for i in keys]))
+        if ltps is None:
+            logger.exception(f"could not find ltp for {self.symbol} shortlisted options")
+            return
+        prices = {k: ltps[k]['last_price'] for k in keys if k in ltps}
+        if not len(prices) or not min(prices.values()) <= premium <= max(prices.values()):
+            logger.debug(f'{self.symbol}: premium {premium} not covered by shortlist, scanning all strikes')
+            return self.client.map_strikes_based_on_premium(opts, premium)
+        return keys[min(prices, key=lambda k: abs(prices[k] - premium))]
+
+    @staticmethod
+    def covers(shortlist: list, price: float) -> bool:
+        """
+        :return: True if strikes of shortlist are on both sides of price
+        """
+        if not len(shortlist):
+            return False
+        strikes = [i['strike'] for i in shortlist]
+        return min(strikes) <= price <= max(strikes)
+
+    def select_by_delta(self, opts: list, shortlist: int = 0, full_opts: list = None):
+        """
+        Compute implied volatility and delta of all options from one quote snapshot
+        :param opts: list of call and put option instruments
+        :param shortlist: number of options kept on each side of target delta, only closest option if 0
+        :param full_opts: options selected from instead if deltas of opts are not on both sides of target delta
+                          i.e. deltas moved away since opts were shortlisted
+        :return: tuple of call and put option lists ordered by closeness to target delta, None if quotes not found
+        """
+        import numpy as np
+        from trading_bot.strategies.greeks import chain_deltas
+
+        key = f'{self.exchange}:{self.symbol}'
+        keys = [f"{i['exchange']}:{i['tradingsymbol']}" for i in opts]
+        ltps = self.client.get_ltp(params=''.join([f"i={i}&" for i in [key] + keys]))
+        if ltps is None or key not in ltps:
+            logger.exception(f"could not find ltp for {self.symbol} option chain")
+            return
+        opts = [(o, ltps[k]['last_price']) for o, k in zip(opts, keys) if k in ltps]
+        expiry = datetime.combine(self.expiry_date, EXPIRY_TIME)
+        t = max((expiry - datetime.now(tz=TZ).replace(tzinfo=None)).total_seconds(), 60) / (365 * 24 * 3600)
+        is_call = np.array([o['instrument_type'] == 'CE' for o, _ in opts])
+        _, deltas = chain_deltas(ltps[key]['last_price'], [o['strike'] for o, _ in opts], [p for _, p in opts],
+                                 is_call, t, RISK_FREE_RATE)
+
+        # Distance of absolute delta from target, options without delta are not selected
+        target = np.where(is_call, abs(self.call_delta), abs(self.put_delta))
+        distance = np.nan_to_num(np.abs(np.abs(deltas) - target), nan=np.inf)
+        count = max(shortlist * 2, 1)
+        result = []
+        for side in [is_call, ~is_call]:
+            index = np.flatnonzero(side & np.isfinite(distance))
+            if not len(index):
+                logger.debug(f'{self.symbol}: no delta could be computed for option chain')
+                return
+            if full_opts is not None:
+                side_deltas = np.abs(deltas[index])
+                if not side_deltas.min() <= target[index[0]] <= side_deltas.max():
+                    logger.debug(f'{self.symbol}: delta {target[index[0]]} not covered by shortlist, '
+                                 f'scanning all strikes')
+                    return self.select_by_delta(full_opts, shortlist)
+            index = index[np.argsort(distance[index])][:count]
+            result.append([opts[i][0] for i in index])
+        return result
@@ -0,0 +1,162 @@
+from collections import defaultdict, deque
+from datetime import datetime, time, timedelta
+from threading import Lock
+
+from trading_bot.settings import logger, TZ
+
+"""
+Candle builder to aggregate live ticks into candles
+"""
+
+# Kite historical data intervals for time frames in seconds
+INTERVALS = {60: 'minute', 180: '3minute', 300: '5minute', 600: '10minute', 900: '15minute', 1800: '30minute',
+             3600: '60minute'}
+MARKET_OPEN = time(9, 15)
+
+
+def field(tick, name: str):
+    """
+    :return: tick field, None if tick doesn't have it, works for tick dicts and tick ring records
+    """
+    try:
+        return tick[name]
+    except (KeyError, ValueError):
+        return
+
+
+class CandleBuilder:
+    def __init__(self, time_frames: list = None, size: int = 375, origin: time = MARKET_OPEN):
+        """
+        CandleBuilder class to build candles of each token incrementally from ticks,
+        completed candles are kept in fixed size buffers so recent candles are available without api calls
+        :param time_frames: list of time frames in seconds, [60] if None
+        :param size: number of completed candles kept per token and time frame
+        :param origin: time candles are aligned to, i.e. 09:15 for 60 minute candles starting at market open
+        """
+        self.time_frames = time_frames if time_frames is not None else [60]
+        self.size = size
+        self.origin = origin.hour * 3600 + origin.minute * 60 + origin.second
+        self.lock = Lock()
+
+        # Completed candles, candle being built and last cumulative volume of each token
+        self.candles = {tf: defaultdict(lambda: deque(maxlen=self.size)) for tf in self.time_frames}
+        self.current = {tf: dict() for tf in self.time_frames}
+        self.last_volume = dict()
+
+    def candle_start(self, timestamp: datetime, time_frame: int) -> datetime:
+        """
+        :return: start time of candle containing timestamp
+        """
+        seconds = timestamp.hour * 3600 + timestamp.minute * 60 + timestamp.second - self.origin
+        return datetime.combine(timestamp.date(), time()) + timedelta(
+            seconds=self.origin + seconds // time_frame * time_frame)
+
+    @staticmethod
+    def tick_time(tick) -> datetime:
+        """
+        :return: exchange time of tick, current time if tick doesn't have it
+        """
+        timestamp = field(tick, 'exchange_timestamp')
+        if isinstance(timestamp, datetime):
+            return timestamp
+        if timestamp:
+            # Tick ring records store epoch seconds
+            return datetime.fromtimestamp(float(timestamp))
+        return datetime.now(tz=TZ).replace(tzinfo=None)
+
+    def on_ticks(self, ticks):
+        """
+        Update candles with ticks
+        :param ticks: list of tick dicts or tick ring records
+        """
+        with self.lock:
+            for tick in ticks:
+                self.update(tick)
+
+    def update(self, tick):
+        """
+        Update candles of tick's token
+        :param tick: tick dict or tick ring record
+        """
+        price = field(tick, 'last_price')
+        if not price:
+            return
+        token = int(tick['instrument_token'])
+        timestamp = self.tick_time(tick)
+        # Candle volume is change of cumulative day volume
+        volume = field(tick, 'volume_traded')
+        last_volume = self.last_volume.get(token)
+        traded = max(0, volume - last_volume) if volume and last_volume is not None else 0
+        if volume:
+            self.last_volume[token] = volume
+
+        for tf in self.time_frames:
+            start = self.candle_start(timestamp, tf)
+            candle = self.current[tf].get(token)
+            if candle is None or start > candle[0]:
+                if candle is not None:
+                    self.candles[tf][token].append(tuple(candle))
+                self.current[tf][token] = [start, price, price, price, price, traded]
+            elif start == candle[0]:
+                candle[2] = max(candle[2], price)
+                candle[3] = min(candle[3], price)
+                candle[4] = price
+                candle[5] += traded
+
+    def last(self, token: int, n: int = 1, time_frame: int = None, include_current: bool = False) -> list:
+        """
+        :param token: instrument token
+        :param n: number of candles
+        :param time_frame: time frame in seconds, first time frame if None
+        :param include_current: add candle being built as last candle
+        :return: list of (start, open, high, low, close, volume) tuples, oldest first
+        """
+        time_frame = time_frame if time_frame is not None else self.time_frames[0]
+        with self.lock:
+            candles = self.candles[time_frame].get(token, ())
+            current = self.current[time_frame].get(token) if include_current else None
+            count = n - 1 if current is not None else n
+            result = [candles[i] for i in range(max(0, len(candles) - count), len(candles))] if count > 0 else []
+            if current is not None:
+                result.append(tuple(current))
+            return result
+
+    def seed(self, client, instruments: dict, days: int = 5):
+        """
+        Load recent candles from historical data, ticks continue candles from there
+        :param client: kite client
+        :param instruments: dict of instrument token and trading symbol
+        :param days: number of days to load
+        """
+        end_date = datetime.now(tz=TZ).date()
+        start_date = end_date - timedelta(days=days)
+        for tf in self.time_frames:
+            if tf not in INTERVALS:
+                logger.debug(f'No historical interval for time frame: {tf}, candles are built from ticks only')
+                continue
+            for token, symbol in instruments.items():
+                df = client.get_data(symbol, token, str(start_date), str(end_date), INTERVALS[tf])
+                if df is None:
+                    continue
+                self.seed_candles(int(token), tf, [(r.Index.to_pydatetime(), r.open, r.high, r.low, r.close,
+                                                    r.volume) for r in df.itertuples()])
+
+    def seed_candles(self, token: int, time_frame: int, candles: list):
+        """
+        Add candles before candles built from ticks, last candle is continued if it's still being built
+        :param token: instrument token
+        :param time_frame: time frame in seconds
+        :param candles: list of (start, open, high, low, close, volume) tuples, oldest first
+        """
+        with self.lock:
+            current = self.current[time_frame].get(token)
+            built = list(self.candles[time_frame][token])
+            # Candles built from ticks are kept, only older candles are added
+            first = built[0][0] if len(built) else current[0] if current is not None else None
+            candles = [c for c in candles if first is None or c[0] < first]
+            if first is None and len(candles) and candles[-1][0] == self.candle_start(
+                    datetime.now(tz=TZ).replace(tzinfo=None), time_frame):
+                self.current[time_frame][token] = list(candles.pop())
+            queue = self.candles[time_frame][token]
+            queue.clear()
+            queue.extend(candles + built)
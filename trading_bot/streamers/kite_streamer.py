@@ -1,40 +1,100 @@
 import json
+import time
 from collections import defaultdict
-from queue import Queue
+from queue import Queue, Full, Empty
 from threading import Thread
 
 import websocket
-from kiteconnect import KiteTicker
 
-from trading_bot.settings import logger
+from trading_bot.settings import logger, TICKS_QUEUE_SIZE, TICKS_DROP_WARNING_INTERVAL
+
+# Order statuses after which order is not updated anymore
+FINAL_STATUSES = ('COMPLETE', 'REJECTED', 'CANCELLED')
 
 """
 Kite streamer to get real time data feed
 """
 
 
+def pop_all(items: set) -> set:
+    """
+    Remove all items of set which is updated by other thread
+    :param items: set
+    :return: set of removed items
+    """
+    removed = set()
+    while len(items):
+        try:
+            removed.add(items.pop())
+        except KeyError:
+            break
+    return removed
+
+
+def store_order_update(orders_queue: defaultdict, message: dict, updated_symbols: set = None):
+    """
+    Store order update, only latest update of each order is kept so symbol's list grows with orders
+    and not with updates i.e. trailing sl modifications
+    :param orders_queue: dict of symbol and list of order updates
+    :param message: order update
+    :param updated_symbols: set to add symbol of order update to
+    """
+    if updated_symbols is not None:
+        updated_symbols.add(message['tradingsymbol'])
+    orders = orders_queue[message['tradingsymbol']]
+    for i, o in enumerate(orders):
+        if o['order_id'] == message['order_id']:
+            # Updates can arrive out of order, final status is not replaced
+            if o['status'] not in FINAL_STATUSES:
+                orders[i] = message
+            return
+    orders.append(message)
+
+
 class KiteStreamer:
-    def __init__(self, user_id: str, ws_token: str):
+    def __init__(self, user_id: str, ws_token: str, recorder=None):
         """
         KiteStreamer class to stream real time data for subscribed instruments
         :param user_id: zerodha kite user id
         :param ws_token: authentication token
+        :param recorder: tick recorder to store received ticks, ticks are not stored if None
         """
         self.user_id = user_id
         self.ws_url = 'wss://ws.zerodha.com'
         self.ua_string = 'user-agent=kite3-web&version=2.9.3'
         self.key_string = 'kitefront'
         self.uid = "1605085892719"
-        self.ws_token = ws_token
-        self.connection_string = f'{self.ws_url}/?api_key={self.key_string}&user_id={self.user_id}&' \
-                                 f'enctoken={self.ws_token}&uid={self.uid}&{self.ua_string}'
-        self.ws_client = KiteTicker(self.key_string, self.ws_token)
+        self.ws_token = None
+        self.connection_string = None
+        self.ws_client = None
+        self.set_token(ws_token)
         self.ws = None
+        # Instruments are sent once websocket is open, all subscriptions are sent again after reconnect
+        self.connected = False
+        self.recorder = recorder
 
         # Variable for string orders, ticks and subscribed instruments
         self.orders_queue = defaultdict(list)
-        self.ticks_queue = Queue()
-        self.subscribed_instruments = []
+        self.updated_symbols = set()
+        self.ticks_queue = Queue(maxsize=TICKS_QUEUE_SIZE)
+        self.subscribed_instruments = set()
+        self.ticks_dropped = 0
+        # Dropped batches already warned about and monotonic time of last warning
+        self.ticks_drop_warned = 0
+        self.ticks_drop_warning_time = None
+
+    def set_token(self, ws_token: str):
+        """
+        Set authentication token used by next connection, called by client when session changes
+        so reconnects after relogin don't use expired token
+        :param ws_token: authentication token
+        """
+        # kiteconnect loads twisted and autobahn, only binary parser of KiteTicker is used
+        from kiteconnect import KiteTicker
+        self.ws_client = KiteTicker(self.key_string, ws_token)
+        self.connection_string = f'{self.ws_url}/?api_key={self.key_string}&user_id={self.user_id}&' \
+                                 f'enctoken={ws_token}&uid={self.uid}&{self.ua_string}'
+        self.ws_token = ws_token
 
     def on_message(self, ws, message):
         """
@@ -45,11 +105,44 @@ class KiteStreamer:
             message = json.loads(message)
             if 'tradingsymbol' in message:
                 # Store order data
-                self.orders_queue[message['tradingsymbol']].append(message)
+                store_order_update(self.orders_queue, message, self.updated_symbols)
             return
         # If it's ticks data
         ticks = self.ws_client._parse_binary(message)  # Parse binary data
-        self.ticks_queue.put(ticks)
+        self.put_ticks(ticks)
+        if self.recorder is not None:
+            self.recorder.record(ticks)
+
+    def put_ticks(self, ticks: list):
+        """
+        Add tick batch to ticks queue, oldest batch is dropped if queue is full
+        i.e. ticks are not consumed while there are no trading instances, so latest prices are kept
+        :param ticks: list of ticks
+        """
+        try:
+            self.ticks_queue.put_nowait(ticks)
+        except Full:
+            try:
+                self.ticks_queue.get_nowait()
+            except Empty:
+                pass
+            self.ticks_dropped += 1
+            self.ticks_queue.put_nowait(ticks)
+            self.warn_ticks_dropped()
+
+    def warn_ticks_dropped(self):
+        """
+        Log dropped tick batches at most once per warning interval so slow consumer is visible without
+        flooding logs from websocket thread
+        """
+        now = time.monotonic()
+        if self.ticks_drop_warning_time is not None and \
+                now - self.ticks_drop_warning_time < TICKS_DROP_WARNING_INTERVAL:
+            return
+        logger.warning(f'Ticks queue full, dropped {self.ticks_dropped - self.ticks_drop_warned} tick batches '
+                       f'since last warning, total dropped: {self.ticks_dropped}')
+        self.ticks_drop_warned = self.ticks_dropped
+        self.ticks_drop_warning_time = now
 
     def subscribe(self, instruments: list):
         """
@@ -57,27 +150,41 @@ class KiteStreamer:
         :param instruments: list of instrument tokens
         """
         if len(instruments):
-            self.ws.send(json.dumps({"a": "mode", "v": ["full", instruments]}))
-            self.subscribed_instruments.extend(instruments)
+            self.subscribed_instruments.update(instruments)
+            if self.connected:
+                self.send_subscriptions(instruments)
+
+    def send_subscriptions(self, instruments: list):
+        """
+        Send subscription request, instruments not sent are sent when websocket opens again
+        :param instruments: list of instrument tokens
+        """
+        try:
+            self.ws.send(json.dumps({"a": "mode", "v": ["full", [int(i) for i in instruments]]}))
+        except Exception as e:
+            logger.debug(f'Subscription of {len(instruments)} instruments not sent, sent again on reconnect: {e}')
 
     def on_error(self, ws, error):
         """
         Handle error
         """
         logger.debug(error)
+        self.connected = False
         self.start_streaming()
 
     def on_close(self, ws, code, reason):
         """
         Handle WS close event
         """
-        pass
+        self.connected = False
 
     def on_open(self, ws):
         """
-        Handle WS close event
+        Handle WS open event, subscriptions requested before connection or lost by reconnect are sent
         """
-        pass
+        self.connected = True
+        if len(self.subscribed_instruments):
+            self.send_subscriptions(list(self.subscribed_instruments))
 
     def start_streaming(self):
         """
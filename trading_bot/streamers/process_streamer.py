@@ -0,0 +1,211 @@
+import atexit
+import json
+import multiprocessing as mp
+from collections import defaultdict
+from queue import Empty
+from threading import Thread
+
+from trading_bot.settings import logger
+from trading_bot.streamers.kite_streamer import KiteStreamer, store_order_update
+from trading_bot.streamers.tick_ring import TickRing
+
+"""
+Kite streamer running in separate process, ticks are passed through shared memory ring buffer
+"""
+
+
+class RingKiteStreamer(KiteStreamer):
+    def __init__(self, user_id: str, ws_token: str, ring: TickRing, orders_queue: mp.Queue, recorder=None):
+        """
+        RingKiteStreamer class to run in feed process and write parsed ticks to ring buffer
+        :param user_id: zerodha kite user id
+        :param ws_token: authentication token
+        :param ring: tick ring attached to shared memory
+        :param orders_queue: queue to send order updates to controller process
+        :param recorder: tick recorder to store received ticks, ticks are not stored if None
+        """
+        super().__init__(user_id=user_id, ws_token=ws_token, recorder=recorder)
+        self.ring = ring
+        self.orders_queue = orders_queue
+
+    def on_message(self, ws, message):
+        """
+        Receive web socket message
+        """
+        if isinstance(message, str):
+            # If it's order update
+            message = json.loads(message)
+            if 'tradingsymbol' in message:
+                self.orders_queue.put(message)
+            return
+        # If it's ticks data
+        ticks = self.ws_client._parse_binary(message)
+        if len(ticks):
+            self.ring.write(ticks)
+            if self.recorder is not None:
+                self.recorder.record(ticks)
+
+
+def run_feed(user_id: str, ws_token: str, ring_name: str, capacity: int, orders_queue: mp.Queue,
+             commands_queue: mp.Queue, record: bool = False):
+    """
+    Entry point of feed process, streams data and subscribes instruments received on commands queue,
+    tuple of 'token' and authentication token received on commands queue sets token for reconnects
+    """
+    ring = TickRing(capacity=capacity, name=ring_name)
+    recorder = None
+    if record:
+        from trading_bot.streamers.tick_recorder import TickRecorder
+        recorder = TickRecorder()
+    streamer = RingKiteStreamer(user_id=user_id, ws_token=ws_token, ring=ring, orders_queue=orders_queue,
+                                recorder=recorder)
+    streamer.start_streaming()
+    while True:
+        command = commands_queue.get()
+        if command is None:
+            break
+        # Errors are logged so feed keeps running, failed subscriptions are sent again when websocket opens
+        try:
+            if isinstance(command, tuple) and command[0] == 'token':
+                streamer.set_token(command[1])
+            else:
+                streamer.subscribe(instruments=command)
+        except Exception as e:
+            logger.exception(e)
+    if recorder is not None:
+        recorder.stop()
+    ring.close()
+
+
+class RingTicksQueue:
+    def __init__(self, ring: TickRing):
+        """
+        Queue like reader of tick ring used by controller in place of ticks queue
+        :param ring: tick ring
+        """
+        self.ring = ring
+
+    def empty(self) -> bool:
+        return self.ring.empty()
+
+    def get(self):
+        """
+        :return: structured array of all unread ticks
+        """
+        return self.ring.read()
+
+
+class ProcessKiteStreamer:
+    def __init__(self, user_id: str, ws_token: str, capacity: int = 65536, record: bool = False):
+        """
+        ProcessKiteStreamer class to stream real time data in separate process,
+        it has same interface as KiteStreamer for controller
+        :param user_id: zerodha kite user id
+        :param ws_token: authentication token
+        :param capacity: number of ticks ring buffer can hold
+        :param record: record ticks in feed process
+        """
+        self.user_id = user_id
+        self.ws_token = ws_token
+        self.record = record
+        self.ring = TickRing(capacity=capacity)
+        self.ctx = mp.get_context('spawn')
+        self.orders_updates = self.ctx.Queue()
+        self.commands = self.ctx.Queue()
+        self.process = None
+
+        # Variable for string orders, ticks and subscribed instruments
+        self.orders_queue = defaultdict(list)
+        self.updated_symbols = set()
+        self.ticks_queue = RingTicksQueue(self.ring)
+        self.subscribed_instruments = set()
+        self.restarts = 0
+        self.stopped = False
+        # Shared memory is removed on exit
+        atexit.register(self.stop_streaming)
+
+    def start_streaming(self):
+        """
+        Start feed process and thread to receive order updates
+        """
+        self.start_feed()
+        orders_thread = Thread(target=self.receive_orders)
+        orders_thread.daemon = True
+        orders_thread.start()
+
+    def start_feed(self):
+        """
+        Start feed process, it attaches to existing ring buffer
+        """
+        self.process = self.ctx.Process(target=run_feed, daemon=True,
+                                        args=(self.user_id, self.ws_token, self.ring.name, self.ring.capacity,
+                                              self.orders_updates, self.commands, self.record))
+        self.process.start()
+        logger.debug(f'Feed process started, pid: {self.process.pid}')
+
+    def check_feed(self):
+        """
+        Restart feed process if it died, subscriptions are sent to new process
+        """
+        if self.stopped or self.process is None or self.process.is_alive():
+            return
+        self.restarts += 1
+        logger.error(f'Feed process died with exit code {self.process.exitcode}, restarting, '
+                     f'restarts: {self.restarts}')
+        # Commands left for dead process are dropped, subscriptions are sent again
+        while True:
+            try:
+                self.commands.get_nowait()
+            except Empty:
+                break
+        self.start_feed()
+        if len(self.subscribed_instruments):
+            self.commands.put([int(i) for i in self.subscribed_instruments])
+
+    def receive_orders(self):
+        """
+        Store order updates received from feed process
+        """
+        while True:
+            try:
+                message = self.orders_updates.get(timeout=1)
+            except Empty:
+                continue
+            store_order_update(self.orders_queue, message, self.updated_symbols)
+
+    def subscribe(self, instruments: list):
+        """
+        sunscribe instruments for live data
+        :param instruments: list of instrument tokens
+        """
+        if len(instruments):
+            self.commands.put([int(i) for i in instruments])
+            self.subscribed_instruments.update(instruments)
+
+    def set_token(self, ws_token: str):
+        """
+        Send authentication token to feed process, called by client when session changes
+        :param ws_token: authentication token
+        """
+        self.ws_token = ws_token
+        self.commands.put(('token', ws_token))
+
+    def stats(self) -> dict:
+        """
+        :return: ring buffer counters
+        """
+        return self.ring.stats()
+
+    def stop_streaming(self):
+        """
+        Stop feed process and remove shared memory
+        """
+        if self.stopped:
+            return
+        self.stopped = True
+        self.commands.put(None)
+        if self.process is not None:
+            self.process.join(timeout=5)
+            if self.process.is_alive():
+                self.process.terminate()
+        self.ring.close()
@@ -0,0 +1,199 @@
+import atexit
+import os
+import time
+from datetime import datetime
+from queue import Queue, Full, Empty
+from threading import Thread
+
+import numpy as np
+
+from trading_bot.settings import TICKS_DIR, TICK_RECORDER_QUEUE_SIZE, TZ, logger
+
+"""
+Append-only tick recorder, ticks are stored as one file per column per day
+"""
+
+# Prices are stored in paise to keep columns compact
+TICK_COLUMNS = {'received_time': 'f8', 'instrument_token': 'u4', 'last_price': 'i4', 'last_traded_quantity': 'i4',
+                'average_traded_price': 'i4', 'volume_traded': 'i8', 'total_buy_quantity': 'i8',
+                'total_sell_quantity': 'i8', 'oi': 'i8', 'last_trade_time': 'u4', 'exchange_timestamp': 'u4'}
+PRICE_COLUMNS = ['last_price', 'average_traded_price']
+
+
+class TickRecorder:
+    def __init__(self, base_dir=TICKS_DIR, max_pending: int = TICK_RECORDER_QUEUE_SIZE):
+        """
+        TickRecorder class to write ticks in background thread, ticks are appended to
+        <base_dir>/<date>/<column>.bin files and compressed to ticks.npz once day is over
+        :param base_dir: directory to store ticks
+        :param max_pending: maximum tick batches waiting for writer, batches are dropped when full
+        """
+        self.base_dir = base_dir
+        self.queue = Queue(maxsize=max_pending)
+        self.day = None
+        self.files = dict()
+        self.recorded = 0
+        self.dropped = 0
+
+        self.thread = Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+        atexit.register(self.stop)
+
+    def record(self, ticks: list):
+        """
+        Hand ticks to writer thread, never blocks
+        :param ticks: list of tick dicts parsed by kite ticker
+        """
+        try:
+            self.queue.put_nowait((time.time(), ticks))
+        except Full:
+            self.dropped += len(ticks)
+
+    def run(self):
+        """
+        Write tick batches, batches waiting in queue are written together
+        """
+        # Days recorded by earlier runs are compressed here, bot is usually stopped before day changes
+        try:
+            self.compact_past_days()
+        except Exception as e:
+            logger.exception(e)
+        while True:
+            item = self.queue.get()
+            batches = []
+            while item is not None:
+                batches.append(item)
+                try:
+                    item = self.queue.get_nowait()
+                except Empty:
+                    break
+            if len(batches):
+                try:
+                    self.write(batches)
+                except Exception as e:
+                    logger.exception(e)
+            if item is None:
+                break
+        self.close_files()
+
+    def write(self, batches: list):
+        """
+        Append tick batches to column files of current day
+        :param batches: list of tuples of received time and ticks
+        """
+        day = datetime.now(tz=TZ).date()
+        if day != self.day:
+            previous_day = self.day
+            self.close_files()
+            day_dir = self.base_dir / str(day)
+            os.makedirs(day_dir, exist_ok=True)
+            self.files = {c: open(day_dir / f'{c}.bin', 'ab') for c in TICK_COLUMNS}
+            self.day = day
+            if previous_day is not None:
+                self.compact(self.base_dir / str(previous_day))
+
+        columns = self.to_columns(batches)
+        for c, f in self.files.items():
+            f.write(columns[c].tobytes())
+            f.flush()
+        self.recorded += len(columns['instrument_token'])
+
+    @staticmethod
+    def to_columns(batches: list) -> dict:
+        """
+        :param batches: list of tuples of received time and ticks
+        :return: dict of column name and numpy array
+        """
+        rows = [(received_time, tick) for received_time, ticks in batches for tick in ticks]
+        columns = {'received_time': np.array([r[0] for r in rows], dtype=TICK_COLUMNS['received_time'])}
+        for c in ['instrument_token', 'last_traded_quantity', 'volume_traded', 'total_buy_quantity',
+                  'total_sell_quantity', 'oi']:
+            columns[c] = np.array([r[1].get(c) or 0 for r in rows], dtype=TICK_COLUMNS[c])
+        for c in PRICE_COLUMNS:
+            columns[c] = np.rint(np.array([r[1].get(c) or 0 for r in rows], dtype='f8') * 100).astype(TICK_COLUMNS[c])
+        for c in ['last_trade_time', 'exchange_timestamp']:
+            columns[c] = np.array([r[1][c].timestamp() if r[1].get(c) else 0 for r in rows], dtype=TICK_COLUMNS[c])
+        return columns
+
+    def close_files(self):
+        for f in self.files.values():
+            f.close()
+        self.files = dict()
+
+    def stop(self):
+        """
+        Write pending ticks and stop writer thread
+        """
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join(timeout=5)
+        if self.dropped:
+            logger.info(f'Tick recorder dropped {self.dropped} ticks, recorded: {self.recorded}')
+
+    def compact_past_days(self):
+        """
+        Compress column files of past days left by earlier runs
+        """
+        if not os.path.exists(self.base_dir):
+            return
+        today = str(datetime.now(tz=TZ).date())
+        for name in sorted(os.listdir(self.base_dir)):
+            day_dir = self.base_dir / name
+            if name < today and os.path.isdir(day_dir) and any(f.endswith('.bin') for f in os.listdir(day_dir)):
+                started = time.perf_counter()
+                self.compact(day_dir)
+                logger.debug('Ticks of %s compacted in %.1f s', name, time.perf_counter() - started)
+
+    @staticmethod
+    def compact(day_dir):
+        """
+        Compress column files of completed day to ticks.npz and remove them
+        :param day_dir: directory of day
+        """
+        paths = {c: day_dir / f'{c}.bin' for c in TICK_COLUMNS}
+        # Column files left after ticks.npz was written are removed
+        if (day_dir / 'ticks.npz').exists():
+            for p in paths.values():
+                if p.exists():
+                    os.remove(p)
+            return
+        if not all(p.exists() for p in paths.values()):
+            return
+        columns = {c: np.fromfile(p, dtype=TICK_COLUMNS[c]) for c, p in paths.items()}
+        length = min(len(a) for a in columns.values())
+        temp_path = day_dir / 'ticks.tmp.npz'
+        np.savez_compressed(temp_path, **{c: a[:length] for c, a in columns.items()})
+        os.replace(temp_path, day_dir / 'ticks.npz')
+        for p in paths.values():
+            os.remove(p)
+
+
+def read_ticks(day, base_dir=TICKS_DIR, tokens: list = None, decode: bool = True) -> dict:
+    """
+    Read recorded ticks of day, column files of current day are memory mapped
+    :param day: date
+    :param base_dir: directory ticks are stored in
+    :param tokens: instrument tokens to read, all tokens if None
+    :param decode: convert prices from paise to rupees
+    :return: dict of column name and numpy array in received order
+    """
+    day_dir = base_dir / str(day)
+    if (day_dir / 'ticks.npz').exists():
+        with np.load(day_dir / 'ticks.npz') as data:
+            columns = {c: data[c] for c in TICK_COLUMNS}
+    else:
+        columns = dict()
+        for c, dtype in TICK_COLUMNS.items():
+            path = day_dir / f'{c}.bin'
+            columns[c] = np.memmap(path, dtype=dtype, mode='r') if os.path.getsize(path) else np.empty(0, dtype)
+        # Writer may be between columns of a batch
+        length = min(len(a) for a in columns.values())
+        columns = {c: a[:length] for c, a in columns.items()}
+    if tokens is not None:
+        mask = np.isin(columns['instrument_token'], tokens)
+        columns = {c: a[mask] for c, a in columns.items()}
+    if decode:
+        for c in PRICE_COLUMNS:
+            columns[c] = columns[c] / 100
+    return columns
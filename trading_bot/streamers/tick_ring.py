@@ -0,0 +1,127 @@
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+"""
+Shared memory ring buffer to pass ticks between processes
+"""
+
+TICK_DTYPE = np.dtype([('instrument_token', 'i8'), ('last_price', 'f8'), ('last_traded_quantity', 'i8'),
+                       ('average_traded_price', 'f8'), ('volume_traded', 'i8'), ('total_buy_quantity', 'i8'),
+                       ('total_sell_quantity', 'i8'), ('open', 'f8'), ('high', 'f8'), ('low', 'f8'),
+                       ('close', 'f8'), ('oi', 'i8'), ('last_trade_time', 'f8'), ('exchange_timestamp', 'f8')])
+
+# Header slots
+WRITE_SEQ, READ_SEQ, OVERRUNS, BACKPRESSURE, CLAIM_SEQ = range(5)
+HEADER_SIZE = 8 * 8
+
+
+class TickRing:
+    def __init__(self, capacity: int = 65536, name: str = None):
+        """
+        TickRing class to store ticks in fixed layout records in shared memory,
+        single feed process writes and single controller process reads
+        :param capacity: number of tick records
+        :param name: name of existing shared memory to attach, new shared memory is created if None
+        """
+        self.capacity = capacity
+        size = HEADER_SIZE + capacity * TICK_DTYPE.itemsize
+        self.shm = shared_memory.SharedMemory(name=name, create=name is None, size=size)
+        # Memory is unlinked by creator process only, feed process is spawned and shares resource tracker
+        # of creator so its registration of attached memory is not removed, removing it would make
+        # unlink of creator fail
+        self.owner = name is None
+        self.header = np.ndarray((8,), dtype=np.int64, buffer=self.shm.buf)
+        self.slots = np.ndarray((capacity,), dtype=TICK_DTYPE, buffer=self.shm.buf, offset=HEADER_SIZE)
+        if self.owner:
+            self.header[:] = 0
+        # Ticks returned by last read, they are released to writer on next read
+        self.consumed = int(self.header[READ_SEQ])
+
+    @property
+    def name(self) -> str:
+        return self.shm.name
+
+    def write(self, ticks: list, max_wait: float = 0.05):
+        """
+        Write ticks, if ring is full wait for reader up to max_wait and then overwrite oldest ticks
+        :param ticks: list of tick dicts
+        :param max_wait: seconds to wait for reader when ring is full
+        """
+        n = len(ticks)
+        write_seq = int(self.header[WRITE_SEQ])
+        if write_seq + n - self.header[READ_SEQ] > self.capacity:
+            self.header[BACKPRESSURE] += 1
+            deadline = time.monotonic() + max_wait
+            while write_seq + n - self.header[READ_SEQ] > self.capacity and time.monotonic() < deadline:
+                time.sleep(0.0005)
+        # Claim slots before writing so reader can detect records being overwritten
+        self.header[CLAIM_SEQ] = write_seq + n
+        for i, tick in enumerate(ticks):
+            self.slots[(write_seq + i) % self.capacity] = self.to_record(tick)
+        # Publish after records are written
+        self.header[WRITE_SEQ] = write_seq + n
+
+    def read(self) -> np.ndarray:
+        """
+        Read all unread ticks without copying unless they wrap around end of ring, returned ticks are view of
+        shared memory and their slots are released to writer on next read, writer waits for release up to
+        its max wait, ticks overwritten before being read are counted as overruns
+        :return: structured array of TICK_DTYPE, records support tick['last_price'] style access
+        """
+        # Release ticks of previous read
+        self.header[READ_SEQ] = read_seq = self.consumed
+        write_seq = int(self.header[WRITE_SEQ])
+        if write_seq == read_seq:
+            return self.slots[:0]
+        if write_seq - read_seq > self.capacity:
+            self.header[OVERRUNS] += write_seq - read_seq - self.capacity
+            read_seq = write_seq - self.capacity
+        start, end = read_seq % self.capacity, write_seq % self.capacity
+        if start < end:
+            ticks = self.slots[start:end]
+        else:
+            ticks = np.concatenate([self.slots[start:], self.slots[:end]])
+        # Drop ticks overwritten while reading
+        overwritten = int(self.header[CLAIM_SEQ]) - self.capacity - read_seq
+        if overwritten > 0:
+            self.header[OVERRUNS] += overwritten
+            ticks = ticks[overwritten:]
+        self.consumed = write_seq
+        return ticks
+
+    def empty(self) -> bool:
+        return self.header[WRITE_SEQ] == self.consumed
+
+    def stats(self) -> dict:
+        """
+        :return: dict of written, read, overrun and backpressure counts
+        """
+        return {'written': int(self.header[WRITE_SEQ]), 'read': int(self.header[READ_SEQ]),
+                'overruns': int(self.header[OVERRUNS]), 'backpressure': int(self.header[BACKPRESSURE])}
+
+    @staticmethod
+    def to_record(tick: dict) -> tuple:
+        """
+        :param tick: tick dict parsed by kite ticker
+        :return: tuple in TICK_DTYPE field order
+        """
+        ohlc = tick.get('ohlc') or {}
+        last_trade_time = tick.get('last_trade_time')
+        exchange_timestamp = tick.get('exchange_timestamp')
+        return (tick['instrument_token'], tick.get('last_price') or 0, tick.get('last_traded_quantity') or 0,
+                tick.get('average_traded_price') or 0, tick.get('volume_traded') or 0,
+                tick.get('total_buy_quantity') or 0, tick.get('total_sell_quantity') or 0,
+                ohlc.get('open') or 0, ohlc.get('high') or 0, ohlc.get('low') or 0, ohlc.get('close') or 0,
+                tick.get('oi') or 0, last_trade_time.timestamp() if last_trade_time else 0,
+                exchange_timestamp.timestamp() if exchange_timestamp else 0)
+
+    def close(self):
+        """
+        Detach shared memory and remove it if created by this process
+        """
+        del self.header, self.slots
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
@@ -0,0 +1,167 @@
+import time
+
+import numpy as np
+
+from trading_bot.scheduler import seconds_of_day
+from trading_bot.settings import TRAIL_SL_STEP_TICKS, TRAIL_SL_MIN_INTERVAL
+from trading_bot.trade_managers.opt_trade_manager import TradeState
+
+"""
+Exit evaluator to check exit and trailing sl conditions of all legs with arrays
+"""
+
+
+class ExitEvaluator:
+    def __init__(self, capacity: int = 64):
+        """
+        ExitEvaluator class to keep prices and exit parameters of trade manager instances in arrays indexed
+        by slot and find legs whose exit order needs an action for whole tick batch at once,
+        legs waiting for exit order without action are skipped instead of running their trade function
+        :param capacity: initial number of slots, arrays grow when full
+        """
+        self.managers = []
+        self.slots = dict()
+        self.symbol_slots = dict()
+        self.free = []
+        self.size = 0
+        self.used = np.zeros(capacity, dtype=bool)
+        self.token = np.zeros(capacity, dtype=np.int64)
+        self.start_price = np.full(capacity, np.nan)
+        self.sl = np.full(capacity, np.nan)
+        self.exit_price = np.full(capacity, np.nan)
+        self.sign = np.zeros(capacity)
+        self.tick_size = np.full(capacity, 0.05)
+        self.end_time = np.zeros(capacity)
+        self.modify_time = np.zeros(capacity)
+        self.trail = np.zeros(capacity, dtype=bool)
+        # Legs waiting for exit order, other states always run trade function
+        self.waiting = np.zeros(capacity, dtype=bool)
+        # Legs having order updates not processed yet
+        self.dirty = np.zeros(capacity, dtype=bool)
+
+    def grow(self):
+        """
+        Double capacity of arrays
+        """
+        for name in ['used', 'token', 'start_price', 'sl', 'exit_price', 'sign', 'tick_size', 'end_time',
+                     'modify_time', 'trail', 'waiting', 'dirty']:
+            array = getattr(self, name)
+            fill = np.nan if name in ['start_price', 'sl', 'exit_price'] else 0
+            setattr(self, name, np.concatenate([array, np.full(len(array), fill, dtype=array.dtype)]))
+
+    def sync(self, trade_managers: list):
+        """
+        Add new trade manager instances and release slots of removed instances
+        :param trade_managers: list of trade manager instances
+        """
+        for obj in trade_managers:
+            if obj not in self.slots:
+                self.add(obj)
+        if len(self.slots) != len(trade_managers):
+            current = set(trade_managers)
+            for obj in [obj for obj in self.slots if obj not in current]:
+                self.remove(obj)
+
+    def add(self, obj):
+        """
+        Assign slot to trade manager instance, its order updates are checked on first tick
+        :param obj: trade manager instance
+        """
+        if len(self.free):
+            slot = self.free.pop()
+        else:
+            if self.size == len(self.used):
+                self.grow()
+            slot = self.size
+            self.size += 1
+            self.managers.append(None)
+        self.managers[slot] = obj
+        self.slots[obj] = slot
+        self.symbol_slots.setdefault(obj.symbol, set()).add(slot)
+        self.used[slot] = True
+        self.dirty[slot] = True
+        self.update(obj)
+
+    def remove(self, obj):
+        """
+        Release slot of trade manager instance
+        :param obj: trade manager instance
+        """
+        slot = self.slots.pop(obj)
+        self.symbol_slots[obj.symbol].discard(slot)
+        if not len(self.symbol_slots[obj.symbol]):
+            del self.symbol_slots[obj.symbol]
+        self.managers[slot] = None
+        self.used[slot] = self.waiting[slot] = self.dirty[slot] = False
+        self.free.append(slot)
+
+    def update(self, obj):
+        """
+        Copy exit parameters of trade manager instance to arrays after its trade function ran,
+        slot is released if trade is ended
+        :param obj: trade manager instance
+        """
+        slot = self.slots.get(obj)
+        if slot is None:
+            return
+        if obj.trade_ended:
+            self.remove(obj)
+            return
+        self.token[slot] = obj.instrument_token
+        self.sign[slot] = 1 if obj.bought else -1
+        self.start_price[slot] = obj.start_price if obj.start_price is not None else np.nan
+        self.sl[slot] = obj.sl if obj.sl is not None else np.nan
+        self.exit_price[slot] = float(obj.exit_order_price) if obj.exit_order_price is not None else np.nan
+        self.tick_size[slot] = obj.tick_size
+        self.end_time[slot] = seconds_of_day(obj.end_time)
+        self.modify_time[slot] = obj.trail_sl_modify_time
+        self.trail[slot] = bool(obj.trail_sl)
+        self.waiting[slot] = obj.state is TradeState.EXIT_OPEN and not obj.force_exit
+
+    def invalidate(self):
+        """
+        Run trade function of all legs on their next tick i.e. after exit is forced
+        """
+        self.waiting[:] = False
+
+    def select(self, ticks: list, now, updated_symbols: set) -> list:
+        """
+        Evaluate exit and trailing sl conditions of all legs for tick batch
+        :param ticks: tick batch
+        :param now: time of tick batch
+        :param updated_symbols: symbols having order updates since last batch
+        :return: list of tuples of trade manager instance and its tick, for legs needing trade function
+        """
+        for symbol in updated_symbols:
+            for slot in self.symbol_slots.get(symbol, ()):
+                self.dirty[slot] = True
+        n = self.size
+        if not n or not len(ticks):
+            return []
+
+        # Latest tick of each instrument
+        latest = {tick['instrument_token']: tick for tick in ticks}
+        ticks = list(latest.values())
+        tokens = np.fromiter(latest.keys(), dtype=np.int64, count=len(latest))
+        prices = np.array([tick['last_price'] or np.nan for tick in ticks], dtype=float)
+        order = np.argsort(tokens)
+        pos = np.minimum(np.searchsorted(tokens[order], self.token[:n]), len(tokens) - 1)
+        tick_index = order[pos]
+        has_tick = self.used[:n] & (tokens[tick_index] == self.token[:n])
+        ltp = np.where(has_tick, prices[tick_index], np.nan)
+        has_tick &= ltp > 0
+
+        # Trailing sl moves by price gain from entry, modified only if trigger moves by trail step
+        # and last modification is old enough, same as trade manager
+        sign, tick_size = self.sign[:n], self.tick_size[:n]
+        favorable = sign * (ltp - self.start_price[:n]) > 0
+        price = np.round(np.round((self.sl[:n] + ltp - self.start_price[:n]) / tick_size) * tick_size, 2)
+        trail_due = self.trail[:n] & favorable & \
+            (np.abs(price - self.exit_price[:n]) >= tick_size * TRAIL_SL_STEP_TICKS - 1e-9) & \
+            (time.monotonic() - self.modify_time[:n] >= TRAIL_SL_MIN_INTERVAL)
+        exit_time_reached = seconds_of_day(now) > self.end_time[:n]
+
+        need = has_tick & (~self.waiting[:n] | self.dirty[:n] | exit_time_reached | trail_due)
+        slots = np.flatnonzero(need)
+        self.dirty[slots] = False
+        return [(self.managers[slot], ticks[tick_index[slot]]) for slot in slots]
@@ -0,0 +1,72 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from trading_bot.settings import logger
+
+"""
+Leg group to enter all legs of one strike selection together
+"""
+
+
+class LegGroup:
+    def __init__(self, underlying_symbol: str, trade_managers: list):
+        """
+        LegGroup class to place entry orders of all legs concurrently and track their fills
+        :param underlying_symbol: underlying symbol
+        :param trade_managers: list of trade manager instances of legs
+        """
+        self.underlying_symbol = underlying_symbol
+        self.trade_managers = trade_managers
+        self.order_times = dict()
+        self.fill_times = dict()
+        for obj in self.trade_managers:
+            obj.leg_group = self
+
+    def __repr__(self):
+        return f"<underlying: {self.underlying_symbol}, legs: {[obj.symbol for obj in self.trade_managers]}>"
+
+    def enter(self, client) -> list:
+        """
+        Get quotes of all legs in single request and place entry orders of all legs concurrently,
+        legs without quote wait for their first tick to enter
+        :param client: trading client
+        :return: list of tuples of trade manager instance and dict containing messages
+        """
+        keys = {f"{obj.exchange}:{obj.symbol}": obj for obj in self.trade_managers}
+        ltps = client.get_ltp(params=''.join([f"i={k}&" for k in keys]))
+        if ltps is None:
+            logger.debug(f'{self}: could not get quotes, legs will enter on ticks')
+            return []
+        legs = [(obj, ltps[k]['last_price']) for k, obj in keys.items() if k in ltps]
+        if not len(legs):
+            return []
+        with ThreadPoolExecutor(max_workers=len(legs)) as executor:
+            res = list(executor.map(self.enter_leg, legs))
+        if len(self.order_times) > 1:
+            skew = max(self.order_times.values()) - min(self.order_times.values())
+            logger.info(f'{self}: entry orders placed, order skew: {round(skew * 1000, 1)} ms')
+        return [(obj, r) for (obj, _), r in zip(legs, res)]
+
+    def enter_leg(self, args: tuple) -> dict:
+        """
+        Place entry order of leg
+        """
+        obj, ltp = args
+        res = obj.enter(ltp)
+        if obj.entered:
+            self.order_times[obj.symbol] = time.monotonic()
+        return res
+
+    def on_fill(self, obj):
+        """
+        Record fill of leg and report entry skew once all legs are filled
+        :param obj: trade manager instance of filled leg
+        """
+        self.fill_times[obj.symbol] = obj.entry_time
+        if len(self.fill_times) < len(self.trade_managers) or len(self.fill_times) < 2:
+            return
+        try:
+            skew = (max(self.fill_times.values()) - min(self.fill_times.values())).total_seconds()
+        except TypeError:  # Fill times with and without timezone
+            return
+        logger.info(f'{self}: all legs filled, entry skew: {round(skew * 1000, 1)} ms')
@@ -0,0 +1,130 @@
+from collections import defaultdict
+
+from trading_bot.settings import logger
+
+"""
+Mark to market engine to track live profit and loss of open legs
+"""
+
+
+class MtmEngine:
+    def __init__(self, max_loss: float = None, max_profit: float = None):
+        """
+        MtmEngine class to keep leg, underlying and portfolio profit and loss as running sums,
+        each tick only updates legs of its instrument and adds the change to running sums
+        :param max_loss: portfolio loss amount at which all positions must be exited
+        :param max_profit: portfolio profit amount at which all positions must be exited
+        """
+        self.max_loss = max_loss
+        self.max_profit = max_profit
+
+        # Variables for storing legs and running sums
+        self.legs = dict()
+        self.token_legs = defaultdict(dict)
+        self.underlying_pnl = defaultdict(float)
+        self.unrealized_pnl = 0.0
+        self.realized_pnl = 0.0
+        self.limit_reached = None
+
+    @property
+    def pnl(self) -> float:
+        return self.unrealized_pnl + self.realized_pnl
+
+    def open_leg(self, key: tuple, instrument_token: int, underlying_symbol: str, side: str, qty: int,
+                 entry_price: float):
+        """
+        Start tracking leg
+        :param key: unique key of leg i.e. symbol and entry order id
+        :param instrument_token: instrument token
+        :param underlying_symbol: underlying symbol
+        :param side: side i.e. BUY/SELL
+        :param qty: quantity
+        :param entry_price: entry price
+        """
+        if key in self.legs or entry_price is None:
+            return
+        leg = {'key': key, 'instrument_token': instrument_token, 'underlying_symbol': underlying_symbol,
+               'signed_qty': qty if side == 'BUY' else -qty, 'entry_price': float(entry_price),
+               'ltp': float(entry_price), 'pnl': 0.0}
+        self.legs[key] = leg
+        self.token_legs[instrument_token][key] = leg
+
+    def close_leg(self, key: tuple, exit_price: float = None):
+        """
+        Stop tracking leg and move its profit and loss to realized
+        :param key: unique key of leg
+        :param exit_price: exit price, leg is removed without realizing profit and loss if None
+        """
+        leg = self.legs.pop(key, None)
+        if leg is None:
+            return
+        del self.token_legs[leg['instrument_token']][key]
+        if not len(self.token_legs[leg['instrument_token']]):
+            del self.token_legs[leg['instrument_token']]
+        self.unrealized_pnl -= leg['pnl']
+        self.underlying_pnl[leg['underlying_symbol']] -= leg['pnl']
+        if exit_price is not None:
+            realized = leg['signed_qty'] * (float(exit_price) - leg['entry_price'])
+            self.realized_pnl += realized
+            self.underlying_pnl[leg['underlying_symbol']] += realized
+
+    def get_state(self) -> dict:
+        """
+        :return: dict of legs and realized profit and loss to checkpoint engine, legs are copied
+        """
+        return {'legs': {key: dict(leg) for key, leg in self.legs.items()}, 'realized_pnl': self.realized_pnl,
+                'underlying_pnl': dict(self.underlying_pnl), 'limit_reached': self.limit_reached}
+
+    def restore(self, state: dict):
+        """
+        Restore legs and running sums from checkpoint
+        :param state: dict returned by get_state
+        """
+        self.legs = state['legs']
+        self.token_legs = defaultdict(dict)
+        for key, leg in self.legs.items():
+            self.token_legs[leg['instrument_token']][key] = leg
+        self.unrealized_pnl = sum(leg['pnl'] for leg in self.legs.values())
+        self.realized_pnl = state['realized_pnl']
+        self.underlying_pnl = defaultdict(float, state['underlying_pnl'])
+        self.limit_reached = state['limit_reached']
+
+    def on_tick(self, tick: dict):
+        """
+        Update profit and loss of legs for tick's instrument
+        :param tick: tick data
+        """
+        legs = self.token_legs.get(tick['instrument_token'])
+        ltp = tick['last_price']
+        if not legs or not ltp:
+            return
+        for leg in legs.values():
+            change = leg['signed_qty'] * (ltp - leg['ltp'])
+            leg['ltp'] = ltp
+            leg['pnl'] += change
+            self.unrealized_pnl += change
+            self.underlying_pnl[leg['underlying_symbol']] += change
+
+    def check_limits(self):
+        """
+        :return: limit name if portfolio profit or loss limit reached first time else None
+        """
+        if self.limit_reached is not None:
+            return
+        pnl = self.pnl
+        if self.max_loss is not None and pnl <= -abs(self.max_loss):
+            self.limit_reached = 'max_loss'
+        elif self.max_profit is not None and pnl >= self.max_profit:
+            self.limit_reached = 'max_profit'
+        else:
+            return
+        logger.info(f'Portfolio {self.limit_reached} reached, pnl: {round(pnl, 2)}, exiting all positions')
+        return self.limit_reached
+
+    def summary(self) -> str:
+        """
+        :return: profit and loss summary
+        """
+        underlyings = ', '.join(f'{u}: {round(p, 2)}' for u, p in self.underlying_pnl.items())
+        return f'MTM pnl: {round(self.pnl, 2)}, realized: {round(self.realized_pnl, 2)}, ' \
+               f'unrealized: {round(self.unrealized_pnl, 2)}, open legs: {len(self.legs)}, {underlyings}'
@@ -1,20 +1,43 @@
+import time
 from datetime import datetime
+from enum import IntEnum
 
 from dateutil.parser import parse
 
-from trading_bot.settings import logger, TZ
+from trading_bot.settings import logger, TZ, TRAIL_SL_STEP_TICKS, TRAIL_SL_MIN_INTERVAL
 
 """
 Trade manager to handle order and trading related functions
 """
 
 
+class TradeState(IntEnum):
+    """
+    States of trade, states only move forward except EXIT_OPEN moves back to POSITION_OPEN
+    if exit order gets rejected or cancelled
+    """
+    PENDING_ENTRY = 0
+    ENTRY_OPEN = 1
+    POSITION_OPEN = 2
+    EXIT_OPEN = 3
+    DONE = 4
+
+
 class OptTradeManager:
+    __slots__ = ('symbol', 'exchange', 'instrument_token', 'underlying_symbol', 'client', 'lots', 'lot_size',
+                 'direction', 'stop_loss', 'end_time', 'trail_sl', 'variety', 'product', 'ltp', 'ltp_time', 'side',
+                 'instruction', 'qty', 'bought', 'sold', 'sl', 'entry_order_time', 'entry_order_type',
+                 'entry_order_price', 'entry_order_id', 'entry_order_status', 'entry_time', 'entry_price',
+                 'position_status', 'exit_order_type', 'exit_order_time', 'exit_order_price', 'exit_order_id',
+                 'exit_order_status', 'exit_type', 'exit_time', 'exit_price', 'start_price', 'final_sl',
+                 'force_exit', 'tick_size', 'trail_sl_modified', 'trail_sl_skipped', 'trail_sl_modify_time',
+                 'leg_group', 'messages', 'state', 'now')
+
     def __init__(self, symbol, instrument_token, exchange, underlying_symbol, client, lot_size, lots, direction,
                  stop_loss, end_time, trail_sl, side=None, instruction=None, entered=False, entry_order_filled=False,
                  entry_order_status=None, entry_order_price=None, entry_order_id=None, bought=False, sold=False,
                  qty=None, sl=None, exit_order_id=None, exit_order_status=None, exit_order_price=None,
-                 exit_pending=False, final_sl=None):
+                 exit_pending=False, final_sl=None, entry_price=None, tick_size=0.05):
         """
         OptTradeManager class to handle trading operations
 
@@ -30,6 +53,9 @@ class OptTradeManager:
         :param stop_loss: stop loss
         :param end_time: end time
         :param trail_sl: to specify trail sl or not
+
+        Optional parameters
+        :param tick_size: tick size of instrument, order prices are rounded to it
         """
         self.symbol = symbol
         self.exchange = exchange
@@ -49,7 +75,6 @@ class OptTradeManager:
         self.side = side
         self.instruction = instruction
         self.qty = qty
-        self.entered = entered
         self.bought = bought
         self.sold = sold
         self.sl = sl
@@ -58,9 +83,8 @@ class OptTradeManager:
         self.entry_order_price = entry_order_price
         self.entry_order_id = entry_order_id
         self.entry_order_status = entry_order_status
-        self.entry_order_filled = entry_order_filled
         self.entry_time = None
-        self.entry_price = None
+        self.entry_price = entry_price
         self.position_status = None
         self.exit_order_type = 'SL'
         self.exit_order_time = None
@@ -70,27 +94,84 @@ class OptTradeManager:
         self.exit_type = None
         self.exit_time = None
         self.exit_price = None
-        self.exit_pending = exit_pending
-        self.trade_ended = False
-        self.start_price = None
+        self.start_price = entry_price
         self.final_sl = final_sl
+        self.force_exit = False
+        self.tick_size = tick_size
+        self.trail_sl_modified = 0
+        self.trail_sl_skipped = 0
+        self.trail_sl_modify_time = 0.0
+        self.leg_group = None
         self.messages = []
-        logger.debug(f"""Trading instance created, symbol: {self.symbol}, exchange: {self.exchange}, 
-                         instrument_token: {self.instrument_token}, lot_size: {self.lot_size}, lots: {self.lots},
-                         underlying: {self.underlying_symbol}, end_time: {self.end_time}, stop_loss: {self.stop_loss}, 
-                         end_time: {self.end_time}, trail_sl: {self.trail_sl}, direction: {self.direction}""")
+        self.now = None
+        if not entered:
+            self.state = TradeState.PENDING_ENTRY
+        elif not entry_order_filled:
+            self.state = TradeState.ENTRY_OPEN
+        elif exit_pending:
+            self.state = TradeState.EXIT_OPEN
+        else:
+            self.state = TradeState.POSITION_OPEN
+        logger.debug('Trading instance created, symbol: %s, exchange: %s, instrument_token: %s, lot_size: %s, '
+                     'lots: %s, underlying: %s, end_time: %s, stop_loss: %s, trail_sl: %s, direction: %s',
+                     self.symbol, self.exchange, self.instrument_token, self.lot_size, self.lots,
+                     self.underlying_symbol, self.end_time, self.stop_loss, self.trail_sl, self.direction)
 
     def __repr__(self):
         return f"<symbol: {self.symbol}, exchange: {self.exchange}, instrument_token: {self.instrument_token}>"
 
-    def trade(self, tick: dict, order_data: dict):
+    # Attributes not stored in checkpoint, client is set again and leg group is not restored,
+    # trail sl modify time is monotonic clock value which is meaningless after restart
+    transient = ('client', 'leg_group', 'messages', 'trail_sl_modify_time')
+
+    def get_state(self) -> dict:
+        """
+        :return: dict of attributes to checkpoint instance
+        """
+        return {k: getattr(self, k) for k in self.__slots__ if k not in self.transient}
+
+    @classmethod
+    def from_state(cls, state: dict, client):
+        """
+        Create instance from checkpoint
+        :param state: dict of attributes returned by get_state
+        :param client: trading client
+        :return: trade manager instance
+        """
+        obj = cls.__new__(cls)
+        for k, v in state.items():
+            setattr(obj, k, v)
+        obj.client = client
+        obj.leg_group = None
+        obj.messages = []
+        obj.trail_sl_modify_time = 0.0
+        return obj
+
+    @property
+    def entered(self) -> bool:
+        return TradeState.ENTRY_OPEN <= self.state <= TradeState.EXIT_OPEN
+
+    @property
+    def entry_order_filled(self) -> bool:
+        return TradeState.POSITION_OPEN <= self.state <= TradeState.EXIT_OPEN
+
+    @property
+    def exit_pending(self) -> bool:
+        return self.state is TradeState.EXIT_OPEN
+
+    @property
+    def trade_ended(self) -> bool:
+        return self.state is TradeState.DONE
+
+    def trade(self, tick: dict, order_data: dict, now: datetime = None):
         """
         :param tick: tick data
         :param order_data: order data
+        :param now: current time shared by tick batch, fetched if None
         :return: self or dict containing messages
         """
         # Return if trade is ended
-        if self.trade_ended:
+        if self.state is TradeState.DONE:
             return self
 
         # Set ltp and ltp_time
@@ -99,46 +180,153 @@ class OptTradeManager:
         if not self.ltp or not self.ltp_time:
             return
 
-        # Variable to store messages
+        self.now = now if now is not None else datetime.now(tz=TZ)
+        # Variable to store messages, reused if previous tick produced none
+        if self.messages:
+            self.messages = []
+
+        # Run handler of current state, if state moves forward then run handler of new state in same tick
+        last_state = -1
+        while last_state < self.state < TradeState.DONE:
+            last_state = self.state
+            self.handlers[self.state](self, order_data)
+
+        return {'msg': self.messages}
+
+    def enter(self, ltp: float, now: datetime = None) -> dict:
+        """
+        Take entry at given price without waiting for tick
+        :param ltp: last traded price
+        :param now: current time, fetched if None
+        :return: dict containing messages
+        """
+        self.ltp = ltp
+        self.now = now if now is not None else datetime.now(tz=TZ)
         self.messages = []
+        if self.state is TradeState.PENDING_ENTRY:
+            self.on_pending_entry(None)
+        return {'msg': self.messages}
 
-        if self.is_valid_entry():  # If entry conditions match then take entry
-            self.make_entry()
+    def flatten(self, now: datetime = None) -> dict:
+        """
+        Exit immediately without waiting for tick, instance waiting for entry is closed, open entry order
+        is cancelled, open position is exited with market order and exit order is modified to market
+        :param now: current time, fetched if None
+        :return: dict containing messages
+        """
+        self.force_exit = True
+        self.now = now if now is not None else datetime.now(tz=TZ)
+        self.messages = []
+        if self.state is TradeState.PENDING_ENTRY:
+            logger.debug('%s: flattened before entry, closing instance', self.symbol)
+            self.state = TradeState.DONE
+        elif self.state is TradeState.ENTRY_OPEN:
+            # Instance is closed when cancellation is confirmed, exited again if entry got filled meanwhile
+            order_id = self.client.cancel_order(variety=self.variety, order_id=self.entry_order_id)
+            logger.debug('%s: entry order cancel requested, order id: %s', self.symbol, order_id)
+        elif self.state is TradeState.POSITION_OPEN:
+            self.instruction = 'SELL' if self.bought else 'BUY'
+            order_id = self.client.place_order(tradingsymbol=self.symbol, exchange=self.exchange,
+                                               variety=self.variety, transaction_type=self.instruction,
+                                               quantity=self.qty, order_type='MARKET', product=self.product,
+                                               tag='algo_order')
+            if order_id is None:
+                logger.debug('%s: Error placing flatten exit order', self.symbol)
+                return {'msg': self.messages}
+            self.exit_order_id = order_id
+            self.state = TradeState.EXIT_OPEN
+            self.exit_order_time = self.now
+            self.exit_order_status = 'OPEN'
+            logger.debug('Flatten exit order placed to %s %s, qty: %s, order id:%s', self.instruction, self.symbol,
+                         self.qty, self.exit_order_id)
+            self.messages.append(self.save_trade(action='make_exit'))
+        elif self.state is TradeState.EXIT_OPEN:
+            self.modify_exit(modify_reason='exit_time_reached')
+        return {'msg': self.messages}
+
+    def on_end_time(self, now: datetime = None) -> dict:
+        """
+        Modify exit order to market when end time is reached without waiting for tick
+        :param now: current time, fetched if None
+        :return: dict containing messages
+        """
+        self.now = now if now is not None else datetime.now(tz=TZ)
+        self.messages = []
+        if self.state is TradeState.EXIT_OPEN:
+            self.modify_exit(modify_reason='exit_time_reached')
+        return {'msg': self.messages}
 
-        if self.entered and not self.entry_order_filled:  # If entry order open then wait until it's complete
+    def on_orders(self, order_data: dict, now: datetime = None) -> dict:
+        """
+        Confirm open entry or exit order from order updates without waiting for tick
+        :param order_data: order data
+        :param now: current time, fetched if None
+        :return: dict containing messages
+        """
+        self.now = now if now is not None else datetime.now(tz=TZ)
+        self.messages = []
+        if self.state is TradeState.ENTRY_OPEN:
             self.confirm_entry(orders_data=order_data)
+        elif self.state is TradeState.EXIT_OPEN:
+            self.confirm_exit(orders_data=order_data)
+        return {'msg': self.messages}
 
-        if self.is_valid_exit():  # If exit conditions match then take exit
-            self.make_exit()
+    def on_pending_entry(self, order_data: dict):
+        """
+        If entry conditions match then take entry
+        """
+        if self.is_valid_entry():
+            self.make_entry()
 
-        if self.entered and self.exit_pending:  # If exit order open then wait until it's complete
-            self.confirm_exit(orders_data=order_data)
-            if self.entered and self.exit_pending:
-                # If end time is reached or trail sl set to true then check for order modification
-                # and confirm exit again after that
-                if datetime.now(tz=TZ).time() > self.end_time or self.trail_sl:
-                    modify_reason = 'exit_time_reached' if datetime.now(tz=TZ).time() > self.end_time else 'trail_sl'
-                    self.modify_exit(modify_reason=modify_reason)
-                    self.confirm_exit(orders_data=order_data)
+    def on_entry_open(self, order_data: dict):
+        """
+        If entry order open then wait until it's complete
+        """
+        self.confirm_entry(orders_data=order_data)
 
-        return {'msg': self.messages}
+    def on_position_open(self, order_data: dict):
+        """
+        If exit conditions match then take exit
+        """
+        if self.is_valid_exit():
+            self.make_exit()
+
+    def on_exit_open(self, order_data: dict):
+        """
+        If exit order open then wait until it's complete
+        """
+        self.confirm_exit(orders_data=order_data)
+        if self.state is TradeState.EXIT_OPEN:
+            # If end time is reached, exit is forced or trail sl set to true then check for order modification
+            # and confirm exit again after that
+            exit_time_reached = self.force_exit or self.now.time() > self.end_time
+            if exit_time_reached or self.trail_sl:
+                modify_reason = 'exit_time_reached' if exit_time_reached else 'trail_sl'
+                self.modify_exit(modify_reason=modify_reason)
+                self.confirm_exit(orders_data=order_data)
 
     def is_valid_entry(self):
         """
         Check entry conditions
         """
         # If not already entered
-        if self.entered:
+        if self.state is not TradeState.PENDING_ENTRY:
+            return
+
+        # If exit is forced then close instance without entry
+        if self.force_exit:
+            logger.debug('%s: exit forced before entry, closing instance', self.symbol)
+            self.state = TradeState.DONE
             return
 
         # Based on direction specified set instruction take entry
         if self.direction == 'LONG':
-            logger.info(f'Long signal generated for {self.symbol} at {datetime.now(tz=TZ)}, price: {self.ltp}')
+            logger.info('Long signal generated for %s at %s, price: %s', self.symbol, self.now, self.ltp)
             self.bought = True
             self.instruction = 'BUY'
             return True
         if self.direction == 'SHORT':
-            logger.info(f'Short signal generated for {self.symbol} at {datetime.now(tz=TZ)}, price: {self.ltp}')
+            logger.info('Short signal generated for %s at %s, price: %s', self.symbol, self.now, self.ltp)
             self.sold = True
             self.instruction = 'SELL'
             return True
@@ -147,12 +335,12 @@ class OptTradeManager:
         """
         Check exit conditions
         """
-        if not self.entered or not self.entry_order_filled or self.exit_pending:
+        if self.state is not TradeState.POSITION_OPEN:
             return False
 
         positions = self.client.get_positions()
         if not positions:
-            logger.debug(f'{self.symbol}: error retrieving positions')
+            logger.debug('%s: error retrieving positions', self.symbol)
             return
 
         close_entry_in_db = False
@@ -165,7 +353,7 @@ class OptTradeManager:
                     return True
             else:
                 close_entry_in_db = True
-                logger.debug(f'{self.symbol} No long position exist for qty: {self.qty}, closing instance')
+                logger.debug('%s No long position exist for qty: %s, closing instance', self.symbol, self.qty)
 
         elif self.sold:
             for p in positions:
@@ -174,16 +362,16 @@ class OptTradeManager:
                     return True
             else:
                 close_entry_in_db = True
-                logger.debug(f'{self.symbol} No short position exist for qty: {self.qty}, closing instance')
+                logger.debug('%s No short position exist for qty: %s, closing instance', self.symbol, self.qty)
 
         # If no open positions exist for exit then close trade in db
         if close_entry_in_db:
             self.exit_type, self.exit_time, self.exit_price = None, None, None
             self.exit_order_status, self.position_status = None, None
-            self.entered, self.bought, self.sold, self.exit_pending = False, False, False, False
+            self.bought, self.sold = False, False
+            self.state = TradeState.DONE
             confirm_exit_data = self.save_trade(action='confirm_exit')
             self.messages.append(confirm_exit_data)
-            self.trade_ended = True
 
     def make_entry(self):
         """
@@ -193,8 +381,8 @@ class OptTradeManager:
         price = float("{:0.1f}".format(self.ltp))
         self.qty = int(self.lots * self.lot_size)
         if self.qty <= 0:
-            logger.debug(f'{self.symbol}, closing instance, qty less than or equal to 0')
-            self.trade_ended = True
+            logger.debug('%s, closing instance, qty less than or equal to 0', self.symbol)
+            self.state = TradeState.DONE
             return
 
         # Place order
@@ -205,20 +393,18 @@ class OptTradeManager:
 
         # If error in placing order then close instance
         if order_id is None:
-            logger.debug(f'{self.symbol}: Error placing entry order, Closing instance')
-            self.trade_ended = True
+            logger.debug('%s: Error placing entry order, Closing instance', self.symbol)
+            self.state = TradeState.DONE
             return
         # If error placed successfully then set order details
         self.entry_order_id = order_id
         self.entry_order_price = price
-        self.entered = True
-        self.entry_order_filled = False
-        self.entry_order_time = datetime.now(tz=TZ)
+        self.state = TradeState.ENTRY_OPEN
+        self.entry_order_time = self.now
         self.entry_order_status = 'OPEN'
         self.side = self.instruction
-        logger.debug(
-            f"""Entry order placed to {self.instruction} {self.symbol}, qty: {self.qty}, price: {price}, 
-                time: {self.entry_order_time}, order id:{self.entry_order_id}""")
+        logger.debug('Entry order placed to %s %s, qty: %s, price: %s, time: %s, order id:%s', self.instruction,
+                     self.symbol, self.qty, price, self.entry_order_time, self.entry_order_id)
         entry_data = self.save_trade(action='make_entry')
         self.messages.append(entry_data)
 
@@ -231,15 +417,18 @@ class OptTradeManager:
         if orders_data is None:
             orders_data = self.client.get_orders() if not self.client.all_orders else self.client.all_orders
             if orders_data is None:
-                logger.debug(f'{self.symbol}:Error retrieving order')
+                logger.debug('%s:Error retrieving order', self.symbol)
                 return
         for o in orders_data:
+            # Entry cancelled by flatten after partial fill leaves filled quantity open, it is exited by flatten
+            partly_filled = o['order_id'] == self.entry_order_id and o['status'] == 'CANCELLED' and \
+                self.force_exit and (o.get('filled_quantity') or 0) > 0
             # If order rejected or cancelled then close instance
-            if o['order_id'] == self.entry_order_id and o['status'] in ['REJECTED', 'CANCELLED']:
-                logger.debug(f"Entry Order Got {o['status']} in {self.symbol}, Reason: {o.get('status_message')}, "
-                             f"closing instance")
-                self.trade_ended = True
-                self.entered = False
+            if o['order_id'] == self.entry_order_id and o['status'] in ['REJECTED', 'CANCELLED'] and \
+                    not partly_filled:
+                logger.debug('Entry Order Got %s in %s, Reason: %s, closing instance', o['status'], self.symbol,
+                             o.get('status_message'))
+                self.state = TradeState.DONE
                 self.bought, self.sold = False, False
                 self.entry_time = None
                 self.entry_price = None
@@ -250,22 +439,25 @@ class OptTradeManager:
                 return
 
             # If order complete then set order + sl details
-            if o['order_id'] == self.entry_order_id and o['status'] == 'COMPLETE':
-                self.entry_order_filled = True
+            if o['order_id'] == self.entry_order_id and (o['status'] == 'COMPLETE' or partly_filled):
+                if partly_filled:
+                    logger.debug('%s: entry order cancelled after partial fill, filled qty: %s of %s', self.symbol,
+                                 o['filled_quantity'], self.qty)
+                    self.qty = o['filled_quantity']
+                self.state = TradeState.POSITION_OPEN
                 self.entry_order_status = o['status']
                 self.entry_price = o['average_price']
                 self.start_price = self.entry_price
-                self.entry_time = parse(o['order_timestamp']) if 'order_timestamp' in o else datetime.now(tz=TZ)
+                self.entry_time = parse(o['order_timestamp']) if 'order_timestamp' in o else self.now
                 self.position_status = 'OPEN'
                 if self.bought:
                     self.sl = self.entry_price * (1 - (self.stop_loss / 100))
                 else:
                     self.sl = self.entry_price * (1 + (self.stop_loss / 100))
                 self.final_sl = self.sl
-                logger.debug(
-                    f"""Entry order Filled to {self.instruction} {self.symbol}, qty: {self.qty}, 
-                        price: {self.entry_price}, time: {self.entry_time}, order_id:{self.entry_order_id}, 
-                        SL set to {self.sl}""")
+                logger.debug('Entry order Filled to %s %s, qty: %s, price: %s, time: %s, order_id:%s, SL set to %s',
+                             self.instruction, self.symbol, self.qty, self.entry_price, self.entry_time,
+                             self.entry_order_id, self.sl)
                 entry_data = self.save_trade(action='confirm_entry')
                 self.messages.append(entry_data)
                 return
@@ -275,25 +467,24 @@ class OptTradeManager:
         Make exit
         """
         # Set price
-        price = float("{:0.1f}".format(self.sl))
+        price = self.round_to_tick(self.sl)
         order_id = self.client.place_order(tradingsymbol=self.symbol, exchange=self.exchange,
                                            variety=self.variety, transaction_type=self.instruction,
                                            quantity=self.qty, order_type=self.exit_order_type,
                                            product=self.product, tag='algo_order', price=price, trigger_price=price)
         if order_id is None:  # If error in placing order
-            logger.debug(f'{self.symbol}: Error placing exit order')
+            logger.debug('%s: Error placing exit order', self.symbol)
             return
 
         # If error placed successfully then set order details
         self.exit_order_id = order_id
-        self.exit_pending = True
-        self.exit_order_time = datetime.now(tz=TZ)
+        self.state = TradeState.EXIT_OPEN
+        self.exit_order_time = self.now
         self.exit_order_price = price
         self.exit_order_status = 'OPEN'
         self.position_status = 'OPEN'
-        logger.debug(
-            f"""Exit order placed to {self.instruction} {self.symbol}, qty: {self.qty}, sl trigger price: {price}, 
-                time: {self.exit_order_time}, order id:{self.exit_order_id}""")
+        logger.debug('Exit order placed to %s %s, qty: %s, sl trigger price: %s, time: %s, order id:%s',
+                     self.instruction, self.symbol, self.qty, price, self.exit_order_time, self.exit_order_id)
         exit_data = self.save_trade(action='make_exit')
         self.messages.append(exit_data)
 
@@ -308,20 +499,28 @@ class OptTradeManager:
             if (self.bought and self.ltp > self.start_price) or (self.sold and self.ltp < self.start_price):
                 prev_sl = self.final_sl
                 if self.bought:
-                    self.final_sl = self.sl + (self.ltp - self.start_price)
+                    final_sl = self.sl + (self.ltp - self.start_price)
                 else:
-                    self.final_sl = self.sl - (self.start_price - self.ltp)
-                self.exit_order_price = float("{:0.1f}".format(self.final_sl))
+                    final_sl = self.sl - (self.start_price - self.ltp)
+                price = self.round_to_tick(final_sl)
+                # Skip modification if trigger not moved by trail step or order modified recently,
+                # skipped moves are coalesced into next modification
+                if abs(price - float(self.exit_order_price)) < self.tick_size * TRAIL_SL_STEP_TICKS - 1e-9 or \
+                        time.monotonic() - self.trail_sl_modify_time < TRAIL_SL_MIN_INTERVAL:
+                    self.trail_sl_skipped += 1
+                    return
                 order_id = self.client.modify_order(variety=self.variety, order_id=self.exit_order_id,
-                                                    price=self.exit_order_price, trigger_price=self.exit_order_price)
+                                                    price=price, trigger_price=price)
                 if not order_id:  # If error in modifying order
                     return
+                self.final_sl = final_sl
+                self.exit_order_price = price
+                self.trail_sl_modified += 1
+                self.trail_sl_modify_time = time.monotonic()
 
                 # If order modified successfully
-                logger.debug(
-                    f'{self.symbol}: Exit {self.instruction} SL order price'
-                    f' successfully modified from {prev_sl} to to {self.exit_order_price}, '
-                    f' order id: {self.exit_order_id}')
+                logger.debug('%s: Exit %s SL order price successfully modified from %s to to %s, order id: %s',
+                             self.symbol, self.instruction, prev_sl, self.exit_order_price, self.exit_order_id)
                 entry_data = self.save_trade(action='modify_exit')
                 self.messages.append(entry_data)
             return
@@ -330,8 +529,7 @@ class OptTradeManager:
         order_id = self.client.modify_order(variety=self.variety, order_id=self.exit_order_id, order_type='MARKET')
         if not order_id:  # If error in modifying order
             return
-        logger.debug(f'{self.symbol}: exit time reached to exit order type modified to market, '
-                     f'order id: {order_id}')
+        logger.debug('%s: exit time reached to exit order type modified to market, order id: %s', self.symbol, order_id)
 
     def confirm_exit(self, orders_data: dict = None):
         """
@@ -342,36 +540,42 @@ class OptTradeManager:
         if orders_data is None:
             orders_data = self.client.get_orders() if not self.client.all_orders else self.client.all_orders
             if orders_data is None:
-                logger.debug(f'{self.symbol}:Error retrieving order')
+                logger.debug('%s:Error retrieving order', self.symbol)
                 return
         for o in orders_data:
             # If order rejected or cancelled then place again
             if o['order_id'] == self.exit_order_id and o['status'] in ['REJECTED', 'CANCELLED']:
-                logger.debug(f"Exit Order Got {o['status']} in {self.symbol}, Reason: {o.get('status_message')}")
-                self.exit_pending = False
+                logger.debug('Exit Order Got %s in %s, Reason: %s', o['status'], self.symbol, o.get('status_message'))
+                self.state = TradeState.POSITION_OPEN
                 return
 
             # If order complete then set order+position details and close instance
             if o['order_id'] == self.exit_order_id and o['status'] == 'COMPLETE':
-                self.exit_pending = False
+                self.state = TradeState.DONE
                 self.exit_order_status = o['status']
                 self.exit_price = o['average_price']
-                self.exit_time = parse(o['order_timestamp']) if 'order_timestamp' in o else datetime.now(tz=TZ)
+                self.exit_time = parse(o['order_timestamp']) if 'order_timestamp' in o else self.now
                 self.exit_type = 'SL'
                 self.position_status = 'CLOSED'
                 self.bought, self.sold = False, False
-                self.entered = False
-                self.exit_pending = False
-                logger.debug(
-                    f"""Exit order Filled to {self.instruction} {self.symbol}, qty: {self.qty}, 
-                        price: {self.exit_price}, time: {self.exit_time}, order_id:{self.exit_order_id}""")
+                logger.debug('Exit order Filled to %s %s, qty: %s, price: %s, time: %s, order_id:%s', self.instruction,
+                             self.symbol, self.qty, self.exit_price, self.exit_time, self.exit_order_id)
                 exit_data = self.save_trade(action='confirm_exit')
                 self.messages.append(exit_data)
 
-                self.trade_ended = True
-                logger.debug(f'{self.symbol} Trade completed, closing instance')
+                logger.debug('%s Trade completed, closing instance', self.symbol)
+                if self.trail_sl:
+                    logger.debug('%s: trailing sl modifications: %s, skipped: %s', self.symbol, self.trail_sl_modified,
+                                 self.trail_sl_skipped)
                 return
 
+    def round_to_tick(self, price: float) -> float:
+        """
+        :param price: price
+        :return: price rounded to nearest multiple of tick size
+        """
+        return round(round(price / self.tick_size) * self.tick_size, 2)
+
     def save_trade(self, action: str) -> dict:
         """
         :param action: state of trade, i.e. make_entry, make_exit etc
@@ -386,13 +590,13 @@ class OptTradeManager:
                                'direction': self.direction, 'underlying_symbol': self.underlying_symbol,
                                'end_time': self.end_time, 'lots': self.lots, 'lot_size': self.lot_size,
                                'stop_loss_percent': self.stop_loss, 'instrument_token': self.instrument_token,
-                               'trail_sl': self.trail_sl}
+                               'trail_sl': self.trail_sl, 'user_id': self.client.user_id}
             return message
         elif action == 'confirm_entry':
             message[action] = {'symbol': self.symbol, 'entry_order_id': self.entry_order_id,
                                'entry_order_status': self.entry_order_status, 'entry_time': self.entry_time,
                                'entry_price': self.entry_price, 'stop_loss': self.sl,
-                               'position_status': self.position_status}
+                               'position_status': self.position_status, 'quantity': self.qty}
             return message
         elif action == 'make_exit':
             message[action] = {'symbol': self.symbol, 'entry_order_id': self.entry_order_id,
@@ -411,3 +615,7 @@ class OptTradeManager:
                                'exit_price': self.exit_price, 'exit_type': self.exit_type,
                                'exit_order_status': self.exit_order_status}
             return message
+
+    # State handlers for dispatch in trade
+    handlers = {TradeState.PENDING_ENTRY: on_pending_entry, TradeState.ENTRY_OPEN: on_entry_open,
+                TradeState.POSITION_OPEN: on_position_open, TradeState.EXIT_OPEN: on_exit_open}